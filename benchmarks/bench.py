@@ -0,0 +1,419 @@
+"""Benchmarks of the piter hot paths.
+
+Builds synthetic underfolders (JPEG/PNG images plus YAML metadata) and times the
+report commands, the image encoding functions and the template rendering. Each
+case runs in a fresh process, so that its peak memory can be measured, and the
+results are written to a JSON file that can be compared with a previous run:
+
+    python benchmarks/bench.py run --output results.json
+    python benchmarks/bench.py run --sizes 1000 --baseline results.json
+
+The datasets are cached in `--data-dir` across runs. By default the sizes are
+swept at the first resolution and the resolutions at the first size.
+
+The startup cases time `piter --help` and a single `piter image2base64` in fresh
+interpreters, `--startup-budget` fails the run if any of them is slower.
+"""
+
+import json
+import os
+import pathlib as pl
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+
+import typer
+
+bench = typer.Typer(name="bench", pretty_exceptions_enable=False, no_args_is_help=True)
+
+
+def _rss_mb(children: bool = False) -> float:
+    """The peak RSS in MB of this process, or of its terminated children.
+
+    `resource` is Unix only, elsewhere the peak of this process is read from
+    psutil if installed, the one of the children is not known (0).
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return 0.0
+        if children:
+            return 0.0
+        info = psutil.Process().memory_info()
+        # the peak working set on Windows, the current RSS elsewhere
+        return getattr(info, "peak_wset", info.rss) / (1 << 20)
+
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _pattern(width: int, height: int):
+    import numpy as np
+
+    # smooth content with some noise, so that PNG compresses like real images do
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack(
+        [
+            127 + 127 * np.sin(x / 23.0 + y / 41.0),
+            127 + 127 * np.cos(y / 17.0),
+            127 + 127 * np.sin((x + y) / 31.0),
+        ],
+        axis=-1,
+    )
+    noise = np.random.default_rng(0).integers(0, 16, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def make_underfolder(
+    root: t.Union[str, pl.Path],
+    size: int,
+    resolution: t.Tuple[int, int],
+    png_ratio: float = 0.25,
+    clusters: int = 10,
+) -> pl.Path:
+    """Writes a synthetic underfolder, unless already complete.
+
+    Samples have an `image` (PNG for a `png_ratio` fraction of them, else JPEG)
+    and a `metadata` YAML with a cluster label and a score. Images are distinct
+    shifts of a common pattern.
+    """
+    import numpy as np
+    from PIL import Image
+
+    root = pl.Path(root)
+    done = root / ".complete"
+    if done.exists():
+        return root
+
+    data = root / "data"
+    data.mkdir(parents=True, exist_ok=True)
+    width, height = resolution
+    pattern = _pattern(width, height)
+    rng = np.random.default_rng(size)
+    png_every = round(1 / png_ratio) if png_ratio > 0 else 0
+    for index in range(size):
+        shifted = np.roll(pattern, (index * 7 % height, index * 13 % width), (0, 1))
+        image = Image.fromarray(shifted)
+        if png_every and index % png_every == 0:
+            image.save(data / f"{index:06d}_image.png", compress_level=1)
+        else:
+            image.save(data / f"{index:06d}_image.jpg", quality=90)
+        (data / f"{index:06d}_metadata.yaml").write_text(
+            f"cluster: {index % clusters}\nscore: {rng.random():.6f}\n"
+        )
+    done.touch()
+    return root
+
+
+def _dataset(data_dir: str, size: int, resolution: t.Tuple[int, int]) -> pl.Path:
+    width, height = resolution
+    return make_underfolder(
+        pl.Path(data_dir) / f"underfolder_{size}_{width}x{height}", size, resolution
+    )
+
+
+def _case_cli(params: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    from piter.cli.cli import piter
+
+    # the commands import these lazily, their import time is not measured
+    import pipelime.items  # noqa: F401
+    import pipelime.sequences  # noqa: F401
+    import pipelime.stages  # noqa: F401
+    import rich.progress  # noqa: F401
+
+    folder = _dataset(params["data_dir"], params["size"], params["resolution"])
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = pl.Path(tmp) / "report.html"
+        args = [params["command"], "--folder", str(folder)]
+        if params["command"] == "images_table_simple":
+            args += ["--keys", "image", "--mkeys", "metadata"]
+        else:
+            args += ["--image-key", "image", "--label-key", "metadata.cluster"]
+        if params["embed"]:
+            args += ["--embed", "--workers", str(params["workers"])]
+        args += ["--output-file", str(output_file)] + params.get("extra_args", [])
+
+        start = time.perf_counter()
+        piter(args, standalone_mode=False)
+        wall_time = time.perf_counter() - start
+        output_size = output_file.stat().st_size
+    return {"wall_time": wall_time, "items": params["size"], "bytes": output_size}
+
+
+# modules the CLI and the lightweight utilities must not import before a command
+# actually needs them
+HEAVY_MODULES = [
+    "numpy",
+    "PIL",
+    "colour",
+    "pydantic",
+    "pydantic_settings",
+    "jinja2",
+    "pipelime",
+    "rich",
+]
+
+
+def imported_heavy_modules(statement: str) -> t.List[str]:
+    """The `HEAVY_MODULES` imported by running `statement` in a fresh interpreter."""
+    probe = (
+        f"import sys\n{statement}\n"
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", probe], stdout=subprocess.PIPE, check=True, text=True
+    )
+    return completed.stdout.split()
+
+
+def _case_startup(params: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    args = list(params["args"])
+    if params.get("image"):
+        folder = _dataset(params["data_dir"], params["size"], params["resolution"])
+        args += ["-i", str(next((folder / "data").glob("*_image.jpg")))]
+    command = [sys.executable, "-c", "from piter.cli.cli import piter; piter()"]
+    times = []
+    for _ in range(params["repeat"]):
+        start = time.perf_counter()
+        subprocess.run(command + args, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    # the median, process startup is noisy
+    wall_time = sorted(times)[len(times) // 2]
+    return {"wall_time": wall_time, "items": 1, "bytes": 0}
+
+
+def _case_encode_numpy(params: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    from piter.utils.images import numpy_to_base64_url
+
+    width, height = params["resolution"]
+    image = _pattern(width, height)
+    count = params["count"]
+    start = time.perf_counter()
+    output_size = sum(len(numpy_to_base64_url(image)) for _ in range(count))
+    wall_time = time.perf_counter() - start
+    return {"wall_time": wall_time, "items": count, "bytes": output_size}
+
+
+def _case_encode_file(params: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    from piter.utils.images import image_file_to_base64_url
+
+    folder = _dataset(params["data_dir"], params["size"], params["resolution"])
+    files = sorted((folder / "data").glob("*_image.*"))[: params["count"]]
+    start = time.perf_counter()
+    output_size = sum(len(image_file_to_base64_url(path)) for path in files)
+    wall_time = time.perf_counter() - start
+    return {"wall_time": wall_time, "items": len(files), "bytes": output_size}
+
+
+def _case_render(params: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    from piter.renderers.html import ImagesTableSimple, ImagesTableSimpleParams
+
+    size = params["size"]
+    data = ImagesTableSimpleParams(
+        keys=["image"],
+        images=[{"image": f"data/{index:06d}_image.jpg"} for index in range(size)],
+        mkeys=["metadata"],
+        metadatas=[
+            {"metadata": {"cluster": str(index % 10), "score": "0.5000"}}
+            for index in range(size)
+        ],
+    )
+    renderer = ImagesTableSimple()
+    renderer.render(data)  # the template compilation is not measured
+    start = time.perf_counter()
+    output_size = len(renderer.render(data))
+    wall_time = time.perf_counter() - start
+    return {"wall_time": wall_time, "items": size, "bytes": output_size}
+
+
+_CASES = {
+    "cli": _case_cli,
+    "startup": _case_startup,
+    "encode_numpy": _case_encode_numpy,
+    "encode_file": _case_encode_file,
+    "render": _case_render,
+}
+
+
+@bench.command("case")
+def case(kind: str, params: str) -> None:
+    """Runs a single case in this process and prints its measures (internal)."""
+    result = _CASES[kind](json.loads(params))
+    result["peak_rss_mb"] = _rss_mb()
+    result["peak_children_rss_mb"] = _rss_mb(children=True)
+    print(json.dumps(result))
+
+
+def _run_case(name: str, kind: str, params: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    completed = subprocess.run(
+        [sys.executable, __file__, "case", kind, json.dumps(params)],
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["throughput"] = result["items"] / result["wall_time"]
+    return {"name": name, "kind": kind, "params": params, **result}
+
+
+def _parse_resolution(value: str) -> t.Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def plan(
+    sizes: t.List[int],
+    resolutions: t.List[t.Tuple[int, int]],
+    data_dir: str,
+    workers: int,
+    encode_count: int,
+) -> t.List[t.Tuple[str, str, t.Dict[str, t.Any]]]:
+    """The cases to run, as (name, kind, params)."""
+    cases = [
+        ("startup[help]", "startup", {"args": ["--help"], "repeat": 5}),
+        (
+            "startup[image2base64]",
+            "startup",
+            {
+                "args": ["image2base64"],
+                "image": True,
+                "repeat": 5,
+                "data_dir": data_dir,
+                "size": sizes[0],
+                "resolution": resolutions[0],
+            },
+        ),
+    ]
+    datasets = [(size, resolutions[0]) for size in sizes]
+    datasets += [(sizes[0], resolution) for resolution in resolutions[1:]]
+    for size, (width, height) in datasets:
+        dataset = {"data_dir": data_dir, "size": size, "resolution": (width, height)}
+        for command in ("images_table_simple", "images_clusters_simple"):
+            for embed in (False, True):
+                name = f"{command}{'_embed' if embed else ''}[{size},{width}x{height}]"
+                params = {**dataset, "command": command, "embed": embed}
+                cases.append((name, "cli", {**params, "workers": workers}))
+    for width, height in resolutions:
+        resolution = {"resolution": (width, height), "count": encode_count}
+        cases.append((f"encode_numpy[{width}x{height}]", "encode_numpy", resolution))
+        cases.append(
+            (
+                f"encode_file[{width}x{height}]",
+                "encode_file",
+                {**resolution, "data_dir": data_dir, "size": sizes[0]},
+            )
+        )
+    for size in sizes:
+        cases.append((f"render[{size}]", "render", {"size": size}))
+    return cases
+
+
+def compare(
+    results: t.List[t.Dict[str, t.Any]],
+    baseline: t.List[t.Dict[str, t.Any]],
+    tolerance: float = 0.1,
+) -> t.List[str]:
+    """The cases slower than in `baseline` by more than `tolerance`."""
+    previous = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        if result["name"] not in previous:
+            continue
+        ratio = result["wall_time"] / previous[result["name"]]["wall_time"]
+        print(f"{result['name']:<55} {ratio:6.2f}x")
+        if ratio > 1 + tolerance:
+            regressions.append(result["name"])
+    return regressions
+
+
+def over_budget(results: t.List[t.Dict[str, t.Any]], budget: float) -> t.List[str]:
+    """The startup cases slower than `budget` seconds."""
+    return [
+        result["name"]
+        for result in results
+        if result["kind"] == "startup" and result["wall_time"] > budget
+    ]
+
+
+@bench.command("run")
+def run(
+    sizes: str = typer.Option(
+        "1000,10000,100000", help="The numbers of samples of the datasets"
+    ),
+    resolutions: str = typer.Option(
+        "256x256,1024x768,1920x1080", help="The image resolutions of the datasets"
+    ),
+    data_dir: str = typer.Option(
+        str(pl.Path(tempfile.gettempdir()) / "piter_benchmarks"),
+        help="The folder where the synthetic datasets are cached",
+    ),
+    workers: int = typer.Option(1, help="The number of workers of the embed cases"),
+    encode_count: int = typer.Option(
+        200, help="The number of images encoded by the encoding cases"
+    ),
+    only: str = typer.Option("", help="Runs only the cases whose name contains this"),
+    output: str = typer.Option(
+        "benchmark_results.json", help="The path of the JSON results file"
+    ),
+    baseline: str = typer.Option(
+        "", help="A previous results file to compare against, slower cases fail"
+    ),
+    startup_budget: float = typer.Option(
+        0.0,
+        help="The maximum wall time in seconds of the startup cases, slower ones fail. If 0, no budget",
+    ),
+) -> None:
+    import piter
+
+    cases = plan(
+        [int(size) for size in sizes.split(",")],
+        [_parse_resolution(value) for value in resolutions.split(",")],
+        data_dir,
+        workers,
+        encode_count,
+    )
+    results = []
+    for name, kind, params in cases:
+        if only and only not in name:
+            continue
+        result = _run_case(name, kind, params)
+        print(
+            f"{name:<55} {result['wall_time']:9.3f}s {result['throughput']:10.1f}/s"
+            f" {result['peak_rss_mb']:8.1f}MB"
+        )
+        results.append(result)
+
+    report = {
+        "meta": {
+            "piter": piter.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    pl.Path(output).write_text(json.dumps(report, indent=2))
+    print(f"Results saved at {output}")
+
+    regressions = []
+    if baseline:
+        previous = json.loads(pl.Path(baseline).read_text())["results"]
+        regressions += compare(results, previous)
+    if startup_budget > 0:
+        regressions += over_budget(results, startup_budget)
+    if regressions:
+        print(f"Slower than the baseline or budget: {', '.join(regressions)}")
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    bench()
@@ -1,7 +1,12 @@
+import contextlib
 import typing as t
 from pathlib import Path
 import typer
 
+if t.TYPE_CHECKING:
+    from piter.utils.atlas import Sprite
+    from piter.utils.images import ArraySource
+
 piter = typer.Typer(name="piter", pretty_exceptions_enable=False, no_args_is_help=True)
 context_settings = {"allow_extra_args": True, "ignore_unknown_options": False}
 
@@ -15,16 +20,70 @@ def check(
 
 @piter.command("image2base64", context_settings=context_settings)
 def image2base64(
-    image_path: str = typer.Option(
-        ...,
+    image_path: t.List[str] = typer.Option(
+        [],
         "-i",
-        help="The path to the input image file to be converted to a base64 string",
-    )
-) -> str:
-    import rich
+        help="The path to an input image file to be converted to a base64 string, can be repeated",
+    ),
+    paths_file: str = typer.Option(
+        "",
+        help="A file listing more input image paths, one per line ('-' for the standard input)",
+    ),
+    thumb_size: int = typer.Option(
+        0,
+        help="The maximum height of the image in pixels, larger images are downscaled. If 0, the full resolution is kept",
+    ),
+    workers: int = typer.Option(
+        1, help="The number of worker processes used to encode the images"
+    ),
+) -> None:
+    # one data URL per line, in the input order
+    import functools
+    import sys
     from piter.utils.images import image_file_to_base64_url
+    from piter.utils.parallel import ordered_map
+
+    paths = list(image_path)
+    if paths_file:
+        lines = sys.stdin if paths_file == "-" else open(paths_file)
+        with lines:
+            paths += [line.strip() for line in lines if line.strip()]
+    if not paths:
+        raise typer.BadParameter("No input images, use -i or --paths-file")
 
-    rich.print(image_file_to_base64_url(image_path))
+    encode = functools.partial(image_file_to_base64_url, thumb_size=thumb_size or None)
+    for data_url in ordered_map(encode, paths, workers=workers):
+        print(data_url)
+
+
+@piter.command("compile_templates", context_settings=context_settings)
+def compile_templates(
+    output_dir: str = typer.Option(
+        "",
+        help="The folder to write the precompiled templates to. If not provided, they are installed into the package, where they are picked up automatically",
+    )
+) -> None:
+    from piter.renderers.html import compile_templates, compiled_templates_path
+
+    target = compile_templates(output_dir or compiled_templates_path())
+    print(f"Templates compiled to {target}")
+
+
+# the datasets loaded so far, by folder, while `piter batch` runs
+_datasets: t.Optional[t.Dict[str, t.Any]] = None
+
+
+def _load_underfolder(folder):
+    """Loads an underfolder dataset, only once per folder within `piter batch`."""
+    import os
+    import pipelime.sequences as pls
+
+    if _datasets is None:
+        return pls.SamplesSequence.from_underfolder(folder)
+    key = os.path.abspath(folder)
+    if key not in _datasets:
+        _datasets[key] = pls.SamplesSequence.from_underfolder(folder)
+    return _datasets[key]
 
 
 def _is_valid_image(item):
@@ -34,8 +93,10 @@ def _is_valid_image(item):
 
 
 def _process_metadata_value(value):
-    if isinstance(value, float):
-        return f"{value:.4f}"
+    # numbers (also NaN and infinities, missing in the typed index of the
+    # filters) are kept as they are, the reports show floats with 4 decimals
+    if isinstance(value, (int, float)):
+        return value
     return str(value)
 
 
@@ -43,6 +104,623 @@ def _purge_metadata(item):
     return {key: _process_metadata_value(value) for key, value in item.items()}
 
 
+def _metadata_values(item):
+    """The purged values of a metadata item, None for other items."""
+    import pipelime.items as pli
+
+    if isinstance(item, pli.MetadataItem):
+        return _purge_metadata(item())
+    return None
+
+
+def _is_array_item(item):
+    import pipelime.items as pli
+
+    return isinstance(item, (pli.NumpyItem, pli.TiffImageItem))
+
+
+def _renderings(
+    keys: t.List[str],
+    mask_keys: t.List[str],
+    overlay: t.List[str],
+    colormap: str,
+    overlay_alpha: float,
+) -> t.Dict[str, "ArraySource"]:
+    """How the items of each key are rendered, if not images shown as they are.
+
+    The overlay of a mask holds the key of the image it is drawn over.
+    """
+    from piter.utils.arrays import COLORMAPS
+    from piter.utils.images import ArraySource
+
+    if colormap not in COLORMAPS:
+        raise typer.BadParameter(f"The colormap must be one of {', '.join(COLORMAPS)}")
+    overlays = {}
+    for value in overlay:
+        mask_key, _, image_key = value.partition(":")
+        if not mask_key or not image_key:
+            raise typer.BadParameter(f"Invalid overlay {value}, expected MASK:IMAGE")
+        overlays[mask_key] = image_key
+    return {
+        key: ArraySource(
+            "",
+            mode="mask" if key in mask_keys or key in overlays else "auto",
+            colormap=colormap,
+            overlay=overlays.get(key),
+            alpha=overlay_alpha,
+        )
+        for key in keys
+    }
+
+
+def _sample_sources(
+    sample, renderings: t.Dict[str, "ArraySource"], render: bool
+) -> t.Dict[str, t.Union[str, "ArraySource"]]:
+    """The sources of the images of a sample, by key.
+
+    Images are their paths, masks and arrays (with `render`, they cannot be
+    linked) are `ArraySource`s rendered from their values.
+    """
+    sources = {}
+    for key, rendering in renderings.items():
+        item = sample[key]
+        if rendering.mode == "auto" and _is_valid_image(item):
+            sources[key] = str(item.local_sources[0])
+        elif render and (_is_valid_image(item) or _is_array_item(item)):
+            overlay = rendering.overlay
+            if overlay is not None:
+                overlay = (
+                    str(sample[overlay].local_sources[0]) if overlay in sample else None
+                )
+            sources[key] = rendering._replace(
+                path=str(item.local_sources[0]), overlay=overlay
+            )
+    return sources
+
+
+def _image_url(
+    source: t.Union[str, "ArraySource"],
+    assets_dir: t.Optional[str] = None,
+    assets_url: str = "",
+    **settings: t.Any,
+) -> str:
+    """Encodes an image, as a base64 data URL or as a file written to `assets_dir`.
+
+    `source` is the path of an image file or an `ArraySource` to render.
+
+    In the latter case the URL is relative, `assets_url` being the URL of
+    `assets_dir` from the report. `settings` are the encoding options.
+    """
+    from piter.utils.images import image_file_to_base64_url, image_file_to_asset
+
+    if assets_dir is None:
+        return image_file_to_base64_url(source, **settings)
+    return f"{assets_url}/{image_file_to_asset(source, assets_dir, **settings)}"
+
+
+def _embed_images(
+    row: t.Tuple[t.Dict[str, str], t.Any], **settings: t.Any
+) -> t.Tuple[t.Dict[str, str], t.Any]:
+    """Replaces the image paths of a `(sources, payload)` row with encoded URLs.
+
+    Runs in the worker processes, so it only receives and returns plain data.
+    `settings` are forwarded to `_image_url`.
+    """
+    sources, payload = row
+    urls = {key: _image_url(source, **settings) for key, source in sources.items()}
+    return urls, payload
+
+
+def _embed_rows(
+    rows: t.Iterable[t.Tuple[t.Dict[str, str], t.Any]],
+    workers: int = 1,
+    cache=None,
+    store=None,
+    **settings: t.Any,
+) -> t.Iterator[t.Tuple[t.Dict[str, str], t.Any]]:
+    """Embeds the images of `(sources, payload)` rows, preserving their order.
+
+    Cached images are resolved here, only the misses are sent to the workers and
+    their results are stored back into the cache. With a `DataURLStore` the rows
+    get asset ids instead of data URLs, and files identical to one already seen
+    are not encoded again. `settings` are the options of `_image_url` (quality,
+    extension, thumb_size, assets_dir, ...), sources are image paths or
+    `ArraySource`s.
+    """
+    import collections
+    import os
+    from functools import partial
+    from piter.utils.images import ArraySource
+    from piter.utils.parallel import ordered_map
+
+    assets_dir = settings.get("assets_dir")
+
+    resolved = collections.deque()
+
+    def lookup():
+        for sources, payload in rows:
+            keys, hits, misses = {}, {}, {}
+            for key, source in sources.items():
+                # rendered arrays are not files to compare, they are not deduplicated
+                plain = not isinstance(source, ArraySource)
+                if store is not None and plain:
+                    hits[key] = store.source_id(source)
+                if cache is not None and hits.get(key) is None:
+                    keys[key] = cache.source_key(source, **settings)
+                    hit = cache.get(keys[key])
+                    # a cached asset URL is valid only as long as its file exists
+                    if hit is not None and assets_dir is not None:
+                        name = hit.rsplit("/", 1)[-1]
+                        if not os.path.exists(os.path.join(assets_dir, name)):
+                            hit = None
+                    hits[key] = hit
+                if hits.get(key) is None:
+                    misses[key] = source
+            # rows come back in order, so the hits can wait here in a FIFO
+            generation = store.generation if store is not None else None
+            resolved.append((sources, keys, hits, generation))
+            yield misses, payload
+
+    for urls, payload in ordered_map(
+        partial(_embed_images, **settings), lookup(), workers=workers
+    ):
+        sources, keys, hits, generation = resolved.popleft()
+        if cache is not None:
+            for key, url in urls.items():
+                cache.put(keys[key], url)
+        if store is not None:
+            for key, hit in hits.items():
+                if hit is None:
+                    continue
+                if key in keys:  # a data URL from the cache
+                    urls[key] = hit
+                elif generation == store.generation:  # an id of an identical file
+                    hits[key] = store.reuse(hit)
+                else:
+                    # the id was resolved ahead, for a document that is over
+                    urls[key] = _image_url(sources[key], **settings)
+            for key, url in urls.items():
+                hits[key] = store.add(url)
+                if not isinstance(sources[key], ArraySource):
+                    store.add_source(sources[key], hits[key])
+        yield {key: hits.get(key) or urls[key] for key in sources}, payload
+
+
+def _atlas_sheet(
+    paths: t.List[str],
+    atlas_size: int,
+    thumb_size: int,
+    quality: int,
+    assets_dir: t.Optional[str] = None,
+    assets_url: str = "",
+) -> t.Optional[t.Tuple[str, int, int, t.List[t.Tuple[int, int, int, int]]]]:
+    """Packs image files into a sprite sheet, encoded as by `_image_url`.
+
+    Runs in the worker processes, so it only receives and returns plain data.
+
+    :return: the URL and size of the sheet and the placement of each image, None
+        if there are no images
+    """
+    from piter.utils.atlas import pack_sheet
+    from piter.utils.images import pil_to_asset, pil_to_base64_url
+
+    if not paths:
+        return None
+    sheet, placements = pack_sheet(paths, thumb_size, atlas_size)
+    if assets_dir is None:
+        url = pil_to_base64_url(sheet, quality)
+    else:
+        url = f"{assets_url}/{pil_to_asset(sheet, assets_dir, quality)}"
+    return url, sheet.width, sheet.height, placements
+
+
+def _atlas_sprites(
+    clusters: t.Dict[int, t.List[str]],
+    workers: int = 1,
+    cache=None,
+    **settings: t.Any,
+) -> t.Iterator["Sprite"]:
+    """Packs the members of each cluster into sprite sheets, yields their sprites.
+
+    The members of a cluster are split into chunks of `sheet_capacity` images,
+    one sheet each, encoded in the worker processes; the sprites come in the
+    order of the members. Sheets are cached as a whole. `settings` are the
+    options of `_atlas_sheet`.
+    """
+    import collections
+    import json
+    import os
+    from functools import partial
+    from piter.utils.atlas import Sheet, Sprite, sheet_capacity
+    from piter.utils.parallel import ordered_map
+
+    capacity = sheet_capacity(settings["thumb_size"], settings["atlas_size"])
+    chunks = (
+        sources[start : start + capacity]
+        for sources in clusters.values()
+        for start in range(0, len(sources), capacity)
+    )
+    assets_dir = settings.get("assets_dir")
+
+    resolved = collections.deque()
+
+    def lookup():
+        for chunk in chunks:
+            key = hit = None
+            if cache is not None:
+                keys = [cache.source_key(source) for source in chunk]
+                key = cache.make_key(*keys, kind="atlas", **settings)
+                hit = cache.get(key)
+                # a cached asset URL is valid only as long as its file exists
+                if hit is not None and assets_dir is not None:
+                    name = json.loads(hit)[0].rsplit("/", 1)[-1]
+                    if not os.path.exists(os.path.join(assets_dir, name)):
+                        hit = None
+            resolved.append((key, hit))
+            yield [] if hit is not None else chunk
+
+    for packed in ordered_map(
+        partial(_atlas_sheet, **settings), lookup(), workers=workers
+    ):
+        key, hit = resolved.popleft()
+        if hit is not None:
+            packed = json.loads(hit)
+        elif cache is not None:
+            cache.put(key, json.dumps(packed))
+        url, width, height, placements = packed
+        sheet = Sheet(url, width, height)
+        for x, y, w, h in placements:
+            yield Sprite(sheet, x, y, w, h)
+
+
+def _unzip(
+    pairs: t.Iterable[t.Tuple[t.Any, t.Any]],
+) -> t.Tuple[t.Iterator[t.Any], t.Iterator[t.Any]]:
+    """Lazily splits an iterable of pairs, meant to be consumed in lockstep."""
+    import itertools
+
+    first, second = itertools.tee(pairs)
+    return (a for a, _ in first), (b for _, b in second)
+
+
+def _stable_output_file(output_file: str) -> str:
+    """`output_file`, or a new temporary file if not provided."""
+    import tempfile
+
+    if not output_file:
+        with tempfile.NamedTemporaryFile(suffix=".html", delete=False) as f:
+            output_file = f.name
+    return output_file
+
+
+def _shard_option(shard: str, output_file: str) -> t.Tuple[int, int]:
+    """The `(index, count)` of a `--shard i/N` option, written to `output_file`."""
+    from piter.utils.shards import parse_shard
+
+    if not output_file:
+        raise typer.BadParameter("--shard needs the --output-file of the shard")
+    try:
+        return parse_shard(shard)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+
+def _assets_settings(assets_dir: str, output_file: str) -> t.Dict[str, str]:
+    """The `_image_url` options to write the images to `assets_dir`.
+
+    A relative `assets_dir` is relative to the folder of `output_file`.
+    """
+    import os
+    from urllib.parse import quote
+
+    report_dir = Path(output_file).parent
+    assets_path = report_dir / assets_dir
+    assets_url = Path(os.path.relpath(assets_path, report_dir)).as_posix()
+    return {"assets_dir": str(assets_path), "assets_url": quote(assets_url)}
+
+
+def _write_report(renderer, params, output_file: str) -> None:
+    """Streams a rendered report to `output_file`, or to a temporary file."""
+    import tempfile
+
+    if output_file:
+        renderer.dump(params, output_file)
+        print(f"HTML file saved at {output_file}")
+    else:
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".html", delete=False) as f:
+            renderer.dump(params, f)
+        print(f"HTML file saved at {f.name}")
+
+
+def _write_pages(renderer, pages, links, title: str, output_file: str) -> None:
+    """Writes a multi-page report: numbered pages plus an index page.
+
+    `output_file` (or a temporary file) becomes the index, the pages are written
+    next to it as `<name>_<number>.html`. `pages` lazily yields the params of each
+    page and `links` holds the matching `PageLink`s shown in the index.
+    """
+    import tempfile
+    from piter.renderers.html import PagesIndex, PagesIndexParams, Pagination
+
+    if not output_file:
+        with tempfile.NamedTemporaryFile(suffix=".html", delete=False) as f:
+            output_file = f.name
+    index = Path(output_file)
+    # pages of a gzipped index are gzipped as well
+    suffix = ".html.gz" if index.suffix == ".gz" else ".html"
+    stem = Path(index.stem).stem if index.suffix == ".gz" else index.stem
+    digits = max(3, len(str(len(links))))
+    for number, link in enumerate(links, start=1):
+        link.url = f"{stem}_{number:0{digits}d}{suffix}"
+
+    def numbered_pages():
+        for idx, params in enumerate(pages):
+            params.pagination = Pagination(
+                index=index.name,
+                current=idx + 1,
+                total=len(links),
+                previous=links[idx - 1].url if idx > 0 else None,
+                next=links[idx + 1].url if idx + 1 < len(links) else None,
+            )
+            yield params, index.parent / links[idx].url
+
+    renderer.dump_pages(numbered_pages())
+    PagesIndex().dump(PagesIndexParams(title=title, pages=links), index)
+    print(f"HTML file saved at {index} ({len(links)} pages)")
+
+
+def _render_table(
+    rows: t.Iterable[t.Tuple[t.Dict[str, str], t.Dict[str, str]]],
+    total: int,
+    output_file: str,
+    title: str,
+    keys: t.List[str],
+    mkeys: t.List[str],
+    divide_each: int = -1,
+    virtual: bool = False,
+    compress: bool = False,
+    store=None,
+    page_size: int = 0,
+) -> None:
+    """Renders a table report from its `total` rows of `(images, metadata)`.
+
+    The rows are consumed lazily, while the report is written.
+    """
+    import collections
+    import itertools
+    from piter.renderers.html import ImagesTableSimpleParams, ImagesTableSimple
+    from piter.renderers.html import PageLink
+
+    # Unzip the rows lazily, the template consumes both sides in lockstep
+    batches, mbatches = _unzip(rows)
+
+    def make_params(images, metadatas, start_index: int = 0):
+        return ImagesTableSimpleParams(
+            title=title,
+            keys=keys,
+            images=images,
+            mkeys=mkeys,
+            metadatas=metadatas,
+            group_size=divide_each if divide_each > 0 else None,
+            start_index=start_index,
+            virtual=virtual or compress,
+            compress=compress,
+            assets=store,
+        )
+
+    renderer = ImagesTableSimple()
+    if page_size > 0:
+        starts = range(0, total, page_size)
+        links = [
+            PageLink(
+                label=f"Rows {start + 1}-{min(start + page_size, total)}",
+                url="",
+                count=min(page_size, total - start),
+            )
+            for start in starts
+        ]
+
+        def pages():
+            for start, link in zip(starts, links):
+                if store is not None:
+                    store.reset()  # each page is a standalone document
+                # each page lazily takes its rows from the shared ordered stream
+                yield make_params(
+                    itertools.islice(batches, link.count),
+                    itertools.islice(mbatches, link.count),
+                    start,
+                )
+
+        _write_pages(renderer, pages(), links, title, output_file)
+        # drain the (empty) stream, so that the progress bar completes
+        collections.deque(batches, maxlen=0)
+    else:
+        _write_report(renderer, make_params(batches, mbatches), output_file)
+
+
+def _render_clusters(
+    urls: t.Iterable[str],
+    shown: t.Dict[int, int],
+    output_file: str,
+    title: str,
+    colors: t.Dict[int, str],
+    sizes: t.Dict[int, int],
+    max_per_cluster: int = 0,
+    virtual: bool = False,
+    compress: bool = False,
+    store=None,
+    page_size: int = 0,
+    atlas: bool = False,
+) -> None:
+    """Renders a clusters report from the image URLs of its members.
+
+    `urls` yields the members of each cluster in turn (their `Sprite`s with
+    `atlas`), `shown` holds how many of them each cluster has, `sizes` how many
+    it had before sampling. The URLs are consumed lazily, while the report is
+    written.
+    """
+    import collections
+    import itertools
+    from piter.renderers.html import ImagesClustersSimpleParams, ImagesClustersSimple
+    from piter.renderers.html import PageLink
+
+    urls = iter(urls)
+    renderer = ImagesClustersSimple()
+    if page_size > 0:
+        # one page per cluster, larger clusters are split over several pages
+        links, labels = [], []
+        for label, count in shown.items():
+            chunks = range(0, count, page_size)
+            for chunk, start in enumerate(chunks, start=1):
+                part = f" ({chunk}/{len(chunks)})" if len(chunks) > 1 else ""
+                links.append(
+                    PageLink(
+                        label=f"Cluster {label}{part}",
+                        url="",
+                        count=min(page_size, count - start),
+                        color=colors[label],
+                    )
+                )
+                labels.append(label)
+
+        def pages():
+            for label, link in zip(labels, links):
+                if store is not None:
+                    store.reset()  # each page is a standalone document
+                yield ImagesClustersSimpleParams(
+                    title=f"{title} - {link.label}",
+                    images_clusters={label: itertools.islice(urls, link.count)},
+                    labels_colors=colors,
+                    clusters_sizes=sizes,
+                    max_per_cluster=max_per_cluster or None,
+                    virtual=virtual or compress,
+                    compress=compress,
+                    assets=store,
+                    atlas=atlas,
+                )
+
+        _write_pages(renderer, pages(), links, title, output_file)
+    else:
+        _write_report(
+            renderer,
+            ImagesClustersSimpleParams(
+                title=title,
+                # each cluster lazily takes its members from the shared ordered stream
+                images_clusters={
+                    label: itertools.islice(urls, count)
+                    for label, count in shown.items()
+                },
+                labels_colors=colors,
+                clusters_sizes=sizes,
+                max_per_cluster=max_per_cluster or None,
+                virtual=virtual or compress,
+                compress=compress,
+                assets=store,
+                atlas=atlas,
+            ),
+            output_file,
+        )
+    # drain the (empty) stream, so that the progress bar completes
+    collections.deque(urls, maxlen=0)
+
+
+@contextlib.contextmanager
+def _profiling(enabled: bool, output: str = "", trace: str = "") -> t.Iterator[None]:
+    """Profiles the processing stages run within the context, if enabled.
+
+    A summary is printed at the end, optionally written as JSON to `output`, and
+    every stage call is written to `trace` as a Chrome trace. Any of the outputs
+    enables profiling.
+    """
+    if not (enabled or output or trace):
+        yield
+        return
+
+    import rich
+    from rich.table import Table
+    from piter.utils.profiling import Profiler, profiling
+
+    with profiling(Profiler(trace=bool(trace))) as profiler:
+        yield
+
+    table = Table(title=f"Profile ({profiler.wall_time:.2f}s wall time)")
+    for column in (
+        "Stage",
+        "Calls",
+        "Total",
+        "Self",
+        "Share",
+        "MB",
+        "MB/s",
+        "Peak RSS",
+    ):
+        table.add_column(column, justify="left" if column == "Stage" else "right")
+    for row in profiler.summary():
+        table.add_row(
+            row["stage"],
+            str(row["calls"]),
+            f"{row['total']:.3f}s",
+            f"{row['self_time']:.3f}s",
+            f"{100 * row['share']:.1f}%",
+            f"{row['bytes'] / 1e6:.1f}" if row["bytes"] else "",
+            f"{row['throughput'] / 1e6:.1f}" if row["bytes"] else "",
+            f"{row['peak_rss']:.0f}MB",
+        )
+    rich.print(table)
+    if output:
+        profiler.write_json(output)
+        print(f"Profile saved at {output}")
+    if trace:
+        profiler.write_trace(trace)
+        print(f"Profile trace saved at {trace}")
+
+
+def _folder_state(folder: Path) -> str:
+    """A fingerprint of the files in a folder (names, mtimes and sizes)."""
+    import hashlib
+    import os
+
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+def _watch(folder: Path, interval: float, build: t.Callable[[], None]) -> None:
+    """Calls `build` whenever the files in `folder` change, until interrupted.
+
+    The folder is polled every `interval` seconds. A failed build (e.g. of a sample
+    still being written) is reported and retried on the next change.
+    """
+    import time
+
+    # only the samples of an underfolder, not files written next to them
+    data_folder = Path(folder) / "data"
+    if data_folder.is_dir():
+        folder = data_folder
+
+    state = None
+    try:
+        while True:
+            current = _folder_state(folder)
+            if current != state:
+                state = current
+                try:
+                    build()
+                except Exception as e:
+                    print(f"Report update failed: {e}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
 @piter.command("images_table_simple", context_settings=context_settings)
 def images_table_simple(
     title: str = typer.Option(
@@ -57,6 +735,21 @@ def images_table_simple(
     mkeys: t.List[str] = typer.Option(
         [], help="A list of keys to identify metadata in the dataset"
     ),
+    mask_keys: t.List[str] = typer.Option(
+        [],
+        help="A list of keys of label masks, drawn with a color per label (0 being the background)",
+    ),
+    colormap: str = typer.Option(
+        "viridis",
+        help="The colormap of single-channel arrays (e.g. depth maps): viridis, turbo or gray",
+    ),
+    overlay: t.List[str] = typer.Option(
+        [],
+        help="A mask drawn over an image, as MASK_KEY:IMAGE_KEY, shown in the column of the mask",
+    ),
+    overlay_alpha: float = typer.Option(
+        0.5, help="The opacity of the masks drawn over images (0-1)"
+    ),
     divide_each: int = typer.Option(
         -1, help="The number of images to display in each row"
     ),
@@ -66,76 +759,305 @@ def images_table_simple(
     embed_quality: int = typer.Option(
         50, help="The quality of embedded images (0-100)"
     ),
+    thumb_size: int = typer.Option(
+        0,
+        help="The maximum height of embedded images in pixels, larger images are downscaled. If 0, images are embedded at full resolution",
+    ),
+    passthrough_size: int = typer.Option(
+        0,
+        help="The maximum size in KB of JPEG/PNG/GIF/WebP/BMP images embedded as they are, without re-encoding (unless taller than thumb-size). If 0, images are always re-encoded",
+    ),
+    dedup: bool = typer.Option(
+        False,
+        help="Whether to store identical embedded images only once in the HTML file",
+    ),
+    assets_dir: str = typer.Option(
+        "",
+        help="A folder (relative to the output file) where the images are written, with content-hashed names, and referenced by relative URLs: the report and this folder can be moved together. An alternative to --embed that keeps the HTML file small",
+    ),
+    workers: int = typer.Option(
+        1, help="The number of worker processes used to encode embedded images"
+    ),
+    cache_dir: str = typer.Option(
+        "",
+        help="A folder where embedded images are cached across runs. If not provided, no cache is used",
+    ),
+    cache_size: int = typer.Option(
+        1024, help="The maximum size of the embedded images cache in MB"
+    ),
+    index_dir: str = typer.Option(
+        "",
+        help="A folder where the metadata values are indexed across runs, so that only new or changed metadata files are parsed again. If not provided, no index is used",
+    ),
+    virtual: bool = typer.Option(
+        False,
+        help="Whether to store the images as JSON data and build only the visible ones in the browser, for very large reports",
+    ),
+    compress: bool = typer.Option(
+        False,
+        help="Whether to store the JSON data of the report gzipped, inflated by the browser when opened (implies --virtual). Output files ending in .gz are gzipped as a whole",
+    ),
+    page_size: int = typer.Option(
+        0,
+        help="The maximum number of images per page, larger reports are split into numbered pages plus an index page (the output file). If 0, a single page is written",
+    ),
+    shard: str = typer.Option(
+        "",
+        help="Processes only the i-th of N slices of the dataset (e.g. 0/4) and writes it to the output file as a shard, combined with the others by `piter merge`",
+    ),
     output_file: str = typer.Option(
         "",
         help="The path to save the generated HTML file. If not provided, a temporary file will be created",
     ),
+    profile: bool = typer.Option(
+        False,
+        help="Whether to measure the time, calls, bytes and memory of each processing stage and print a summary",
+    ),
+    profile_output: str = typer.Option(
+        "", help="A JSON file to write the profiling summary to (implies --profile)"
+    ),
+    profile_trace: str = typer.Option(
+        "",
+        help="A Chrome trace file (chrome://tracing, ui.perfetto.dev) to write every profiled stage to (implies --profile)",
+    ),
+    incremental: bool = typer.Option(
+        False,
+        help="Whether to keep a manifest of the processed samples next to the output file, so that a rerun only processes the new or changed samples",
+    ),
+    watch: int = typer.Option(
+        0,
+        help="Polls the folder every given number of seconds and updates the report incrementally when it changes, until interrupted. If 0, the report is built once",
+    ),
 ) -> None:
-    from piter.renderers.html import ImagesTableSimpleParams, ImagesTableSimple
-    from piter.utils.images import numpy_to_base64_url, image_file_to_base64_url
-    import tempfile
-    import pipelime.sequences as pls
+    from piter.utils.images import ArraySource, ImageCache, DataURLStore
+    import itertools
+    import os
     import pipelime.stages as pst
-    import pipelime.items as pli
     from rich.progress import track
+    from piter.utils.manifest import ReportManifest
+    from piter.utils.metadata import MetadataIndex
+    from piter.utils.profiling import stage
+    from piter.utils.shards import ShardWriter, shard_range
 
-    dataset = pls.SamplesSequence.from_underfolder(folder)
-
-    if len(dataset) == 0:
-        print("No images found in the folder")
-        return
+    if embed and assets_dir:
+        raise typer.BadParameter("--embed and --assets-dir are mutually exclusive")
 
-    # If no keys provided, use all keys from first sample
-    if not keys:
-        keys = sorted(dataset[0].keys())
-    elif mkeys:  # Only filter if either keys or mkeys are provided
-        dataset = dataset.map(pst.StageKeysFilter(key_list=keys + mkeys))
-
-    def get_image_url(item: pli.ImageItem):
-        if not embed:
-            return str(item.local_sources[0])
-        return image_file_to_base64_url(item.local_sources[0], embed_quality)
-
-    # Process samples more efficiently using list comprehensions
-    processed_data = [
-        (
-            {
-                key: get_image_url(sample[key])
-                for key in keys
-                if _is_valid_image(sample[key])
-            },
-            {
-                mkey: _purge_metadata(sample[mkey]())
-                for mkey in mkeys
-                if isinstance(sample[mkey], pli.MetadataItem)
-            },
+    # masks and arrays have no image file to link to, they are rendered
+    render = embed or bool(assets_dir)
+    if (mask_keys or overlay) and not render:
+        raise typer.BadParameter(
+            "--mask-keys and --overlay need --embed or --assets-dir"
         )
-        for sample in track(dataset, total=len(dataset), description="Processing")
-    ]
 
-    # Unzip the processed data
-    batches, mbatches = map(list, zip(*processed_data)) if processed_data else ([], [])
+    incremental = incremental or watch > 0
+    part = _shard_option(shard, output_file) if shard else None
+    if part and incremental:
+        raise typer.BadParameter("--shard cannot be used with --incremental or --watch")
+    if incremental or assets_dir:
+        # the report is updated in place or has files next to it
+        output_file = _stable_output_file(output_file)
+    assets = _assets_settings(assets_dir, output_file) if assets_dir else {}
 
-    renderer = ImagesTableSimple()
-    output = renderer.render(
-        ImagesTableSimpleParams(
-            title=title,
-            keys=keys,
-            images=batches,
-            mkeys=mkeys,
-            metadatas=mbatches,
-            group_size=divide_each if divide_each > 0 else None,
-        )
-    )
+    def build():
+        with _profiling(profile, profile_output, profile_trace):
+            build_report()
 
-    if output_file:
-        with open(output_file, "w") as f:
-            f.write(output)
-        print(f"HTML file saved at {output_file}")
+    def build_report():
+        nonlocal keys
+
+        with stage("load"):
+            dataset = _load_underfolder(folder)
+
+        if len(dataset) == 0:
+            print("No images found in the folder")
+            return
+
+        # If no keys provided, use all keys from first sample
+        if not keys:
+            keys = sorted(dataset[0].keys())
+        elif mkeys:  # Only filter if either keys or mkeys are provided
+            # the images the masks are drawn over are kept as well
+            overlays = [value.partition(":")[2] for value in overlay]
+            dataset = dataset.map(pst.StageKeysFilter(key_list=keys + mkeys + overlays))
+        renderings = _renderings(keys, mask_keys, overlay, colormap, overlay_alpha)
+
+        if part:
+            shard_settings = {
+                "kind": "images_table_simple",
+                "folder": os.path.abspath(folder),
+                "samples": len(dataset),
+                "count": part[1],
+                "title": title,
+                "keys": keys,
+                "mkeys": mkeys,
+                "divide_each": divide_each,
+                "dedup": dedup,
+                "virtual": virtual,
+                "compress": compress,
+                "page_size": page_size,
+            }
+            positions = shard_range(len(dataset), *part)
+            dataset = dataset[positions.start : positions.stop]
+
+        manifest = None
+        if incremental:
+            manifest = ReportManifest(
+                f"{output_file}.manifest",
+                keys=keys,
+                mkeys=mkeys,
+                # arrays are read only to be rendered, they cannot be linked
+                renderings=renderings,
+                render=render,
+            )
+
+        indexed = None
+        if index_dir and mkeys:
+            index = MetadataIndex.in_folder(index_dir, folder, mkeys, shard=part)
+            indexed = index.read(
+                track(dataset, total=len(dataset), description="Indexing"),
+                {mkey: (mkey, _metadata_values) for mkey in mkeys},
+            )
+            print(f"Metadata index: {index.stats()}")
+
+        def read_sample(position, sample):
+            fingerprint = None
+            if manifest is not None:
+                overlays = [r.overlay for r in renderings.values() if r.overlay]
+                fingerprint = manifest.fingerprint(
+                    sample[key] for key in keys + mkeys + overlays if key in sample
+                )
+                row = manifest.get(fingerprint)
+                if row is not None:
+                    sources, metadata = row
+                    # the stored `ArraySource`s are lists
+                    return {
+                        key: source if isinstance(source, str) else ArraySource(*source)
+                        for key, source in sources.items()
+                    }, metadata
+            sources = _sample_sources(sample, renderings, render)
+            if indexed is not None:
+                values = {mkey: indexed[mkey][position] for mkey in mkeys}
+            else:
+                with stage("metadata"):
+                    values = {mkey: _metadata_values(sample[mkey]) for mkey in mkeys}
+            metadata = {
+                mkey: value for mkey, value in values.items() if value is not None
+            }
+            if manifest is not None:
+                manifest.put(fingerprint, (sources, metadata))
+            return sources, metadata
+
+        cache = None
+        if (embed or assets) and (cache_dir or manifest is not None):
+            cache = ImageCache(
+                cache_dir or manifest.images_dir, max_size=cache_size * 1024 * 1024
+            )
+
+        # shards are deduplicated when merged
+        store = DataURLStore() if embed and dedup and not part else None
+
+        rows = itertools.starmap(read_sample, enumerate(dataset))
+        if embed or assets:
+            # image decoding/encoding is the bottleneck, it is spread over the workers
+            rows = _embed_rows(
+                rows,
+                workers=workers,
+                cache=cache,
+                store=store,
+                quality=embed_quality,
+                extension=None,
+                thumb_size=thumb_size or None,
+                passthrough_size=passthrough_size * 1024 or None,
+                **assets,
+            )
+        rows = track(rows, total=len(dataset), description="Processing")
+
+        if part:
+            with ShardWriter(output_file, shard_settings, part[0]) as writer:
+                writer.header["start"] = positions.start
+                writer.header["rows"] = writer.write("rows.jsonl", rows)
+            print(f"Shard {shard} saved at {output_file}")
+        else:
+            _render_table(
+                rows,
+                len(dataset),
+                output_file,
+                title=title,
+                keys=keys,
+                mkeys=mkeys,
+                divide_each=divide_each,
+                virtual=virtual,
+                compress=compress,
+                store=store,
+                page_size=page_size,
+            )
+
+        if cache is not None:
+            cache.prune()
+            print(f"Images cache: {cache.stats()}")
+        if store is not None:
+            print(f"Images dedup: {store.stats()}")
+        if manifest is not None:
+            manifest.commit()
+            manifest.close()
+            print(f"Samples: {manifest.stats()}")
+
+    if watch > 0:
+        _watch(folder, watch, build)
     else:
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".html", delete=False) as f:
-            f.write(output)
-            print(f"HTML file saved at {f.name}")
+        build()
+
+
+def _embedding_clusters(
+    dataset,
+    image_key: str,
+    embedding_key: str,
+    num_clusters: int,
+    seed: int = 0,
+    max_per_cluster: int = 0,
+) -> t.Tuple[t.Dict[int, t.List[str]], t.Dict[int, int]]:
+    """Clusters the images of a dataset by the embedding vectors of its samples.
+
+    The embeddings are read into one contiguous array, clustered by mini-batch
+    k-means. Returns the image paths of each cluster, nearest to its centroid
+    first and at most `max_per_cluster` of them, and the size of each cluster.
+    """
+    import numpy as np
+    from rich.progress import track
+    from piter.utils.clustering import minibatch_kmeans
+    from piter.utils.profiling import stage
+
+    item_key, _, subkey = embedding_key.partition(".")
+    sources, embeddings = [], None
+    for sample in track(dataset, total=len(dataset), description="Reading"):
+        image = sample[image_key]
+        if not _is_valid_image(image):
+            continue
+        with stage("metadata"):
+            value = sample[item_key]()
+            value = value[subkey] if subkey else value
+            vector = np.asarray(value, dtype=np.float32).ravel()
+        if embeddings is None:
+            embeddings = np.empty((len(dataset), vector.size), dtype=np.float32)
+        if vector.size != embeddings.shape[1]:
+            raise ValueError(
+                f"Embedding of size {vector.size}, expected {embeddings.shape[1]}"
+            )
+        embeddings[len(sources)] = vector
+        sources.append(str(image.local_sources[0]))
+    if not sources:
+        return {}, {}
+
+    result = minibatch_kmeans(embeddings[: len(sources)], num_clusters, seed=seed)
+    # the members of each cluster, nearest to the centroid first
+    order = np.lexsort((result.distances, result.labels))
+    starts = np.flatnonzero(np.diff(result.labels[order])) + 1
+    clusters, sizes = {}, {}
+    for members in np.split(order, starts):
+        label = int(result.labels[members[0]])
+        sizes[label] = len(members)
+        clusters[label] = [sources[i] for i in members[: max_per_cluster or None]]
+    return clusters, sizes
 
 
 @piter.command("images_clusters_simple", context_settings=context_settings)
@@ -157,95 +1079,699 @@ def images_clusters_simple(
         "",
         help="The key to identify colors in the dataset (use dot notation for nested keys)",
     ),
+    embedding_key: str = typer.Option(
+        "",
+        help="The key of an embedding vector per sample, a metadata value (use dot notation for nested keys) or a numpy item: the images are clustered by mini-batch k-means instead of by label-key, nearest to the centroid first",
+    ),
+    num_clusters: int = typer.Option(
+        10, help="The number of clusters computed from the embeddings"
+    ),
+    cluster_seed: int = typer.Option(
+        0,
+        help="The seed of the clustering of the embeddings, the same seed gives the same clusters",
+    ),
     embed: bool = typer.Option(
         False, help="Whether to embed images directly in the HTML file"
     ),
     embed_quality: int = typer.Option(
         50, help="The quality of embedded images (0-100)"
     ),
+    thumb_size: int = typer.Option(
+        0,
+        help="The maximum height of embedded images in pixels, larger images are downscaled. If 0, images are embedded at full resolution",
+    ),
+    passthrough_size: int = typer.Option(
+        0,
+        help="The maximum size in KB of JPEG/PNG/GIF/WebP/BMP images embedded as they are, without re-encoding (unless taller than thumb-size). If 0, images are always re-encoded",
+    ),
+    dedup: bool = typer.Option(
+        False,
+        help="Whether to store identical embedded images only once in the HTML file",
+    ),
+    assets_dir: str = typer.Option(
+        "",
+        help="A folder (relative to the output file) where the images are written, with content-hashed names, and referenced by relative URLs: the report and this folder can be moved together. An alternative to --embed that keeps the HTML file small",
+    ),
+    atlas: bool = typer.Option(
+        False,
+        help="Whether to pack the thumbnails of each cluster into a few large sprite sheets (with --embed or --assets-dir and --thumb-size), shown with CSS background offsets, instead of one image each",
+    ),
+    atlas_size: int = typer.Option(
+        2048, help="The width in pixels of the sprite sheets of --atlas"
+    ),
+    workers: int = typer.Option(
+        1, help="The number of worker processes used to encode embedded images"
+    ),
+    cache_dir: str = typer.Option(
+        "",
+        help="A folder where embedded images are cached across runs. If not provided, no cache is used",
+    ),
+    cache_size: int = typer.Option(
+        1024, help="The maximum size of the embedded images cache in MB"
+    ),
+    index_dir: str = typer.Option(
+        "",
+        help="A folder where the metadata values are indexed across runs, so that only new or changed metadata files are parsed again. If not provided, no index is used",
+    ),
+    max_per_cluster: int = typer.Option(
+        0,
+        help="The maximum number of images shown per cluster, larger clusters are randomly sampled before any image is processed. If 0, every image is shown",
+    ),
+    sample_seed: int = typer.Option(
+        0, help="The seed of the cluster sampling, the same seed picks the same images"
+    ),
+    virtual: bool = typer.Option(
+        False,
+        help="Whether to store the images as JSON data and build only the visible ones in the browser, for very large reports",
+    ),
+    compress: bool = typer.Option(
+        False,
+        help="Whether to store the JSON data of the report gzipped, inflated by the browser when opened (implies --virtual). Output files ending in .gz are gzipped as a whole",
+    ),
+    page_size: int = typer.Option(
+        0,
+        help="The maximum number of images per page, larger reports are split into numbered pages plus an index page (the output file). If 0, a single page is written",
+    ),
+    shard: str = typer.Option(
+        "",
+        help="Processes only the i-th of N slices of the dataset (e.g. 0/4) and writes it to the output file as a shard, combined with the others by `piter merge`",
+    ),
     output_file: str = typer.Option(
         "",
         help="The path to save the generated HTML file. If not provided, a temporary file will be created",
     ),
+    profile: bool = typer.Option(
+        False,
+        help="Whether to measure the time, calls, bytes and memory of each processing stage and print a summary",
+    ),
+    profile_output: str = typer.Option(
+        "", help="A JSON file to write the profiling summary to (implies --profile)"
+    ),
+    profile_trace: str = typer.Option(
+        "",
+        help="A Chrome trace file (chrome://tracing, ui.perfetto.dev) to write every profiled stage to (implies --profile)",
+    ),
 ) -> None:
-    from piter.renderers.html import ImagesClustersSimpleParams, ImagesClustersSimple
-    from piter.utils.images import numpy_to_base64_url, label_to_color, color_rgb_to_hex
-    import tempfile
-    import pipelime.sequences as pls
+    from piter.utils.images import label_to_color, color_rgb_to_hex
+    from piter.utils.images import ImageCache, DataURLStore
+    import collections
+    import itertools
+    import os
     import pipelime.stages as pst
     import pipelime.items as pli
     from rich.progress import track
+    from piter.utils.metadata import MetadataIndex
+    from piter.utils.profiling import stage
+    from piter.utils.sampling import Reservoir
+    from piter.utils.shards import ShardWriter, shard_range
+
+    if embed and assets_dir:
+        raise typer.BadParameter("--embed and --assets-dir are mutually exclusive")
+
+    part = _shard_option(shard, output_file) if shard else None
+    if part and embedding_key:
+        # the clusters of different shards would not match
+        raise typer.BadParameter("--embedding-key cannot be used with --shard")
+    if embedding_key and num_clusters < 1:
+        raise typer.BadParameter("--num-clusters must be at least 1")
+    if atlas:
+        if not (embed or assets_dir) or thumb_size <= 0:
+            raise typer.BadParameter(
+                "--atlas needs --embed or --assets-dir and the --thumb-size of the sprites"
+            )
+        if part or dedup:
+            # the sheets are not shared by the sprites of different documents
+            raise typer.BadParameter("--atlas cannot be used with --shard or --dedup")
 
-    dataset = pls.SamplesSequence.from_underfolder(folder)
+    assets = {}
+    if assets_dir:
+        output_file = _stable_output_file(output_file)
+        assets = _assets_settings(assets_dir, output_file)
 
-    is_nested_label = "." in label_key
-    label_item = label_key.split(".")[0]
-    label_subitem = ".".join(label_key.split(".")[1:]) if is_nested_label else None
+    with _profiling(profile, profile_output, profile_trace):
+        with stage("load"):
+            dataset = _load_underfolder(folder)
 
-    is_nested_color = "." in color_key
-    color_item = color_key.split(".")[0]
-    color_subitem = ".".join(color_key.split(".")[1:]) if is_nested_color else None
+        is_nested_label = "." in label_key
+        label_item = label_key.split(".")[0]
+        label_subitem = ".".join(label_key.split(".")[1:]) if is_nested_label else None
 
+        is_nested_color = "." in color_key
+        color_item = color_key.split(".")[0]
+        color_subitem = ".".join(color_key.split(".")[1:]) if is_nested_color else None
+
+        if len(dataset) == 0:
+            print("No images found in the folder")
+            return
+
+        seed = sample_seed
+        if part:
+            shard_settings = {
+                "kind": "images_clusters_simple",
+                "folder": os.path.abspath(folder),
+                "samples": len(dataset),
+                "count": part[1],
+                "title": title,
+                "max_per_cluster": max_per_cluster,
+                "sample_seed": sample_seed,
+                "dedup": dedup,
+                "virtual": virtual,
+                "compress": compress,
+                "page_size": page_size,
+            }
+            positions = shard_range(len(dataset), *part)
+            dataset = dataset[positions.start : positions.stop]
+            # independent samples, merged by `piter merge`
+            seed = f"{sample_seed}:{part[0]}"
+
+        def is_valid_image(item):
+            return (
+                isinstance(item, pli.JpegImageItem)
+                or isinstance(item, pli.BmpImageItem)
+                or isinstance(item, pli.PngImageItem)
+            )
+
+        def read_label(item):
+            label = item()
+            return label[label_subitem] if is_nested_label else label
+
+        def read_color(item):
+            return item()[color_subitem]
+
+        indexed = None
+        if index_dir and not embedding_key:
+            columns = {"label": (label_item, read_label)}
+            if len(color_key) > 0:
+                columns["color"] = (color_item, read_color)
+            index = MetadataIndex.in_folder(
+                index_dir, folder, [label_key, color_key], shard=part
+            )
+            indexed = index.read(
+                track(dataset, total=len(dataset), description="Indexing"), columns
+            )
+            print(f"Metadata index: {index.stats()}")
+
+        if embedding_key:
+            clusters, sizes = _embedding_clusters(
+                dataset,
+                image_key,
+                embedding_key,
+                num_clusters,
+                seed=cluster_seed,
+                max_per_cluster=max_per_cluster,
+            )
+            colors = {label: label_to_color(label, format="hex") for label in clusters}
+        else:
+            clusters = {}
+            colors = {}
+
+            # metadata-only pass: the members are grouped before any image is processed
+            rows = enumerate(track(dataset, total=len(dataset), description="Reading"))
+            for row, sample in rows:
+                if not is_valid_image(sample[image_key]):
+                    continue
+
+                image = sample[image_key]
+                if indexed is not None:
+                    label = indexed["label"][row]
+                else:
+                    with stage("metadata"):
+                        label = read_label(sample[label_item])
+
+                try:
+                    label = int(label)
+                except:
+                    raise ValueError(f"Label {label} is not a valid number")
+
+                if label not in clusters:
+                    # without a limit the reservoir keeps every member
+                    clusters[label] = Reservoir(
+                        max_per_cluster or len(dataset), seed=f"{seed}:{label}"
+                    )
+
+                if label not in colors:
+                    if len(color_key) > 0:
+                        if indexed is not None:
+                            color = indexed["color"][row]
+                        else:
+                            with stage("metadata"):
+                                color = read_color(sample[color_item])
+                        colors[label] = color_rgb_to_hex(color)
+                    else:
+                        colors[label] = label_to_color(label, format="hex")
+
+                clusters[label].add(str(image.local_sources[0]))
+
+            sizes = {label: members.count for label, members in clusters.items()}
+            clusters = {label: members.items for label, members in clusters.items()}
+
+        cache = None
+        if (embed or assets) and cache_dir:
+            cache = ImageCache(cache_dir, max_size=cache_size * 1024 * 1024)
+
+        # shards are deduplicated when merged
+        store = DataURLStore() if embed and dedup and not part else None
+
+        members = (
+            ({image_key: source}, label)
+            for label, sources in clusters.items()
+            for source in sources
+        )
+        if atlas:
+            sprites = _atlas_sprites(
+                clusters,
+                workers=workers,
+                cache=cache,
+                atlas_size=atlas_size,
+                thumb_size=thumb_size,
+                quality=embed_quality,
+                **assets,
+            )
+            members = (({image_key: sprite}, None) for sprite in sprites)
+        elif embed or assets:
+            members = _embed_rows(
+                members,
+                workers=workers,
+                cache=cache,
+                store=store,
+                quality=embed_quality,
+                extension="jpeg",
+                thumb_size=thumb_size or None,
+                passthrough_size=passthrough_size * 1024 or None,
+                **assets,
+            )
+        total = sum(len(sources) for sources in clusters.values())
+        members = track(members, total=total, description="Processing")
+        urls = (member_urls[image_key] for member_urls, _ in members)
+
+        if part:
+            with ShardWriter(output_file, shard_settings, part[0]) as writer:
+                for label, sources in clusters.items():
+                    members = itertools.islice(urls, len(sources))
+                    writer.write(f"clusters/{label}.jsonl", members)
+                writer.header["clusters"] = [
+                    [label, colors[label], sizes[label], len(sources)]
+                    for label, sources in clusters.items()
+                ]
+            # drain the (empty) stream, so that the progress bar completes
+            collections.deque(urls, maxlen=0)
+            print(f"Shard {shard} saved at {output_file}")
+        else:
+            _render_clusters(
+                urls,
+                {label: len(sources) for label, sources in clusters.items()},
+                output_file,
+                title=title,
+                colors=colors,
+                sizes=sizes,
+                max_per_cluster=max_per_cluster,
+                virtual=virtual,
+                compress=compress,
+                store=store,
+                page_size=page_size,
+                atlas=atlas,
+            )
+
+        if cache is not None:
+            cache.prune()
+            print(f"Images cache: {cache.stats()}")
+        if store is not None:
+            print(f"Images dedup: {store.stats()}")
+
+
+@piter.command("merge", context_settings=context_settings)
+def merge(
+    shard_file: t.List[str] = typer.Option(
+        [],
+        "-i",
+        help="A shard written by images_table_simple or images_clusters_simple with --shard, can be repeated. All the shards of the report are needed",
+    ),
+    output_file: str = typer.Option(
+        "",
+        help="The path to save the generated HTML file. If not provided, a temporary file will be created",
+    ),
+    profile: bool = typer.Option(
+        False,
+        help="Whether to measure the time, calls, bytes and memory of each processing stage and print a summary",
+    ),
+    profile_output: str = typer.Option(
+        "", help="A JSON file to write the profiling summary to (implies --profile)"
+    ),
+    profile_trace: str = typer.Option(
+        "",
+        help="A Chrome trace file (chrome://tracing, ui.perfetto.dev) to write every profiled stage to (implies --profile)",
+    ),
+) -> None:
+    # the report is rendered with the settings the shards were generated with
+    from rich.progress import track
+    from piter.utils.images import DataURLStore
+    from piter.utils.sampling import merge_samples
+    from piter.utils.shards import load_shards, rebase_url
+
+    if not shard_file:
+        raise typer.BadParameter("No shards to merge, use -i")
+    try:
+        shards = load_shards(shard_file)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    settings = shards[0].settings
+
+    output_file = _stable_output_file(output_file)
+    report_dir = Path(output_file).parent
+    store = DataURLStore() if settings["dedup"] else None
+
+    def image_url(shard, url):
+        # relative URLs (--assets-dir) are relative to the shard
+        url = rebase_url(url, shard.path.parent, report_dir)
+        return store.add(url) if store is not None else url
+
+    render = dict(
+        title=settings["title"],
+        virtual=settings["virtual"],
+        compress=settings["compress"],
+        store=store,
+        page_size=settings["page_size"],
+    )
+    with _profiling(profile, profile_output, profile_trace):
+        if settings["kind"] == "images_table_simple":
+            total = sum(shard.header["rows"] for shard in shards)
+            rows = (
+                ({key: image_url(shard, url) for key, url in images.items()}, metadata)
+                for shard in shards
+                for images, metadata in shard.records("rows.jsonl")
+            )
+            _render_table(
+                track(rows, total=total, description="Merging"),
+                total,
+                output_file,
+                keys=settings["keys"],
+                mkeys=settings["mkeys"],
+                divide_each=settings["divide_each"],
+                **render,
+            )
+        else:
+            # the clusters in order of appearance, with the members of each shard
+            clusters = {}
+            for shard in shards:
+                for label, color, size, count in shard.header["clusters"]:
+                    clusters.setdefault(label, (color, []))[1].append(
+                        (shard, size, count)
+                    )
+
+            kept = {}
+            max_per_cluster = settings["max_per_cluster"]
+            for label, (_, parts) in clusters.items():
+                if max_per_cluster:
+                    # the samples of the shards, resampled into one of the cluster
+                    positions = merge_samples(
+                        [(size, count) for _, size, count in parts],
+                        max_per_cluster,
+                        seed=f"{settings['sample_seed']}:{label}",
+                    )
+                else:
+                    positions = [range(count) for _, _, count in parts]
+                kept[label] = [
+                    (shard, set(shard_positions))
+                    for (shard, _, _), shard_positions in zip(parts, positions)
+                ]
+
+            def urls():
+                for label, parts in kept.items():
+                    for shard, positions in parts:
+                        members = shard.records(f"clusters/{label}.jsonl")
+                        for position, url in enumerate(members):
+                            if position in positions:
+                                yield image_url(shard, url)
+
+            shown = {
+                label: sum(len(positions) for _, positions in parts)
+                for label, parts in kept.items()
+            }
+            _render_clusters(
+                track(urls(), total=sum(shown.values()), description="Merging"),
+                shown,
+                output_file,
+                colors={label: color for label, (color, _) in clusters.items()},
+                sizes={
+                    label: sum(size for _, size, _ in parts)
+                    for label, (_, parts) in clusters.items()
+                },
+                max_per_cluster=max_per_cluster,
+                **render,
+            )
+
+    for shard in shards:
+        shard.close()
+    if store is not None:
+        print(f"Images dedup: {store.stats()}")
+
+
+@piter.command("serve", context_settings=context_settings)
+def serve(
+    title: str = typer.Option("Report", help="The title of the served pages"),
+    folder: Path = typer.Option(
+        ..., help="The path to the folder containing the images"
+    ),
+    keys: t.List[str] = typer.Option(
+        [], help="The keys of the images shown in the table (all the keys if none)"
+    ),
+    mkeys: t.List[str] = typer.Option(
+        [], help="The keys of the metadata shown in the table"
+    ),
+    label_key: str = typer.Option(
+        "",
+        help="The key of the cluster labels (use dot notation for nested keys). If provided, the images are served grouped by cluster instead of as a table",
+    ),
+    image_key: str = typer.Option(
+        "image", help="The key of the images shown in the clusters"
+    ),
+    color_key: str = typer.Option(
+        "",
+        help="The key to identify colors in the dataset (use dot notation for nested keys)",
+    ),
+    page_size: int = typer.Option(100, help="The maximum number of images per page"),
+    thumb_size: int = typer.Option(
+        256,
+        help="The maximum height of the served images in pixels, larger images are downscaled. If 0, images are served at full resolution",
+    ),
+    quality: int = typer.Option(70, help="The quality of the served images (0-100)"),
+    passthrough_size: int = typer.Option(
+        200,
+        help="The maximum size in KB of JPEG/PNG/GIF/WebP/BMP images served as they are, without re-encoding (unless taller than thumb-size). If 0, images are always re-encoded",
+    ),
+    workers: int = typer.Option(
+        4, help="The number of threads decoding and encoding the served images"
+    ),
+    memory_cache_size: int = typer.Option(
+        256, help="The maximum size of the in-memory cache of served images in MB"
+    ),
+    cache_dir: str = typer.Option(
+        "",
+        help="A folder where the served images are cached across runs. If not provided, they are only cached in memory",
+    ),
+    cache_size: int = typer.Option(
+        1024, help="The maximum size of the on-disk images cache in MB"
+    ),
+    host: str = typer.Option("127.0.0.1", help="The address the server listens on"),
+    port: int = typer.Option(8000, help="The port the server listens on (0: any)"),
+    verbose: bool = typer.Option(False, help="Whether to log every request"),
+) -> None:
+    from piter.server import ClustersView, ReportServer, TableView, ThumbnailCache
+    from piter.utils.images import ImageCache, label_to_color, color_rgb_to_hex
+
+    # the samples are only listed here, items are read when a page needs them
+    dataset = _load_underfolder(folder)
     if len(dataset) == 0:
         print("No images found in the folder")
         return
 
-    def get_image_url(item: pli.ImageItem):
-        if not embed:
-            return str(item.local_sources[0])
-        else:
-            return numpy_to_base64_url(item(), quality=embed_quality)
+    if label_key:
+        label_item, _, label_subitem = label_key.partition(".")
+        color_item, _, color_subitem = color_key.partition(".")
+
+        def read_label(sample):
+            if not _is_valid_image(sample.get(image_key)):
+                return None
+            label = sample[label_item]()
+            label = int(label[label_subitem] if label_subitem else label)
+            if color_key:
+                color = color_rgb_to_hex(sample[color_item]()[color_subitem])
+            else:
+                color = label_to_color(label, format="hex")
+            return label, color
 
-    def is_valid_image(item):
-        return (
-            isinstance(item, pli.JpegImageItem)
-            or isinstance(item, pli.BmpImageItem)
-            or isinstance(item, pli.PngImageItem)
+        view = ClustersView(
+            dataset, image_key, read_label, title, page_size, _is_valid_image
         )
+    else:
+        keys = keys or sorted(dataset[0].keys())
+
+        def read_row(sample):
+            images = [key for key in keys if _is_valid_image(sample.get(key))]
+            values = {mkey: _metadata_values(sample.get(mkey)) for mkey in mkeys}
+            metadata = {
+                mkey: value for mkey, value in values.items() if value is not None
+            }
+            return images, metadata
+
+        view = TableView(
+            dataset, keys, mkeys, read_row, title, page_size, _is_valid_image
+        )
+
+    disk = None
+    if cache_dir:
+        disk = ImageCache(cache_dir, max_size=cache_size * 1024 * 1024)
+    thumbnails = ThumbnailCache(
+        {
+            "quality": quality,
+            "thumb_size": thumb_size or None,
+            "passthrough_size": passthrough_size * 1024 or None,
+        },
+        max_size=memory_cache_size * 1024 * 1024,
+        workers=workers,
+        disk=disk,
+    )
+    server = ReportServer((host, port), view, thumbnails, verbose=verbose)
+    print(f"Serving {folder} at {server.url} (press Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if disk is not None:
+            disk.prune()
+        print(f"Images cache: {thumbnails.stats()}")
 
-    clusters = {}
-    colors = {}
-    for sample in track(dataset, total=len(dataset), description="Processing"):
 
-        if not is_valid_image(sample[image_key]):
+_BATCH_COMMANDS = ("images_table_simple", "images_clusters_simple")
+
+
+def _job_args(job: t.Dict[str, t.Any]) -> t.List[str]:
+    """The command line of a batch job, from its options (as in `--help`)."""
+    args = [job["command"]]
+    for name, value in job.items():
+        if name in ("command", "name"):
             continue
+        option = "--" + name.replace("_", "-")
+        if isinstance(value, bool):
+            args.append(option if value else f"--no-{option[2:]}")
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                args += [option, str(item)]
+        else:
+            args += [option, str(value)]
+    return args
 
-        image = sample[image_key]
-        label = sample[label_item]()
-        if is_nested_label:
-            label = label[label_subitem]
 
-        if label not in clusters:
-            clusters[label] = []
+def _job_cost(job: t.Dict[str, t.Any]) -> int:
+    """A rough estimate of the cost of a batch job, from its number of files.
+
+    Jobs processing the images (embedded or written to a folder) cost more than
+    jobs only linking them.
+    """
+    import os
+
+    try:
+        files = sum(1 for _ in os.scandir(Path(job["folder"]) / "data"))
+    except OSError:
+        files = 0
+    if job.get("embed") or job.get("assets_dir"):
+        return files * 10
+    return files
 
-        if label not in colors:
-            if len(color_key) > 0:
-                color = sample[color_item]()[color_subitem]
-                colors[label] = color_rgb_to_hex(color)
-            else:
-                colors[label] = label_to_color(label, format="hex")
 
+def _run_job(job: t.Dict[str, t.Any], cost: int) -> t.Dict[str, t.Any]:
+    """Runs a batch job, failures included, and returns its timings."""
+    import time
+    from piter.utils.profiling import Profiler, profiling
+
+    print(f"Job {job['name']} (estimated cost {cost})")
+    error = None
+    start = time.perf_counter()
+    with profiling(Profiler()) as profiler:
         try:
-            label = int(label)
-        except:
-            raise ValueError(f"Label {label} is not a valid number")
+            piter(_job_args(job), standalone_mode=False)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"Job {job['name']} failed: {error}")
+    return {
+        "name": job["name"],
+        "command": job["command"],
+        "cost": cost,
+        "wall_time": time.perf_counter() - start,
+        "error": error,
+        "stages": {row["stage"]: row["self_time"] for row in profiler.summary()},
+    }
 
-        clusters[label].append(get_image_url(image))
 
-    renderer = ImagesClustersSimple()
-    output = renderer.render(
-        ImagesClustersSimpleParams(
-            title=title,
-            images_clusters=clusters,
-            labels_colors=colors,
-        )
-    )
+@piter.command("batch", context_settings=context_settings)
+def batch(
+    config: Path = typer.Option(
+        ...,
+        help="A YAML file with the list of `jobs`, each one the `command` to run and its options (e.g. `folder`, `output_file`), plus optional `defaults` shared by all the jobs",
+    ),
+    workers: int = typer.Option(
+        0,
+        help="The number of worker processes shared by all the jobs. If 0, the largest `workers` option of the jobs",
+    ),
+    order: str = typer.Option(
+        "cost",
+        help="The order of the jobs: 'cost' runs the cheapest first (estimated from their number of files), 'config' keeps the order of the file",
+    ),
+    summary_output: str = typer.Option(
+        "", help="A JSON file to write the timings of the jobs to"
+    ),
+) -> None:
+    import json
+    import yaml
+    import rich
+    from rich.table import Table
+    from piter.utils.parallel import shared_pool
 
-    if output_file:
-        with open(output_file, "w") as f:
-            f.write(output)
-        print(f"HTML file saved at {output_file}")
-    else:
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".html", delete=False) as f:
-            f.write(output)
-            print(f"HTML file saved at {f.name}")
+    with open(config) as f:
+        spec = yaml.safe_load(f) or {}
+    defaults = spec.get("defaults", {})
+    jobs = []
+    for index, job in enumerate(spec.get("jobs", [])):
+        job = {**defaults, **job}
+        if job.get("command") not in _BATCH_COMMANDS:
+            raise typer.BadParameter(
+                f"Job {index}: the command must be one of {', '.join(_BATCH_COMMANDS)}"
+            )
+        job.setdefault("name", f"{index}:{job['command']}:{job.get('folder', '')}")
+        jobs.append((job, _job_cost(job)))
+    if order == "cost":
+        # one job at a time: the cheapest first minimizes the time reports wait
+        jobs.sort(key=lambda job: job[1])
+    elif order != "config":
+        raise typer.BadParameter("--order must be 'cost' or 'config'")
+
+    global _datasets
+    workers = workers or max([job.get("workers", 1) for job, _ in jobs] + [1])
+    # imports, templates, datasets and the worker processes are shared by the jobs
+    _datasets = {}
+    try:
+        with shared_pool(workers):
+            summary = [_run_job(job, cost) for job, cost in jobs]
+    finally:
+        _datasets = None
+
+    table = Table(title=f"Batch ({len(summary)} jobs)")
+    for column in ("Job", "Cost", "Wall time", "Slowest stages", "Status"):
+        table.add_column(column, justify="right" if column == "Cost" else "left")
+    for job in summary:
+        slowest = sorted(job["stages"].items(), key=lambda x: x[1], reverse=True)
+        table.add_row(
+            job["name"],
+            str(job["cost"]),
+            f"{job['wall_time']:.2f}s",
+            ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in slowest[:3]),
+            "failed" if job["error"] else "ok",
+        )
+    rich.print(table)
+    if summary_output:
+        Path(summary_output).write_text(json.dumps(summary, indent=2))
+        print(f"Batch summary saved at {summary_output}")
+    if any(job["error"] for job in summary):
+        raise typer.Exit(1)
@@ -1,66 +1,287 @@
 from abc import ABC, abstractmethod
+import importlib
 import pathlib as pl
-import pydantic as pyd
-from pydantic_settings import BaseSettings
-from jinja2 import Environment, FileSystemLoader, Template
 import typing as t
-import datetime
+import re
+import threading
+
+from piter.utils.profiling import stage
+
+if t.TYPE_CHECKING:
+    from jinja2 import Environment
+    from markupsafe import Markup
+    from piter.renderers.html.models import EnvironmentSettings
+
+# jinja2, pydantic and pydantic-settings are imported on first use: the renderers
+# and their params are defined in `models` and resolved lazily by `__getattr__`
+_LAZY_NAMES = {
+    "EnvironmentSettings",
+    "Pagination",
+    "GlobalParams",
+    "HTMLRenderer",
+    "ImagesTableSimpleParams",
+    "ImagesTableSimple",
+    "ImagesClustersSimpleParams",
+    "ImagesClustersSimple",
+    "PageLink",
+    "PagesIndexParams",
+    "PagesIndex",
+}
+
+
+def __getattr__(name: str) -> t.Any:
+    if name in _LAZY_NAMES:
+        return getattr(importlib.import_module("piter.renderers.html.models"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def templates_path() -> pl.Path:
     return pl.Path(__file__).parent / "templates"
 
 
-class GlobalParams(BaseSettings):
-    footnotes: str = "Eyecan ® - " + str(datetime.datetime.now().year)
+def compiled_templates_path() -> pl.Path:
+    """Where the package templates are looked for in precompiled form."""
+    return templates_path() / "_compiled"
 
 
-class TemplatesCollection:
-    IMAGES_TABLE_SIMPLE = "images_table_simple.html"
-    IMAGES_CLUSTERS_SIMPLE = "images_clusters_simple.html"
+_COMPILED_VERSION_FILE = "JINJA_VERSION"
+_COMPILED_SOURCES_FILE = "TEMPLATES_DIGEST"
+_environment: t.Optional["Environment"] = None
+_environment_lock = threading.Lock()
+
+
+def css_escape(value: t.Any) -> str:
+    """Escapes a value for a CSS selector, e.g. a color in an arbitrary value class."""
+    return re.sub(r"([^a-zA-Z0-9_-])", r"\\\1", str(value))
+
+
+def data_island(value: t.Any, class_name: str, compress: bool = False) -> "Markup":
+    """A `<script>` element holding the JSON `value`, read by `readIsland` in JS.
+
+    With `compress` the JSON is stored gzipped and base64-encoded, unless that is
+    not smaller (e.g. for JPEG data URLs, which base64 inflates again).
+    """
+    from markupsafe import Markup
+
+    attributes = ""
+    if compress:
+        import base64
+        import gzip
+
+        with stage("compress"):
+            data = gzip.compress(str(value).encode("utf-8"), compresslevel=6, mtime=0)
+            packed = base64.b64encode(data).decode("ascii")
+        if len(packed) < len(value):
+            value, attributes = packed, ' data-encoding="gzip"'
+    return Markup(
+        f'<script type="application/json"{attributes} class="{class_name}">'
+        f"{value}</script>"
+    )
+
+
+def metadata_value(value: t.Any) -> str:
+    """A metadata value as shown in the reports, floats with 4 decimals."""
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return str(value)
+
+
+def format_metadata(
+    metadata: t.Mapping[str, t.Mapping[str, t.Any]],
+) -> t.Dict[str, t.Dict[str, str]]:
+    """The metadata of a row, by key, with its values as shown in the reports."""
+    return {
+        mkey: {key: metadata_value(value) for key, value in values.items()}
+        for mkey, values in metadata.items()
+    }
+
+
+class MetadataColumns:
+    """The typed columns of the metadata of a table, read by the filters in JS.
+
+    The metadata of the rows are collected while they stream by, each value is a
+    column `mkey.key`: numbers (and booleans) are kept as numbers, for columns
+    holding only numbers, other values as strings. Missing values are null.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self._columns: t.Dict[str, t.List[t.Any]] = {}
 
+    def collect(
+        self, metadatas: t.Iterable[t.Mapping[str, t.Mapping[str, t.Any]]]
+    ) -> t.Iterator[t.Mapping[str, t.Mapping[str, t.Any]]]:
+        for metadata in metadatas:
+            for mkey, values in metadata.items():
+                for key, value in values.items():
+                    column = self._columns.setdefault(f"{mkey}.{key}", [])
+                    column.extend([None] * (self.rows - len(column)))
+                    column.append(value)
+            self.rows += 1
+            yield metadata
 
-class _HasDict(t.Protocol):
-    def dict(self) -> t.Dict[str, t.Any]: ...
+    def dumps(self) -> str:
+        import json
+        import math
 
+        fields, columns = [], []
+        for name, column in self._columns.items():
+            column.extend([None] * (self.rows - len(column)))
+            numeric = all(
+                isinstance(value, (int, float)) for value in column if value is not None
+            )
+            if numeric:
+                # NaN and infinities are not valid JSON
+                column = [
+                    None if value is None or not math.isfinite(value) else value
+                    for value in column
+                ]
+            else:
+                column = [None if value is None else str(value) for value in column]
+            fields.append({"name": name, "type": "number" if numeric else "string"})
+            columns.append(column)
+        dumped = json.dumps({"rows": self.rows, "fields": fields, "columns": columns})
+        # as `tojson`, so that strings cannot close the <script> element
+        return dumped.replace("<", "\\u003c").replace(">", "\\u003e")
 
-Params = t.TypeVar("Params", bound=_HasDict)
 
+class SpriteSheets:
+    """The sprite sheets of a document, each one written once as a CSS class.
 
-class HTMLRenderer(pyd.BaseModel, t.Generic[Params]):
-    template_path: str
+    `add` maps the sheet of a sprite to a short id, the sheets not yet written to
+    the document are handed out by `flush`, so that their rules are emitted while
+    streaming. The sprites of a sheet come one after the other, so only the last
+    sheet is remembered, instead of all the images of the document.
+    """
 
-    def _build_template(self) -> Template:
-        with open(str(self.template_path), "r") as file:
-            content = file.read()
-        return Template(content)
+    def __init__(self):
+        self.count = 0
+        self._last: t.Any = None
+        self._pending: t.List[t.Tuple[str, t.Any]] = []
 
-    def render(self, data: Params) -> str:
-        env = Environment(loader=FileSystemLoader(templates_path()))
-        return env.get_template(self.template_path).render(data.dict(), zip=zip)
-        # template = self._build_template()
-        # return template.render(data.dict())
+    def add(self, sheet: t.Any) -> str:
+        if self._last is None or sheet != self._last:
+            self._last = sheet
+            self._pending.append((f"s{self.count}", sheet))
+            self.count += 1
+        return f"s{self.count - 1}"
 
+    def flush(self) -> t.List[t.Tuple[str, t.Any]]:
+        """The `(id, sheet)` added since the last flush."""
+        pending, self._pending = self._pending, []
+        return pending
 
-class ImagesTableSimpleParams(GlobalParams):
-    title: str = "Images Table"
-    keys: t.List[str] = []
-    images: t.List[t.Dict[str, str]]
-    mkeys: t.List[str] = []
-    metadatas: t.List[t.Dict[str, t.Mapping[str, t.Any]]] = []
-    group_size: t.Optional[int] = None
-    show_indices: bool = True
 
+def _add_template_helpers(env: "Environment") -> "Environment":
+    env.globals["zip"] = zip
+    env.globals["metadata_columns"] = MetadataColumns
+    env.globals["sprite_sheets"] = SpriteSheets
+    env.filters["css_escape"] = css_escape
+    env.filters["data_island"] = data_island
+    env.filters["metadata_value"] = metadata_value
+    env.filters["format_metadata"] = format_metadata
+    return env
 
-class ImagesTableSimple(HTMLRenderer[ImagesTableSimpleParams]):
-    template_path: str = TemplatesCollection.IMAGES_TABLE_SIMPLE
 
+def compile_templates(target: t.Union[str, pl.Path]) -> pl.Path:
+    """Precompiles the package templates to Python modules in `target`.
 
-class ImagesClustersSimpleParams(GlobalParams):
-    title: str = "Images Clusters"
-    images_clusters: t.Dict[int, t.List[str]]
-    labels_colors: t.Optional[t.Dict[int, str]] = None
+    The modules are tied to the installed Jinja version and to the template
+    sources, which are recorded next to them: they are ignored if loaded by a
+    different version or once the sources are edited.
+    """
+    import jinja2
 
+    target = pl.Path(target)
+    loader = jinja2.FileSystemLoader(templates_path())
+    env = _add_template_helpers(jinja2.Environment(loader=loader))
+    env.compile_templates(
+        str(target),
+        zip=None,
+        filter_func=lambda name: name.endswith((".html", ".css")),
+    )
+    (target / _COMPILED_VERSION_FILE).write_text(jinja2.__version__)
+    (target / _COMPILED_SOURCES_FILE).write_text(_templates_digest())
+    return target
 
-class ImagesClustersSimple(HTMLRenderer[ImagesClustersSimpleParams]):
-    template_path: str = TemplatesCollection.IMAGES_CLUSTERS_SIMPLE
+
+def _templates_digest() -> str:
+    # a hash of the names and contents of the template sources
+    import hashlib
+
+    digest = hashlib.sha1()
+    for path in sorted(templates_path().glob("*")):
+        if path.suffix in (".html", ".css"):
+            digest.update(path.name.encode("utf-8") + b"\0" + path.read_bytes())
+    return digest.hexdigest()
+
+
+def _compiled_loader(folder: pl.Path):
+    import jinja2
+
+    try:
+        version = (folder / _COMPILED_VERSION_FILE).read_text()
+        sources = (folder / _COMPILED_SOURCES_FILE).read_text()
+    except OSError:
+        return None
+    if version == jinja2.__version__ and sources == _templates_digest():
+        return jinja2.ModuleLoader(str(folder))
+    return None
+
+
+def _build_environment(settings: "EnvironmentSettings") -> "Environment":
+    import jinja2
+
+    loaders = []
+    for folder in (settings.compiled_templates_dir, compiled_templates_path()):
+        loader = _compiled_loader(pl.Path(folder)) if folder else None
+        if loader is not None:
+            loaders.append(loader)
+    loaders.append(jinja2.FileSystemLoader(templates_path()))
+
+    bytecode_cache = None
+    if settings.bytecode_cache_dir:
+        pl.Path(settings.bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(settings.bytecode_cache_dir)
+
+    env = jinja2.Environment(
+        loader=jinja2.ChoiceLoader(loaders),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+    )
+    return _add_template_helpers(env)
+
+
+def configure_environment(
+    settings: t.Optional["EnvironmentSettings"] = None,
+) -> "Environment":
+    """(Re)creates the process-wide Jinja environment used by all the renderers.
+
+    Templates are compiled once and then cached by the environment, auto reload is
+    disabled. Precompiled templates (from `settings` or shipped with the package)
+    take precedence over the template sources.
+    """
+    from piter.renderers.html.models import EnvironmentSettings
+
+    global _environment
+    env = _build_environment(settings or EnvironmentSettings())
+    with _environment_lock:
+        _environment = env
+    return env
+
+
+def get_environment() -> "Environment":
+    """The process-wide Jinja environment, created on first use."""
+    from piter.renderers.html.models import EnvironmentSettings
+
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            _environment = _build_environment(EnvironmentSettings())
+        return _environment
+
+
+class TemplatesCollection:
+    IMAGES_TABLE_SIMPLE = "images_table_simple.html"
+    IMAGES_CLUSTERS_SIMPLE = "images_clusters_simple.html"
+    PAGES_INDEX = "pages_index.html"
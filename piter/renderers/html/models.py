@@ -0,0 +1,184 @@
+import datetime
+import pathlib as pl
+import typing as t
+
+import pydantic as pyd
+from jinja2 import Template
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from piter.renderers.html import TemplatesCollection, get_environment
+from piter.utils.profiling import active_profiler, stage
+
+
+class EnvironmentSettings(BaseSettings):
+    """Configures the shared Jinja environment, e.g. via `PITER_*` env variables."""
+
+    model_config = SettingsConfigDict(env_prefix="PITER_")
+
+    # a folder where the compiled templates bytecode is cached across processes
+    bytecode_cache_dir: t.Optional[str] = None
+    # a folder of templates precompiled with `compile_templates`
+    compiled_templates_dir: t.Optional[str] = None
+
+
+class Pagination(pyd.BaseModel):
+    """Navigation links of a page in a multi-page report (urls are relative)."""
+
+    index: str
+    current: int
+    total: int
+    previous: t.Optional[str] = None
+    next: t.Optional[str] = None
+
+
+class GlobalParams(BaseSettings):
+    footnotes: str = "Eyecan ® - " + str(datetime.datetime.now().year)
+    pagination: t.Optional[Pagination] = None
+
+
+class _HasDict(t.Protocol):
+    def dict(self) -> t.Dict[str, t.Any]: ...
+
+
+Params = t.TypeVar("Params", bound=_HasDict)
+
+
+class HTMLRenderer(pyd.BaseModel, t.Generic[Params]):
+    template_path: str
+
+    def _build_template(self) -> Template:
+        with open(str(self.template_path), "r") as file:
+            content = file.read()
+        return Template(content)
+
+    def _get_template(self) -> Template:
+        return get_environment().get_template(self.template_path)
+
+    def _context(self, data: Params) -> t.Dict[str, t.Any]:
+        # a shallow view of the params: lazy iterables are passed through as they are
+        return dict(iter(data))
+
+    def render(self, data: Params) -> str:
+        with stage("render"):
+            return self._get_template().render(self._context(data))
+
+    def stream(self, data: Params) -> t.Iterator[str]:
+        """Renders the template lazily, yielding the output in chunks.
+
+        Iterables in `data` are consumed while the chunks are produced, so the
+        whole report is never held in memory.
+        """
+        return self._get_template().generate(self._context(data))
+
+    def dump(self, data: Params, output: t.Union[str, pl.Path, t.TextIO]) -> None:
+        """Streams the rendered template to a file path or a text file object.
+
+        Paths ending in `.gz` are gzipped while streaming.
+        """
+        if isinstance(output, (str, pl.Path)):
+            if str(output).endswith(".gz"):
+                import gzip
+
+                with gzip.open(output, "wt", encoding="utf-8", compresslevel=6) as f:
+                    self.dump(data, f)
+                return
+            with open(output, "w") as f:
+                self.dump(data, f)
+            return
+        if active_profiler() is None:
+            output.writelines(self.stream(data))
+            return
+        # rows are produced lazily while rendering, their own stages are nested
+        chunks = self.stream(data)
+        while True:
+            with stage("render"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with stage("write", len(chunk)):
+                output.write(chunk)
+
+    def dump_pages(
+        self,
+        pages: t.Iterable[t.Tuple[Params, t.Union[str, pl.Path]]],
+        workers: int = 1,
+    ) -> None:
+        """Renders several independent pages, each to its own file.
+
+        With `workers > 1` the pages are rendered in parallel worker processes, in
+        that case their params must be picklable (i.e. no lazy iterables).
+        """
+        from functools import partial
+        from piter.utils.parallel import ordered_map
+
+        for _ in ordered_map(partial(_dump_page, self), pages, workers=workers):
+            pass
+
+
+def _dump_page(renderer: HTMLRenderer, page: t.Tuple[t.Any, t.Any]) -> None:
+    data, output = page
+    renderer.dump(data, output)
+
+
+class ImagesTableSimpleParams(GlobalParams):
+    title: str = "Images Table"
+    keys: t.List[str] = []
+    # rows are neither validated nor copied, they may be lazy iterables
+    images: pyd.SkipValidation[t.Iterable[t.Mapping[str, str]]]
+    mkeys: t.List[str] = []
+    metadatas: pyd.SkipValidation[t.Iterable[t.Mapping[str, t.Mapping[str, t.Any]]]] = (
+        []
+    )
+    group_size: t.Optional[int] = None
+    show_indices: bool = True
+    # the number of rows preceding the first one, e.g. on previous pages
+    start_index: int = 0
+    # rows are emitted as JSON and only the visible ones are built in the browser
+    virtual: bool = False
+    # the JSON data islands are gzipped, and inflated by the browser
+    compress: bool = False
+    # a `DataURLStore`: images are ids of payloads stored once in the document
+    assets: t.Any = None
+
+
+class ImagesTableSimple(HTMLRenderer[ImagesTableSimpleParams]):
+    template_path: str = TemplatesCollection.IMAGES_TABLE_SIMPLE
+
+
+class ImagesClustersSimpleParams(GlobalParams):
+    title: str = "Images Clusters"
+    # cluster members are neither validated nor copied, they may be lazy iterables
+    images_clusters: pyd.SkipValidation[t.Mapping[int, t.Iterable[str]]]
+    labels_colors: t.Optional[t.Dict[int, str]] = None
+    # the true number of members of each cluster, shown next to its label
+    clusters_sizes: t.Optional[t.Dict[int, int]] = None
+    # the members of larger clusters are a random sample of this many
+    max_per_cluster: t.Optional[int] = None
+    # clusters are emitted as JSON and built in the browser when expanded
+    virtual: bool = False
+    # the JSON data islands are gzipped, and inflated by the browser
+    compress: bool = False
+    # a `DataURLStore`: images are ids of payloads stored once in the document
+    assets: t.Any = None
+    # members are `Sprite`s of sprite sheets instead of image URLs
+    atlas: bool = False
+
+
+class ImagesClustersSimple(HTMLRenderer[ImagesClustersSimpleParams]):
+    template_path: str = TemplatesCollection.IMAGES_CLUSTERS_SIMPLE
+
+
+class PageLink(pyd.BaseModel):
+    label: str
+    url: str
+    count: t.Optional[int] = None
+    color: t.Optional[str] = None
+
+
+class PagesIndexParams(GlobalParams):
+    title: str = "Report"
+    pages: t.List[PageLink] = []
+
+
+class PagesIndex(HTMLRenderer[PagesIndexParams]):
+    template_path: str = TemplatesCollection.PAGES_INDEX
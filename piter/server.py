@@ -0,0 +1,403 @@
+import abc
+import base64
+import collections
+import concurrent.futures
+import threading
+import typing as t
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from piter.utils.images import ImageCache
+
+
+class ThumbnailCache:
+    """A bounded in-memory LRU of encoded images, shared by the request threads.
+
+    Missing images are encoded by a pool of `workers` threads, concurrent requests
+    of the same image wait for a single encoding. Entries are keyed by the file
+    identity and the encoding settings, so changed files are encoded again. With
+    `disk` the encoded images are also kept in an on-disk `ImageCache`.
+
+    :param settings: the options of `image_file_to_bytes` (quality, extension,
+        thumb_size, passthrough_size)
+    :param max_size: the maximum size in bytes of the in-memory entries
+    """
+
+    def __init__(
+        self,
+        settings: t.Optional[t.Dict[str, t.Any]] = None,
+        max_size: int = 256 << 20,
+        workers: int = 4,
+        disk: t.Optional[ImageCache] = None,
+    ):
+        self.settings = settings or {}
+        self.max_size = max_size
+        self.disk = disk
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "collections.OrderedDict[str, t.Tuple[bytes, str]]" = (
+            collections.OrderedDict()
+        )
+        self._pending: t.Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def key(self, path: str) -> str:
+        return ImageCache.file_key(path, **self.settings)
+
+    def get(self, path: str, key: t.Optional[str] = None) -> t.Tuple[bytes, str]:
+        """The encoded image and its MIME type, encoded now if not cached."""
+        key = key or self.key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = self._pool.submit(self._encode, path)
+        try:
+            entry = future.result()
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        self._add(key, entry)
+        return entry
+
+    def _add(self, key: str, entry: t.Tuple[bytes, str]) -> None:
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self.size += len(entry[0])
+            while self.size > self.max_size and len(self._entries) > 1:
+                _, (data, _) = self._entries.popitem(last=False)
+                self.size -= len(data)
+
+    def _encode(self, path: str) -> t.Tuple[bytes, str]:
+        from piter.utils.images import image_file_to_base64_url, image_file_to_bytes
+
+        if self.disk is not None:
+            # the disk cache stores data URLs, decoding them is cheap
+            url = image_file_to_base64_url(path, cache=self.disk, **self.settings)
+            header, payload = url.split(",", 1)
+            return base64.b64decode(payload), header[len("data:") :].split(";")[0]
+        data, image_format = image_file_to_bytes(path, **self.settings)
+        return data, f"image/{image_format}"
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
+
+
+class ReportView(abc.ABC):
+    """What a `ReportServer` serves: numbered pages and the images they show.
+
+    Pages link their images as `image_url(sample, key)`, which the server resolves
+    with `image_path`. Only the items accepted by `is_image` (if given) are
+    served, so that other items (e.g. metadata) never reach the encoder.
+    """
+
+    title: str = "Report"
+    is_image: t.Optional[t.Callable[[t.Any], bool]] = None
+
+    @abc.abstractmethod
+    def page_count(self) -> int:
+        pass
+
+    @abc.abstractmethod
+    def render_page(self, number: int) -> t.Iterator[str]:
+        """Renders the page `number` (from 1) in chunks."""
+
+    def render_index(self) -> t.Optional[t.Iterator[str]]:
+        """Renders the index page, if None the first page is the index."""
+        return None
+
+    @abc.abstractmethod
+    def image_path(self, sample: int, key: str) -> t.Optional[str]:
+        pass
+
+    def _item_path(self, item: t.Any) -> t.Optional[str]:
+        if self.is_image is not None and not self.is_image(item):
+            return None
+        sources = getattr(item, "local_sources", None)
+        return str(sources[0]) if sources else None
+
+    def pagination(self, number: int):
+        from piter.renderers.html import Pagination
+
+        total = self.page_count()
+        return Pagination(
+            index="/",
+            current=number,
+            total=total,
+            previous=f"/page/{number - 1}" if number > 1 else None,
+            next=f"/page/{number + 1}" if number < total else None,
+        )
+
+
+def image_url(sample: int, key: str) -> str:
+    return f"/image/{sample}/{urllib.parse.quote(key)}"
+
+
+class TableView(ReportView):
+    """The samples of a dataset as an images table, `page_size` rows per page.
+
+    :param read_row: reads a sample as `(image keys, metadata)`, called only for
+        the rows of the requested page
+    :param is_image: whether an item is an image that can be served
+    """
+
+    def __init__(
+        self,
+        dataset: t.Sequence[t.Mapping[str, t.Any]],
+        keys: t.List[str],
+        mkeys: t.List[str],
+        read_row: t.Callable[[t.Mapping[str, t.Any]], t.Tuple[t.List[str], t.Dict]],
+        title: str = "Images Table",
+        page_size: int = 100,
+        is_image: t.Optional[t.Callable[[t.Any], bool]] = None,
+    ):
+        self.dataset = dataset
+        self.keys = keys
+        self.mkeys = mkeys
+        self.read_row = read_row
+        self.title = title
+        self.page_size = page_size
+        self.is_image = is_image
+
+    def page_count(self) -> int:
+        return max(1, -(-len(self.dataset) // self.page_size))
+
+    def render_page(self, number: int) -> t.Iterator[str]:
+        from piter.renderers.html import ImagesTableSimple, ImagesTableSimpleParams
+
+        start = (number - 1) * self.page_size
+        stop = min(start + self.page_size, len(self.dataset))
+        images, metadatas = [], []
+        for sample in range(start, stop):
+            keys, metadata = self.read_row(self.dataset[sample])
+            images.append({key: image_url(sample, key) for key in keys})
+            metadatas.append(metadata)
+        params = ImagesTableSimpleParams(
+            title=self.title,
+            keys=self.keys,
+            images=images,
+            mkeys=self.mkeys,
+            metadatas=metadatas,
+            start_index=start,
+            pagination=self.pagination(number) if self.page_count() > 1 else None,
+        )
+        return ImagesTableSimple().stream(params)
+
+    def image_path(self, sample: int, key: str) -> t.Optional[str]:
+        if not 0 <= sample < len(self.dataset) or key not in self.keys:
+            return None
+        return self._item_path(self.dataset[sample].get(key))
+
+
+class ClustersView(ReportView):
+    """The samples of a dataset grouped by label, one page per `page_size` members.
+
+    The labels are read once, at the first request that needs them, the images are
+    only encoded when the browser requests them.
+
+    :param read_label: reads the `(label, color)` of a sample, or None to skip it
+    :param is_image: whether an item is an image that can be served
+    """
+
+    def __init__(
+        self,
+        dataset: t.Sequence[t.Mapping[str, t.Any]],
+        image_key: str,
+        read_label: t.Callable[[t.Mapping[str, t.Any]], t.Optional[t.Tuple]],
+        title: str = "Images Clusters",
+        page_size: int = 100,
+        is_image: t.Optional[t.Callable[[t.Any], bool]] = None,
+    ):
+        self.dataset = dataset
+        self.image_key = image_key
+        self.read_label = read_label
+        self.title = title
+        self.page_size = page_size
+        self.is_image = is_image
+        self._pages: t.Optional[t.List[t.Tuple[t.Any, t.List[int], str]]] = None
+        self._colors: t.Dict[t.Any, str] = {}
+        self._sizes: t.Dict[t.Any, int] = {}
+        self._lock = threading.Lock()
+
+    def _clusters(self) -> t.List[t.Tuple[t.Any, t.List[int], str]]:
+        # the pages as (label, samples, part), larger clusters span several pages
+        with self._lock:
+            if self._pages is None:
+                clusters: t.Dict[t.Any, t.List[int]] = {}
+                for sample in range(len(self.dataset)):
+                    label = self.read_label(self.dataset[sample])
+                    if label is None:
+                        continue
+                    label, color = label
+                    clusters.setdefault(label, []).append(sample)
+                    self._colors.setdefault(label, color)
+                self._sizes = {
+                    label: len(samples) for label, samples in clusters.items()
+                }
+                self._pages = []
+                for label, samples in clusters.items():
+                    chunks = range(0, len(samples), self.page_size)
+                    for chunk, start in enumerate(chunks, start=1):
+                        part = f" ({chunk}/{len(chunks)})" if len(chunks) > 1 else ""
+                        chunk_samples = samples[start : start + self.page_size]
+                        self._pages.append((label, chunk_samples, part))
+            return self._pages
+
+    def page_count(self) -> int:
+        return max(1, len(self._clusters()))
+
+    def render_index(self) -> t.Iterator[str]:
+        from piter.renderers.html import PageLink, PagesIndex, PagesIndexParams
+
+        links = [
+            PageLink(
+                label=f"Cluster {label}{part}",
+                url=f"/page/{number}",
+                count=len(samples),
+                color=self._colors[label],
+            )
+            for number, (label, samples, part) in enumerate(self._clusters(), start=1)
+        ]
+        return PagesIndex().stream(PagesIndexParams(title=self.title, pages=links))
+
+    def render_page(self, number: int) -> t.Iterator[str]:
+        from piter.renderers.html import ImagesClustersSimple
+        from piter.renderers.html import ImagesClustersSimpleParams
+
+        pages = self._clusters()
+        label, samples, part = pages[number - 1] if pages else (None, [], "")
+        clusters = {}
+        if label is not None:
+            clusters[label] = [image_url(sample, self.image_key) for sample in samples]
+        params = ImagesClustersSimpleParams(
+            title=f"{self.title} - Cluster {label}{part}",
+            images_clusters=clusters,
+            labels_colors=self._colors,
+            clusters_sizes=self._sizes,
+            pagination=self.pagination(number),
+        )
+        return ImagesClustersSimple().stream(params)
+
+    def image_path(self, sample: int, key: str) -> t.Optional[str]:
+        if not 0 <= sample < len(self.dataset) or key != self.image_key:
+            return None
+        return self._item_path(self.dataset[sample].get(key))
+
+
+class ReportServer(ThreadingHTTPServer):
+    """A local HTTP server of a report, rendering pages and images on request.
+
+    Routes: `/` (the index), `/page/<number>` and `/image/<sample>/<key>`.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: t.Tuple[str, int],
+        view: ReportView,
+        thumbnails: ThumbnailCache,
+        verbose: bool = False,
+    ):
+        super().__init__(address, _ReportHandler)
+        self.view = view
+        self.thumbnails = thumbnails
+        self.verbose = verbose
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.thumbnails.close()
+
+
+class _ReportHandler(BaseHTTPRequestHandler):
+    server: ReportServer
+
+    def do_GET(self) -> None:
+        parts = urllib.parse.urlsplit(self.path).path.strip("/").split("/")
+        try:
+            if parts == [""]:
+                self._index()
+            elif len(parts) == 2 and parts[0] == "page" and parts[1].isdigit():
+                self._page(int(parts[1]))
+            elif len(parts) == 3 and parts[0] == "image" and parts[1].isdigit():
+                self._image(int(parts[1]), urllib.parse.unquote(parts[2]))
+            else:
+                self.send_error(HTTPStatus.NOT_FOUND)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the browser went away, e.g. a page was left while loading
+
+    def _index(self) -> None:
+        chunks = self.server.view.render_index()
+        if chunks is None:
+            self.send_response(HTTPStatus.FOUND)
+            self.send_header("Location", "/page/1")
+            self.end_headers()
+            return
+        self._html(chunks)
+
+    def _page(self, number: int) -> None:
+        if not 1 <= number <= self.server.view.page_count():
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self._html(self.server.view.render_page(number))
+
+    def _html(self, chunks: t.Iterator[str]) -> None:
+        # streamed as rendered, the connection is closed at the end (HTTP/1.0)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk.encode("utf-8"))
+
+    def _image(self, sample: int, key: str) -> None:
+        path = self.server.view.image_path(sample, key)
+        if path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            etag = f'"{self.server.thumbnails.key(path)}"'
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.end_headers()
+            return
+        try:
+            data, mime = self.server.thumbnails.get(path, etag.strip('"'))
+        except Exception as e:
+            # e.g. a corrupt file, the other images are still served
+            self.log_error("Cannot encode %s: %r", path, e)
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, "Cannot encode the image")
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: t.Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
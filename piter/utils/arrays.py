@@ -0,0 +1,159 @@
+import functools
+import typing as t
+
+import numpy as np
+
+from piter.utils.images import ArraySource, MATERIAL_DESIGN_COLORS_LIST
+from piter.utils.profiling import stage
+
+if t.TYPE_CHECKING:
+    from PIL import Image
+
+# polynomial fits of the colormaps, evaluated once into 256 entries lookup tables
+_VIRIDIS = [
+    (0.2777273272234177, 0.005407344544966578, 0.3340998053353061),
+    (0.1050930431085774, 1.404613529898575, 1.384590162594685),
+    (-0.3308618287255563, 0.214847559468213, 0.09509516302823659),
+    (-4.634230498983486, -5.799100973351585, -19.33244095627987),
+    (6.228269936347081, 14.17993336680509, 56.69055260068105),
+    (4.776384997670288, -13.74514537774601, -65.35303263337234),
+    (-5.435455855934631, 4.645852612178535, 26.3124352495832),
+]
+_TURBO = [
+    (0.13572138, 0.09140261, 0.10667330),
+    (4.61539260, 2.19418839, 12.64194608),
+    (-42.66032258, 4.84296658, -60.58204836),
+    (132.13108234, -14.18503333, 110.36276771),
+    (-152.94239396, 4.27729857, -89.90310912),
+    (59.28637943, 2.82956604, 27.34824973),
+]
+_COLORMAP_FITS = {"viridis": _VIRIDIS, "turbo": _TURBO, "gray": [(0, 0, 0), (1, 1, 1)]}
+
+COLORMAPS = tuple(_COLORMAP_FITS)
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_lut(name: str) -> np.ndarray:
+    """The `(256, 3)` uint8 lookup table of a colormap, one of `COLORMAPS`."""
+    if name not in _COLORMAP_FITS:
+        raise ValueError(f"Unknown colormap {name}, expected one of {COLORMAPS}")
+    x = np.linspace(0.0, 1.0, 256)[:, None]
+    coefficients = np.asarray(_COLORMAP_FITS[name])
+    powers = x ** np.arange(len(coefficients))
+    return np.clip(np.rint(powers @ coefficients * 255), 0, 255).astype(np.uint8)
+
+
+def load_array(path: str) -> np.ndarray:
+    """The values of an array file (`.npy`, `.txt`) or of an image file."""
+    with stage("decode"):
+        if path.endswith(".npy"):
+            return np.load(path, allow_pickle=False)
+        if path.endswith(".txt"):
+            return np.loadtxt(path)
+        from PIL import Image
+
+        with Image.open(path) as image:
+            return np.asarray(image)
+
+
+def colorize_labels(labels: np.ndarray) -> np.ndarray:
+    """The RGB image of a label mask, with the colors of `label_to_color`.
+
+    The background (label 0) is black.
+    """
+    palette = np.asarray(MATERIAL_DESIGN_COLORS_LIST, dtype=np.uint8)
+    labels = labels.astype(np.int64, copy=False)
+    rgb = palette[np.mod(labels, len(palette))]
+    rgb[labels == 0] = 0
+    return rgb
+
+
+def normalize(values: np.ndarray) -> np.ndarray:
+    """The values of an array scaled from their finite range to uint8.
+
+    Non-finite values (e.g. missing depths) are 0.
+    """
+    values = values.astype(np.float32, copy=False)
+    finite = np.isfinite(values)
+    scaled = np.zeros(values.shape, dtype=np.uint8)
+    if finite.any():
+        low, high = values[finite].min(), values[finite].max()
+        scale = 255.0 / (high - low) if high > low else 0.0
+        scaled[finite] = np.rint(np.clip((values[finite] - low) * scale, 0, 255))
+    return scaled
+
+
+def colorize_values(values: np.ndarray, colormap: str = "viridis") -> np.ndarray:
+    """The RGB image of a single-channel array, normalized to its finite range.
+
+    Non-finite values are black.
+    """
+    rgb = colormap_lut(colormap)[normalize(values)]
+    rgb[~np.isfinite(values)] = 0
+    return rgb
+
+
+def blend(
+    image: np.ndarray, colors: np.ndarray, where: np.ndarray, alpha: float
+) -> np.ndarray:
+    """Draws `colors` over an RGB `image` with opacity `alpha`, only `where` set."""
+    blended = image.astype(np.float32)
+    blended[where] = blended[where] * (1.0 - alpha) + colors[where] * alpha
+    return np.rint(blended).astype(np.uint8)
+
+
+def _decimate(array: np.ndarray, thumb_size: t.Optional[int]) -> np.ndarray:
+    # a nearest neighbour downscale by an integer step, the exact size is reached
+    # by the final resize of the (much smaller) rendered image
+    step = array.shape[0] // thumb_size if thumb_size else 1
+    return array[::step, ::step] if step > 1 else array
+
+
+def _nearest_resize(labels: np.ndarray, thumb_size: t.Optional[int]) -> np.ndarray:
+    # labels are resampled, not interpolated: blending them would make colors
+    # (and labels) that are not in the mask
+    height, width = labels.shape[:2]
+    if not thumb_size or height <= thumb_size:
+        return labels
+    size = max(1, round(width * thumb_size / height))
+    rows = (np.arange(thumb_size) * height) // thumb_size
+    cols = (np.arange(size) * width) // size
+    return labels[rows[:, None], cols]
+
+
+def render_source(
+    source: ArraySource, thumb_size: t.Optional[int] = None
+) -> "Image.Image":
+    """Renders an `ArraySource` to an RGB image, on whole arrays.
+
+    Arrays taller than `thumb_size` are downscaled before being colored, masks
+    to exactly `thumb_size` by nearest neighbour, so that they are not resized
+    (and their colors blended) once rendered.
+    """
+    from PIL import Image
+
+    array = load_array(source.path)
+    if array.ndim == 3 and array.shape[-1] == 1:
+        array = array[..., 0]
+    if array.ndim not in (2, 3):
+        raise ValueError(f"Cannot render an array of shape {array.shape}")
+    array = _decimate(array, thumb_size)
+
+    with stage("colormap"):
+        if source.mode == "mask":
+            labels = array if array.ndim == 2 else array[..., 0]
+            labels = _nearest_resize(labels, thumb_size)
+            rgb = colorize_labels(labels)
+            if source.overlay:
+                height, width = labels.shape
+                with Image.open(source.overlay) as overlay:
+                    overlay.draft("RGB", (width, height))
+                    base = overlay.convert("RGB").resize((width, height))
+                rgb = blend(np.asarray(base), rgb, labels != 0, source.alpha)
+        elif array.ndim == 3:
+            rgb = array[..., :3]
+            if rgb.dtype != np.uint8:
+                rgb = normalize(rgb)
+        else:
+            rgb = colorize_values(array, source.colormap)
+    return Image.fromarray(np.ascontiguousarray(rgb))
@@ -0,0 +1,80 @@
+import typing as t
+
+from piter.utils.images import resize_to_thumbnail
+from piter.utils.profiling import stage
+
+if t.TYPE_CHECKING:
+    from PIL import Image
+
+
+class Sheet(t.NamedTuple):
+    """A sprite sheet: the URL of its image and its size in pixels."""
+
+    url: str
+    width: int
+    height: int
+
+
+class Sprite(t.NamedTuple):
+    """An image packed into a `Sheet`, at `(x, y)` with the given size."""
+
+    sheet: Sheet
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def sheet_capacity(thumb_size: int, atlas_size: int) -> int:
+    """The number of thumbnails of a sheet, as many square ones as fit in it."""
+    return max(1, atlas_size // thumb_size) ** 2
+
+
+def shelf_pack(
+    sizes: t.Sequence[t.Tuple[int, int]], shelf_height: int, max_width: int
+) -> t.Tuple[t.List[t.Tuple[int, int]], int, int]:
+    """Places rectangles at most `shelf_height` tall on shelves, in order.
+
+    Each shelf is filled left to right up to `max_width` (or the widest
+    rectangle), then the next one starts below it.
+
+    :return: the `(x, y)` of each rectangle and the width and height of the sheet
+    """
+    max_width = max([max_width] + [width for width, _ in sizes])
+    positions, x, y, width = [], 0, 0, 0
+    for w, _ in sizes:
+        if x > 0 and x + w > max_width:
+            x, y = 0, y + shelf_height
+        positions.append((x, y))
+        x += w
+        width = max(width, x)
+    height = y + shelf_height if sizes else 0
+    return positions, width, height
+
+
+def pack_sheet(
+    paths: t.Sequence[str], thumb_size: int, atlas_size: int
+) -> t.Tuple["Image.Image", t.List[t.Tuple[int, int, int, int]]]:
+    """Packs the thumbnails of image files, at most `thumb_size` tall, in a sheet.
+
+    The sheet is `atlas_size` pixels wide (unless a thumbnail is wider) and as
+    tall as its shelves.
+
+    :return: the RGB sheet and the `(x, y, width, height)` of each image
+    """
+    from PIL import Image
+
+    thumbnails = []
+    for path in paths:
+        with Image.open(path) as image:
+            thumbnail = resize_to_thumbnail(image, thumb_size)
+            with stage("decode"):
+                thumbnails.append(thumbnail.convert("RGB"))
+
+    sizes = [thumbnail.size for thumbnail in thumbnails]
+    positions, width, height = shelf_pack(sizes, thumb_size, atlas_size)
+    with stage("atlas"):
+        sheet = Image.new("RGB", (max(width, 1), max(height, 1)))
+        for thumbnail, position in zip(thumbnails, positions):
+            sheet.paste(thumbnail, position)
+    return sheet, [position + size for position, size in zip(positions, sizes)]
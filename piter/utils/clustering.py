@@ -0,0 +1,121 @@
+import typing as t
+
+import numpy as np
+
+from piter.utils.profiling import stage
+
+
+class KMeansResult(t.NamedTuple):
+    """The clusters of the points: the label of each point, its squared distance
+    to the centroid of its cluster and the centroids."""
+
+    labels: np.ndarray
+    distances: np.ndarray
+    centroids: np.ndarray
+
+
+def assign(
+    points: np.ndarray, centroids: np.ndarray, chunk_size: int = 1 << 15
+) -> t.Tuple[np.ndarray, np.ndarray]:
+    """The nearest centroid of each point and the squared distance to it.
+
+    Points are processed in chunks, so that at most `chunk_size` rows of
+    distances are held at once.
+    """
+    labels = np.empty(len(points), dtype=np.int64)
+    distances = np.empty(len(points), dtype=np.float32)
+    norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start : start + chunk_size]
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, |x|^2 does not change the nearest
+        partial = norms - 2.0 * (chunk @ centroids.T)
+        nearest = partial.argmin(axis=1)
+        labels[start : start + len(chunk)] = nearest
+        closest = partial[np.arange(len(chunk)), nearest]
+        closest += np.einsum("ij,ij->i", chunk, chunk)
+        distances[start : start + len(chunk)] = np.maximum(closest, 0.0)
+    return labels, distances
+
+
+def _init_centroids(sample: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    # k-means++: each centroid is drawn with probability proportional to the
+    # squared distance to the closest centroid drawn so far
+    centroids = np.empty((k, sample.shape[1]), dtype=np.float32)
+    centroids[0] = sample[rng.integers(len(sample))]
+    closest = ((sample - centroids[0]) ** 2).sum(axis=1, dtype=np.float64)
+    for index in range(1, k):
+        total = closest.sum()
+        if total > 0:
+            pick = rng.choice(len(sample), p=closest / total)
+        else:
+            pick = rng.integers(len(sample))
+        centroids[index] = sample[pick]
+        distances = ((sample - centroids[index]) ** 2).sum(axis=1, dtype=np.float64)
+        np.minimum(closest, distances, out=closest)
+    return centroids
+
+
+def minibatch_kmeans(
+    points: np.ndarray,
+    k: int,
+    seed: int = 0,
+    batch_size: int = 1024,
+    iterations: int = 300,
+    tolerance: float = 1e-4,
+) -> KMeansResult:
+    """Clusters the rows of `points` with mini-batch k-means (Sculley, 2010).
+
+    The centroids are seeded with k-means++ on a sample of the points, then each
+    iteration moves them towards the mean of their points in a random batch,
+    with a learning rate decreasing with the points they got so far. Besides
+    `points`, the memory used only depends on `k`, `batch_size` and the chunks
+    of `assign`, so `points` can be a memory-mapped array.
+
+    :param points: a `(n, d)` array, one point per row
+    :param k: the number of clusters, at most `n`
+    :param seed: the seed of the random choices, the same seed gives the same
+        clusters
+    :param batch_size: the number of points of each iteration
+    :param iterations: the maximum number of iterations
+    :param tolerance: the iterations stop when the centroids move less than this,
+        relative to the variance of the points
+    """
+    points = np.asarray(points, dtype=np.float32)
+    if points.ndim != 2 or len(points) == 0:
+        raise ValueError(f"Expected a non empty (n, d) array, got {points.shape}")
+    if k < 1:
+        raise ValueError(f"Expected at least 1 cluster, got {k}")
+    k = min(k, len(points))
+    rng = np.random.default_rng(seed)
+
+    with stage("kmeans"):
+        size = min(len(points), max(batch_size, 32 * k))
+        sample = points[np.sort(rng.choice(len(points), size, replace=False))]
+        centroids = _init_centroids(sample, k, rng)
+        threshold = tolerance * float(sample.var(axis=0).sum())
+
+        counts = np.zeros(k, dtype=np.float64)
+        one_hot = np.zeros((k, min(batch_size, len(points))), dtype=np.float32)
+        for _ in range(iterations):
+            if len(points) <= batch_size:
+                batch = points  # a full batch, as plain k-means
+            else:
+                batch = points[np.sort(rng.integers(0, len(points), batch_size))]
+            labels, _ = assign(batch, centroids)
+            batch_counts = np.bincount(labels, minlength=k)
+            # the sums of the points of each centroid, as one product
+            one_hot[:] = 0.0
+            one_hot[labels, np.arange(len(batch))] = 1.0
+            sums = one_hot @ batch
+
+            moved = batch_counts > 0
+            counts += batch_counts
+            rate = (batch_counts[moved] / counts[moved])[:, None]
+            means = sums[moved] / batch_counts[moved][:, None]
+            step = rate * (means - centroids[moved])
+            centroids[moved] += step
+            if (step**2).sum(axis=1).max() <= threshold:
+                break
+
+        labels, distances = assign(points, centroids)
+    return KMeansResult(labels, distances, centroids)
@@ -1,39 +1,503 @@
-import numpy as np
-from PIL import Image
 import io
 import base64
 import typing as t
-import colour
 import pathlib as pl
+import hashlib
+import json
+import os
+import tempfile
+
+from piter.utils.profiling import stage
+
+if t.TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+
+class ArraySource(t.NamedTuple):
+    """A file rendered to an image from its values, e.g. a mask or a depth map.
+
+    :param path: the image or array (`.npy`, `.txt`, TIFF) file
+    :param mode: "mask" for label masks, drawn with a color per label (0 being the
+        background), or "auto" for single-channel arrays, drawn with `colormap`,
+        and color arrays, drawn as they are
+    :param colormap: the colormap of single-channel arrays (see `COLORMAPS`)
+    :param overlay: an image file the mask is drawn over, if any
+    :param alpha: the opacity of the mask drawn over `overlay`
+    """
+
+    path: str
+    mode: str = "auto"
+    colormap: str = "viridis"
+    overlay: t.Optional[str] = None
+    alpha: float = 0.5
+
+
+class ImageCache:
+    """A persistent on-disk cache of encoded images (data URLs).
+
+    Entries are stored as one file each under `root`, named after a hash of the
+    source identity and of the encoding settings, so any change to either results
+    in a different entry. The total size of the cache is capped at `max_size` bytes,
+    least recently used entries are evicted first by `prune`.
+
+    :param root: the cache folder, created if missing
+    :param max_size: the maximum size of the cache in bytes
+    """
+
+    def __init__(self, root: t.Union[str, pl.Path], max_size: int = 1 << 30):
+        self.root = pl.Path(root)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: t.Any, **settings: t.Any) -> str:
+        payload = json.dumps([parts, sorted(settings.items())], default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def file_key(cls, path: t.Union[str, pl.Path], **settings: t.Any) -> str:
+        """The key of an image file: its path, mtime and size plus the settings."""
+        stat = os.stat(path)
+        return cls.make_key(
+            os.path.abspath(path), stat.st_mtime_ns, stat.st_size, **settings
+        )
+
+    @classmethod
+    def source_key(
+        cls, source: t.Union[str, pl.Path, ArraySource], **settings: t.Any
+    ) -> str:
+        """The key of an image file or of an `ArraySource`, plus the settings."""
+        if not isinstance(source, ArraySource):
+            return cls.file_key(source, **settings)
+        overlay = cls.file_key(source.overlay) if source.overlay else None
+        rendering = [source.mode, source.colormap, overlay, source.alpha]
+        return cls.file_key(source.path, rendering=rendering, **settings)
+
+    @classmethod
+    def array_key(cls, array: "np.ndarray", **settings: t.Any) -> str:
+        """The key of an image array: a hash of its content plus the settings."""
+        import numpy as np
+
+        array = np.ascontiguousarray(array)
+        digest = hashlib.sha1(array.data).hexdigest()
+        return cls.make_key(digest, array.shape, str(array.dtype), **settings)
+
+    def _entry(self, key: str) -> pl.Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> t.Optional[str]:
+        entry = self._entry(key)
+        try:
+            with stage("cache") as measure:
+                value = entry.read_text()
+                measure.bytes = len(value)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        # the mtime of an entry is its last access, used for LRU eviction
+        os.utime(entry)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        entry = self._entry(key)
+        entry.parent.mkdir(exist_ok=True)
+        # write and rename, so concurrent readers never see a partial entry
+        with stage("cache", len(value)):
+            fd, tmp = tempfile.mkstemp(dir=entry.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(value)
+            os.replace(tmp, entry)
+
+    def prune(self) -> int:
+        """Evicts the least recently used entries until the cache fits `max_size`.
+
+        :return: the number of evicted entries
+        """
+        entries = []
+        for entry in self.root.glob("??/*"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, entry in sorted(entries, key=lambda x: x[0]):
+            if total <= self.max_size:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
+
+
+def file_digest(path: t.Union[str, pl.Path], chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DataURLStore:
+    """Deduplicates the images of a document, each distinct one is stored once.
+
+    `add` maps a data URL to a short id, identical payloads get the same id. The
+    payloads not yet written to the document are handed out by `flush`, so that
+    they can be emitted while streaming instead of being kept in memory.
+
+    Source files can be resolved to the id of a previous identical file before
+    being encoded again: files are compared by content hash, which is computed
+    only for files whose size matches one already added.
+    """
+
+    def __init__(self):
+        self.references = 0
+        self.unique = 0
+        self.generation = -1
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the stored payloads, e.g. to start a new document.
+
+        The statistics are kept across resets, ids handed out before a reset can
+        be detected by comparing the `generation` they were obtained in.
+        """
+        self.generation += 1
+        self._ids: t.Dict[str, str] = {}
+        self._pending: t.Dict[str, str] = {}
+        self._sources: t.Dict[t.Tuple[int, str], str] = {}
+        self._unhashed: t.Dict[int, t.Tuple[str, str]] = {}
+        self._hashed_sizes: t.Set[int] = set()
+
+    def add(self, data_url: str) -> str:
+        self.references += 1
+        digest = hashlib.sha1(data_url.encode("utf-8")).hexdigest()
+        asset_id = self._ids.get(digest)
+        if asset_id is None:
+            asset_id = self._ids[digest] = f"a{len(self._ids)}"
+            self._pending[asset_id] = data_url
+            self.unique += 1
+        return asset_id
+
+    def flush(self) -> t.Dict[str, str]:
+        """The payloads added since the last flush, by id."""
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def reuse(self, asset_id: str) -> str:
+        """Counts a new reference to an already stored payload."""
+        self.references += 1
+        return asset_id
+
+    def source_id(self, path: t.Union[str, pl.Path]) -> t.Optional[str]:
+        """The id of a file identical to `path` added before, if any."""
+        size = os.path.getsize(path)
+        first = self._unhashed.pop(size, None)
+        if first is not None:
+            # a size collision: from now on files of this size are hashed
+            first_path, first_id = first
+            self._sources[size, file_digest(first_path)] = first_id
+            self._hashed_sizes.add(size)
+        elif size not in self._hashed_sizes:
+            return None
+        return self._sources.get((size, file_digest(path)))
+
+    def add_source(self, path: t.Union[str, pl.Path], asset_id: str) -> None:
+        """Records that `path` is encoded as `asset_id`."""
+        size = os.path.getsize(path)
+        if size in self._unhashed or size in self._hashed_sizes:
+            self._sources.setdefault((size, file_digest(path)), asset_id)
+            self._hashed_sizes.add(size)
+        else:
+            self._unhashed[size] = (str(path), asset_id)
+
+    def stats(self) -> str:
+        ratio = self.references / self.unique if self.unique else 1.0
+        return f"{self.references} images, {self.unique} unique ({ratio:.2f}x)"
+
+
+def _pil_format(extension: str) -> str:
+    extension = extension.lower()
+    return "jpeg" if extension == "jpg" else extension
+
+
+def resize_to_thumbnail(pil_img: "Image.Image", thumb_size: int) -> "Image.Image":
+    """Downscales an image so that its height is at most `thumb_size` pixels.
+
+    If the image has not been loaded yet and its codec supports it (JPEG), it is
+    decoded directly at a reduced scale. The final resize uses a bilinear filter.
+    """
+    from PIL import Image
+
+    width, height = pil_img.size
+    if height <= thumb_size:
+        return pil_img
+    size = (max(1, round(width * thumb_size / height)), thumb_size)
+    # no-op for codecs without reduced decoding or for already loaded images
+    pil_img.draft(pil_img.mode, size)
+    with stage("decode"):
+        pil_img.load()
+    with stage("resize"):
+        return pil_img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def pil_to_bytes(
+    pil_img: "Image.Image",
+    quality: int = 70,
+    extension: str = "jpeg",
+    thumb_size: t.Optional[int] = None,
+) -> bytes:
+    """Encodes an image to the bytes of an image file in the given format."""
+    extension = _pil_format(extension)
+    if thumb_size:
+        pil_img = resize_to_thumbnail(pil_img, thumb_size)
+    with stage("decode"):
+        pil_img.load()
+    if extension == "jpeg" and pil_img.mode not in ("RGB", "L"):
+        pil_img = pil_img.convert("RGB")
+
+    # Save the PIL image in memory with the specified quality
+    with stage("encode") as measure:
+        buffer = io.BytesIO()
+        pil_img.save(buffer, format=extension, quality=quality)
+        measure.bytes = buffer.tell()
+    return buffer.getvalue()
+
+
+def _bytes_to_base64_url(data: bytes, extension: str) -> str:
+    # Encode the image file in Base64
+    with stage("base64", len(data)):
+        base64_encoded = base64.b64encode(data).decode("ascii")
+
+    # Create a data URL from the Base64 encoded string
+    return f"data:image/{_pil_format(extension)};base64,{base64_encoded}"
+
+
+def pil_to_base64_url(
+    pil_img: "Image.Image",
+    quality: int = 70,
+    extension: str = "jpeg",
+    thumb_size: t.Optional[int] = None,
+):
+    data = pil_to_bytes(pil_img, quality, extension, thumb_size=thumb_size)
+    return _bytes_to_base64_url(data, extension)
 
 
 def numpy_to_base64_url(
-    numpy_img: np.ndarray,
+    numpy_img: "np.ndarray",
     quality: int = 70,
     extension: str = "jpeg",
+    cache: t.Optional[ImageCache] = None,
+    thumb_size: t.Optional[int] = None,
 ):
+    if cache is not None:
+        key = cache.array_key(
+            numpy_img, quality=quality, extension=extension, thumb_size=thumb_size
+        )
+        data_url = cache.get(key)
+        if data_url is None:
+            data_url = numpy_to_base64_url(
+                numpy_img, quality, extension, thumb_size=thumb_size
+            )
+            cache.put(key, data_url)
+        return data_url
+
+    import numpy as np
+    from PIL import Image
+
     # Convert the NumPy array to a PIL image
     pil_img = Image.fromarray(np.uint8(numpy_img))
+    return pil_to_base64_url(pil_img, quality, extension, thumb_size=thumb_size)
 
-    # Save the PIL image as a JPEG file in memory with the specified quality
-    buffer = io.BytesIO()
-    pil_img.save(buffer, format=extension, quality=quality)
-    buffer.seek(0)
 
-    # Encode the JPEG file in Base64
-    base64_encoded = base64.b64encode(buffer.getvalue()).decode("utf-8")
+# the formats browsers display natively, by file signature
+_IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+]
 
-    # Create a data URL from the Base64 encoded string
-    data_url = f"data:image/{extension};base64,{base64_encoded}"
 
-    return data_url
+def sniff_image_format(header: bytes) -> t.Optional[str]:
+    """The format of an image from its first bytes (at least 12), if known."""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    for signature, image_format in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def _passthrough_bytes(
+    image_path: str, max_bytes: int, thumb_size: t.Optional[int] = None
+) -> t.Optional[t.Tuple[bytes, str]]:
+    # the original bytes, unless too large, of an unknown format or to be resized
+    if os.path.getsize(image_path) > max_bytes:
+        return None
+    with stage("read") as measure, open(image_path, "rb") as f:
+        data = f.read()
+        measure.bytes = len(data)
+    image_format = sniff_image_format(data[:16])
+    if image_format is None:
+        return None
+    if thumb_size:
+        from PIL import Image
+
+        # only the header is parsed here, the pixels are not decoded
+        with Image.open(io.BytesIO(data)) as image:
+            if image.height > thumb_size:
+                return None
+    return data, image_format
+
+
+def image_file_to_bytes(
+    image_path: t.Union[str, pl.Path, ArraySource],
+    quality: int = 70,
+    extension: t.Optional[str] = None,
+    thumb_size: t.Optional[int] = None,
+    passthrough_size: t.Optional[int] = None,
+) -> t.Tuple[bytes, str]:
+    """Encodes an image file, see `image_file_to_base64_url` for the options.
+
+    An `ArraySource` is rendered first, by default to PNG for masks and to JPEG
+    otherwise.
+
+    :return: the encoded bytes and their format
+    """
+    if isinstance(image_path, ArraySource):
+        from piter.utils.arrays import render_source
 
+        image = render_source(image_path, thumb_size)
+        if extension is None:
+            # lossless label colors, unless drawn over a photo
+            plain_mask = image_path.mode == "mask" and not image_path.overlay
+            extension = "png" if plain_mask else "jpeg"
+        data = pil_to_bytes(image, quality, extension, thumb_size=thumb_size)
+        return data, _pil_format(extension)
 
-def image_file_to_base64_url(image_path: t.Union[str, pl.Path], quality: int = 70):
     image_path = str(image_path)
-    image = Image.open(image_path)
-    extension = image_path.split(".")[-1]
-    return numpy_to_base64_url(np.array(image), quality=quality, extension=extension)
+    if passthrough_size:
+        passthrough = _passthrough_bytes(image_path, passthrough_size, thumb_size)
+        if passthrough is not None:
+            return passthrough
+
+    from PIL import Image
+
+    if extension is None:
+        with open(image_path, "rb") as f:
+            extension = sniff_image_format(f.read(16)) or image_path.split(".")[-1]
+    with Image.open(image_path) as image:
+        data = pil_to_bytes(image, quality, extension, thumb_size=thumb_size)
+    return data, _pil_format(extension)
+
+
+def image_file_to_base64_url(
+    image_path: t.Union[str, pl.Path, ArraySource],
+    quality: int = 70,
+    extension: t.Optional[str] = None,
+    cache: t.Optional[ImageCache] = None,
+    thumb_size: t.Optional[int] = None,
+    passthrough_size: t.Optional[int] = None,
+):
+    """Encodes an image file as a base64 data URL.
+
+    :param extension: the format to re-encode to, if None the format of the file
+        (detected from its header, or else from its extension)
+    :param passthrough_size: files up to this size in bytes, in a format that
+        browsers display, are embedded as they are instead of being re-encoded,
+        unless they are taller than `thumb_size`
+    """
+    if cache is not None:
+        key = cache.source_key(
+            image_path,
+            quality=quality,
+            extension=extension,
+            thumb_size=thumb_size,
+            passthrough_size=passthrough_size,
+        )
+        data_url = cache.get(key)
+        if data_url is None:
+            data_url = image_file_to_base64_url(
+                image_path,
+                quality,
+                extension,
+                thumb_size=thumb_size,
+                passthrough_size=passthrough_size,
+            )
+            cache.put(key, data_url)
+        return data_url
+
+    data, image_format = image_file_to_bytes(
+        image_path, quality, extension, thumb_size, passthrough_size
+    )
+    return _bytes_to_base64_url(data, image_format)
+
+
+def image_file_to_asset(
+    image_path: t.Union[str, pl.Path, ArraySource],
+    assets_dir: t.Union[str, pl.Path],
+    quality: int = 70,
+    extension: t.Optional[str] = None,
+    thumb_size: t.Optional[int] = None,
+    passthrough_size: t.Optional[int] = None,
+) -> str:
+    """Encodes an image file into `assets_dir`, named after a hash of its content.
+
+    Identical images end up in the same file, which is written only once. The
+    options are those of `image_file_to_base64_url`.
+
+    :return: the name of the file in `assets_dir`
+    """
+    data, image_format = image_file_to_bytes(
+        image_path, quality, extension, thumb_size, passthrough_size
+    )
+    return _write_asset(data, image_format, assets_dir)
+
+
+def pil_to_asset(
+    pil_img: "Image.Image",
+    assets_dir: t.Union[str, pl.Path],
+    quality: int = 70,
+    extension: str = "jpeg",
+) -> str:
+    """Encodes an image into `assets_dir`, as `image_file_to_asset`.
+
+    :return: the name of the file in `assets_dir`
+    """
+    data = pil_to_bytes(pil_img, quality, extension)
+    return _write_asset(data, _pil_format(extension), assets_dir)
+
+
+def _write_asset(
+    data: bytes, image_format: str, assets_dir: t.Union[str, pl.Path]
+) -> str:
+    # named after a hash of the content, identical images are written once
+    suffix = "jpg" if image_format == "jpeg" else image_format
+    name = f"{hashlib.sha1(data).hexdigest()[:20]}.{suffix}"
+
+    target = pl.Path(assets_dir) / name
+    if not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, so concurrent workers never expose a partial file
+        with stage("write", len(data)):
+            fd, tmp = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, target)
+    return name
 
 
 MATERIAL_DESIGN_COLORS_LIST = [
@@ -82,13 +546,19 @@ def label_to_color(
     elif format == "rgba":
         return rgb + (255,)
     elif format == "hex":
-        return colour.rgb2hex(rgb)
+        return _rgb_to_hex(rgb, short=True)
 
 
 def color_rgb_to_hex(color: t.Union[t.Tuple[int, int, int], t.List[int]]) -> str:
-    c = colour.Color()
-    r = color[0] / 255
-    g = color[1] / 255
-    b = color[2] / 255
-    c.set_rgb([r, g, b])
-    return c.get_hex_l()
+    return _rgb_to_hex([c / 255 for c in color[:3]])
+
+
+def _rgb_to_hex(rgb: t.Sequence[float], short: bool = False) -> str:
+    # as `colour.rgb2hex`: components in [0, 1], `short` gives "#f00" for "#ff0000"
+    for c in rgb:
+        if not 0 <= c <= 1:
+            raise ValueError(f"Color component {c} is not in [0, 1]")
+    digits = "".join("%02x" % int(c * 255 + 0.5 - 5e-7) for c in rgb)
+    if short and digits[0::2] == digits[1::2]:
+        digits = digits[0::2]
+    return f"#{digits}"
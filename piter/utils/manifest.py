@@ -0,0 +1,111 @@
+import json
+import os
+import pathlib as pl
+import sqlite3
+import typing as t
+
+from piter.utils.images import ImageCache
+
+
+class ReportManifest:
+    """The processed samples of a report, kept next to it to update it incrementally.
+
+    Samples are identified by a fingerprint of their files (path, mtime and size),
+    the rows read from a sample are stored under its fingerprint, so that a sample
+    whose files did not change is not read again on the next build. The encoded
+    images live in an `ImageCache` in the same folder. Entries not used by a build
+    are dropped by `commit`, any change of `settings` discards all of them.
+
+    :param root: the manifest folder, created if missing
+    :param settings: the options the stored rows depend on (e.g. the keys)
+    """
+
+    VERSION = 2  # of the stored rows, older manifests are discarded
+
+    def __init__(self, root: t.Union[str, pl.Path], **settings: t.Any):
+        self.root = pl.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(str(self.root / "rows.sqlite"))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rows"
+            " (fingerprint TEXT PRIMARY KEY, row TEXT NOT NULL, build INTEGER)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)"
+        )
+        settings_key = ImageCache.make_key(version=self.VERSION, **settings)
+        stored = self._db.execute(
+            "SELECT value FROM settings WHERE name = 'settings'"
+        ).fetchone()
+        if stored is None or stored[0] != settings_key:
+            self._db.execute("DELETE FROM rows")
+            self._db.execute(
+                "INSERT OR REPLACE INTO settings VALUES ('settings', ?)",
+                (settings_key,),
+            )
+        (last_build,) = self._db.execute("SELECT MAX(build) FROM rows").fetchone()
+        self.build = (last_build or 0) + 1
+
+    @property
+    def images_dir(self) -> pl.Path:
+        return self.root / "images"
+
+    @staticmethod
+    def fingerprint(items: t.Iterable[t.Any]) -> t.Optional[str]:
+        """The fingerprint of a sample from the files of its `items`.
+
+        None if any item is not backed by files, such samples are never stored.
+        """
+        parts = []
+        for item in items:
+            sources = getattr(item, "local_sources", None)
+            if not sources:
+                return None
+            for source in sources:
+                stat = os.stat(source)
+                parts.append((os.path.abspath(source), stat.st_mtime_ns, stat.st_size))
+        return ImageCache.make_key(*parts)
+
+    def get(self, fingerprint: t.Optional[str]) -> t.Optional[t.Any]:
+        found = None
+        if fingerprint is not None:
+            found = self._db.execute(
+                "SELECT row FROM rows WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+        if found is None:
+            self.misses += 1
+            return None
+        self._db.execute(
+            "UPDATE rows SET build = ? WHERE fingerprint = ?",
+            (self.build, fingerprint),
+        )
+        self.hits += 1
+        return json.loads(found[0])
+
+    def put(self, fingerprint: t.Optional[str], row: t.Any) -> None:
+        if fingerprint is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+            (fingerprint, json.dumps(row), self.build),
+        )
+
+    def commit(self) -> int:
+        """Saves the build, dropping the entries of samples no longer found.
+
+        :return: the number of dropped entries
+        """
+        dropped = self._db.execute(
+            "DELETE FROM rows WHERE build < ?", (self.build,)
+        ).rowcount
+        self._db.commit()
+        return dropped
+
+    def close(self) -> None:
+        self._db.close()
+
+    def stats(self) -> str:
+        return f"{self.hits} unchanged, {self.misses} new or changed samples"
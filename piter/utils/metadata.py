@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import pathlib as pl
+import tempfile
+import typing as t
+
+import numpy as np
+
+from piter.utils.profiling import stage
+
+# a column: the item it is computed from and the function computing it
+ColumnSpec = t.Tuple[str, t.Callable[[t.Any], t.Any]]
+
+_MISSING = ""  # not a valid JSON document, so it cannot clash with a value
+_VERSION = 2  # of the stored values, older indices are not read
+
+
+class MetadataIndex:
+    """A columnar cache of values computed from the metadata items of a dataset.
+
+    The values of every column are stored in one `.npz` file as JSON strings, next
+    to the path, mtime and size of the item files they were computed from. Reading
+    the columns of a dataset only parses the items whose files changed since the
+    index was written, every other value comes from the single bulk load.
+
+    :param path: the index file, created or updated by `read`
+    """
+
+    def __init__(self, path: t.Union[str, pl.Path]):
+        self.path = pl.Path(path)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def in_folder(
+        cls,
+        folder: t.Union[str, pl.Path],
+        dataset_folder: t.Any,
+        columns: t.Iterable,
+        shard: t.Optional[t.Tuple[int, int]] = None,
+    ) -> "MetadataIndex":
+        """The index of a dataset and of a set of columns, stored in `folder`.
+
+        Each `(index, count)` shard of the dataset has an index of its own.
+        """
+        key = [_VERSION, os.path.abspath(dataset_folder), sorted(columns)]
+        key = json.dumps(key + [list(shard)] if shard else key)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+        return cls(pl.Path(folder) / f"{name}.npz")
+
+    def _load(self) -> t.Dict[str, t.List[t.Any]]:
+        try:
+            with stage("index"), np.load(self.path) as stored:
+                return {name: stored[name].tolist() for name in stored.files}
+        except (FileNotFoundError, ValueError, OSError):
+            return {}
+
+    def _save(self, arrays: t.Dict[str, np.ndarray]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, so that concurrent readers never see a partial index
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".npz")
+        with stage("index"), os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.path)
+
+    def read(
+        self,
+        samples: t.Iterable[t.Mapping[str, t.Any]],
+        columns: t.Dict[str, ColumnSpec],
+    ) -> t.Dict[str, t.List[t.Any]]:
+        """The values of `columns` for every sample, in order.
+
+        A column `name: (item_key, fn)` holds `fn(sample[item_key])`, or None for
+        samples without that item. Items without files are always computed.
+        """
+        stored = self._load()
+        item_keys = sorted({item_key for item_key, _ in columns.values()})
+        stamps: t.Dict[str, t.List[t.Tuple[str, int, int]]] = {
+            key: [] for key in item_keys
+        }
+        values: t.Dict[str, t.List[str]] = {name: [] for name in columns}
+        changed = False
+
+        for row, sample in enumerate(samples):
+            fresh = {}
+            for key in item_keys:
+                stamp = _stamp(sample[key]) if key in sample else None
+                stamps[key].append(stamp or ("", 0, 0))
+                fresh[key] = (
+                    stamp is not None and _stored_stamp(stored, key, row) == stamp
+                )
+
+            for name, (key, fn) in columns.items():
+                column = stored.get(f"column:{name}")
+                if fresh[key] and column is not None:
+                    values[name].append(column[row])
+                    self.hits += 1
+                    continue
+                self.misses += 1
+                changed = True
+                value = None
+                if key in sample:
+                    with stage("metadata"):
+                        value = fn(sample[key])
+                values[name].append(
+                    _MISSING if value is None else json.dumps(value, default=str)
+                )
+
+        if changed or any(len(stamps[key]) != _rows(stored, key) for key in item_keys):
+            arrays = {}
+            for key, item_stamps in stamps.items():
+                paths, mtimes, sizes = (
+                    zip(*item_stamps) if item_stamps else ([], [], [])
+                )
+                arrays[f"item:{key}:path"] = np.array(paths, dtype=str)
+                arrays[f"item:{key}:mtime"] = np.array(mtimes, dtype=np.int64)
+                arrays[f"item:{key}:size"] = np.array(sizes, dtype=np.int64)
+            for name, column in values.items():
+                arrays[f"column:{name}"] = np.array(column, dtype=str)
+            self._save(arrays)
+
+        return {
+            name: [None if value == _MISSING else json.loads(value) for value in column]
+            for name, column in values.items()
+        }
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return f"{self.hits} indexed, {self.misses} parsed values ({rate:.1f}% indexed)"
+
+
+def _stamp(item: t.Any) -> t.Optional[t.Tuple[str, int, int]]:
+    # the identity of the file of an item, None if not backed by a single file
+    sources = getattr(item, "local_sources", None)
+    if not sources or len(sources) != 1:
+        return None
+    try:
+        stat = os.stat(sources[0])
+    except OSError:
+        return None
+    return os.path.abspath(sources[0]), stat.st_mtime_ns, stat.st_size
+
+
+def _rows(stored: t.Dict[str, t.List[t.Any]], key: str) -> int:
+    paths = stored.get(f"item:{key}:path")
+    return -1 if paths is None else len(paths)
+
+
+def _stored_stamp(
+    stored: t.Dict[str, t.List[t.Any]], key: str, row: int
+) -> t.Optional[t.Tuple[str, int, int]]:
+    if row >= _rows(stored, key):
+        return None
+    return (
+        stored[f"item:{key}:path"][row],
+        stored[f"item:{key}:mtime"][row],
+        stored[f"item:{key}:size"][row],
+    )
@@ -0,0 +1,102 @@
+import collections
+import contextlib
+import typing as t
+
+from piter.utils.profiling import ProfiledCall, active_profiler, stage
+
+if t.TYPE_CHECKING:
+    import concurrent.futures as cf
+
+T = t.TypeVar("T")
+R = t.TypeVar("R")
+
+_shared_executor: t.Optional["cf.ProcessPoolExecutor"] = None
+
+
+@contextlib.contextmanager
+def shared_pool(workers: int) -> t.Iterator[None]:
+    """Makes the `ordered_map` calls within the context share one process pool.
+
+    The pool of `workers` processes is started once, instead of once per call,
+    and is used by every call asking for more than one worker.
+    """
+    import concurrent.futures as cf
+
+    global _shared_executor
+    if workers <= 1 or _shared_executor is not None:
+        yield
+        return
+    with cf.ProcessPoolExecutor(max_workers=workers) as executor:
+        _shared_executor = executor
+        try:
+            yield
+        finally:
+            _shared_executor = None
+
+
+def ordered_map(
+    fn: t.Callable[[T], R],
+    iterable: t.Iterable[T],
+    workers: int = 1,
+    window: t.Optional[int] = None,
+) -> t.Iterator[R]:
+    """Lazily maps `fn` over `iterable` on a pool of worker processes.
+
+    Results are yielded in input order. At most `window` items (default: four per
+    worker) are in flight at any time, so the input is consumed lazily and memory
+    stays bounded regardless of its length. With `workers <= 1` no pool is created
+    and the items are processed in the calling process. Within `shared_pool` the
+    shared pool is used instead of a new one.
+
+    :param fn: a picklable callable (e.g. a module-level function or a partial)
+    :param iterable: the input items, they must be picklable as well
+    :param workers: the number of worker processes
+    :param window: the maximum number of pending items
+    """
+    if workers <= 1:
+        yield from map(fn, iterable)
+        return
+
+    profiler = active_profiler()
+    if profiler is None:
+        yield from _pool_map(fn, iterable, workers, window)
+        return
+    # the stages measured in the workers are collected with the results
+    for result, snapshot in _pool_map(
+        ProfiledCall(fn, trace=profiler.trace), iterable, workers, window
+    ):
+        profiler.merge(snapshot)
+        yield result
+
+
+def _result(future: "cf.Future") -> t.Any:
+    # time spent waiting for the workers, when profiling
+    with stage("wait"):
+        return future.result()
+
+
+def _pool_map(
+    fn: t.Callable[[T], R],
+    iterable: t.Iterable[T],
+    workers: int,
+    window: t.Optional[int] = None,
+) -> t.Iterator[R]:
+    import concurrent.futures as cf
+
+    window = max(window or 4 * workers, 1)
+    pending: t.Deque[cf.Future] = collections.deque()
+    if _shared_executor is not None:
+        pool = contextlib.nullcontext(_shared_executor)
+    else:
+        pool = cf.ProcessPoolExecutor(max_workers=workers)
+    with pool as executor:
+        try:
+            for item in iterable:
+                if len(pending) >= window:
+                    yield _result(pending.popleft())
+                pending.append(executor.submit(fn, item))
+            while pending:
+                yield _result(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,248 @@
+import contextlib
+import functools
+import json
+import os
+import pathlib as pl
+import sys
+import threading
+import time
+import typing as t
+
+
+@functools.lru_cache(maxsize=None)
+def _peak_rss_reader() -> t.Callable[[], float]:
+    # `resource` is Unix only, elsewhere psutil is used if installed
+    try:
+        import resource
+    except ImportError:
+        pass
+    else:
+        # kilobytes on Linux, bytes on macOS
+        scale = 1 << 20 if sys.platform == "darwin" else 1024
+        return lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+    try:
+        import psutil
+    except ImportError:
+        return lambda: 0.0
+    process = psutil.Process()
+
+    def read() -> float:
+        info = process.memory_info()
+        # the peak working set on Windows, the current RSS elsewhere
+        return getattr(info, "peak_wset", info.rss) / (1 << 20)
+
+    return read
+
+
+def _peak_rss_mb() -> float:
+    return _peak_rss_reader()()
+
+
+class StageStats:
+    """The cumulative measures of a stage.
+
+    `total` includes the time of the nested stages, `self_time` does not. `peak_rss`
+    is the highest peak RSS (in MB) seen at the end of the stage, in any process.
+    """
+
+    __slots__ = ("calls", "total", "self_time", "bytes", "peak_rss")
+
+    def __init__(self, calls=0, total=0.0, self_time=0.0, bytes=0, peak_rss=0.0):
+        self.calls = calls
+        self.total = total
+        self.self_time = self_time
+        self.bytes = bytes
+        self.peak_rss = peak_rss
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "bytes", "start", "nested")
+
+    def __init__(self, profiler: "Profiler", name: str, nbytes: int):
+        self.profiler = profiler
+        self.name = name
+        self.bytes = nbytes
+
+    def __enter__(self) -> "_Stage":
+        self.nested = 0.0
+        self.profiler._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        duration = time.perf_counter() - self.start
+        stack = self.profiler._stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += duration
+        self.profiler._record(self, duration)
+
+
+class _NullStage:
+    # what `stage` returns when not profiling: a no-op with the same interface
+    bytes = 0
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """Collects the time, calls, bytes and memory of named processing stages.
+
+    Stages are measured with `stage` (or the module-level `stage` while the profiler
+    is active, see `profiling`) and can be nested. With `trace` every stage call is
+    also kept as an event, to be written as a Chrome trace (chrome://tracing or
+    https://ui.perfetto.dev).
+    """
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.stats: t.Dict[str, StageStats] = {}
+        self.events: t.List[t.Tuple[str, float, float, int, int]] = []
+        self.start = time.perf_counter()
+        self.end: t.Optional[float] = None
+        self._stack: t.List[_Stage] = []
+
+    def stage(self, name: str, nbytes: int = 0) -> _Stage:
+        """A context measuring a stage, bytes can also be set on it while running."""
+        return _Stage(self, name, nbytes)
+
+    def _record(self, stage: _Stage, duration: float) -> None:
+        stats = self.stats.get(stage.name)
+        if stats is None:
+            stats = self.stats[stage.name] = StageStats()
+        stats.calls += 1
+        stats.total += duration
+        stats.self_time += duration - stage.nested
+        stats.bytes += stage.bytes
+        stats.peak_rss = max(stats.peak_rss, _peak_rss_mb())
+        if self.trace:
+            self.events.append(
+                (stage.name, stage.start, duration, os.getpid(), threading.get_ident())
+            )
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        """The measures as plain data, e.g. to be sent from a worker process."""
+        return {
+            "stats": {name: stats.to_dict() for name, stats in self.stats.items()},
+            "events": self.events,
+        }
+
+    def merge(self, snapshot: t.Dict[str, t.Any]) -> None:
+        """Adds the measures of another profiler, e.g. of a worker process."""
+        for name, values in snapshot["stats"].items():
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = StageStats()
+            stats.calls += values["calls"]
+            stats.total += values["total"]
+            stats.self_time += values["self_time"]
+            stats.bytes += values["bytes"]
+            stats.peak_rss = max(stats.peak_rss, values["peak_rss"])
+        if self.trace:
+            self.events.extend(tuple(event) for event in snapshot["events"])
+
+    def stop(self) -> None:
+        self.end = time.perf_counter()
+
+    @property
+    def wall_time(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def summary(self) -> t.List[t.Dict[str, t.Any]]:
+        """The stages sorted by self time, with their share of the wall time.
+
+        Stages run by worker processes overlap, so the shares may add up to more
+        than 100%.
+        """
+        wall_time = self.wall_time
+        rows = []
+        for name, stats in self.stats.items():
+            rows.append(
+                {
+                    "stage": name,
+                    **stats.to_dict(),
+                    "share": stats.self_time / wall_time if wall_time else 0.0,
+                    "throughput": stats.bytes / stats.total if stats.total else 0.0,
+                }
+            )
+        return sorted(rows, key=lambda row: row["self_time"], reverse=True)
+
+    def write_json(self, path: t.Union[str, pl.Path]) -> None:
+        report = {
+            "wall_time": self.wall_time,
+            "peak_rss": _peak_rss_mb(),
+            "stages": self.summary(),
+        }
+        pl.Path(path).write_text(json.dumps(report, indent=2))
+
+    def write_trace(self, path: t.Union[str, pl.Path]) -> None:
+        """Writes the events in the Chrome trace event format."""
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.start) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, start, duration, pid, tid in self.events
+        ]
+        pl.Path(path).write_text(json.dumps({"traceEvents": events}))
+
+
+_active: t.Optional[Profiler] = None
+
+
+def active_profiler() -> t.Optional[Profiler]:
+    return _active
+
+
+@contextlib.contextmanager
+def profiling(profiler: Profiler) -> t.Iterator[Profiler]:
+    """Makes `profiler` the one measuring the `stage` calls, within the context."""
+    global _active
+    previous, _active = _active, profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        profiler.stop()
+
+
+def stage(name: str, nbytes: int = 0) -> t.Union[_Stage, _NullStage]:
+    """Measures a stage with the active profiler, if any, as a context manager.
+
+    Cheap when not profiling, so it can be left in hot paths.
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name, nbytes)
+
+
+class ProfiledCall:
+    """Wraps a function to run with its own profiler, e.g. in a worker process.
+
+    The wrapped call returns a `(result, snapshot)` pair, the snapshot is meant to
+    be merged into the profiler of the calling process.
+    """
+
+    def __init__(self, fn: t.Callable[[t.Any], t.Any], trace: bool = False):
+        self.fn = fn
+        self.trace = trace
+
+    def __call__(self, item: t.Any) -> t.Tuple[t.Any, t.Dict[str, t.Any]]:
+        with profiling(Profiler(trace=self.trace)) as profiler:
+            result = self.fn(item)
+        return result, profiler.snapshot()
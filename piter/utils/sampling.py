@@ -0,0 +1,65 @@
+import random
+import typing as t
+
+
+class Reservoir:
+    """A uniform random sample of at most `size` items of a stream (Algorithm R).
+
+    Items are offered one at a time with `add`, the stream length need not be
+    known. The same seed and the same stream always yield the same sample.
+
+    :param size: the maximum number of items kept
+    :param seed: the seed of the random choices, any hashable value
+    """
+
+    def __init__(self, size: int, seed: t.Any = 0):
+        self.size = size
+        self.count = 0
+        self._rng = random.Random(seed)
+        self._items: t.List[t.Tuple[int, t.Any]] = []
+
+    def add(self, item: t.Any) -> None:
+        if len(self._items) < self.size:
+            self._items.append((self.count, item))
+        else:
+            slot = self._rng.randrange(self.count + 1)
+            if slot < self.size:
+                self._items[slot] = (self.count, item)
+        self.count += 1
+
+    @property
+    def items(self) -> t.List[t.Any]:
+        """The sampled items, in stream order."""
+        return [item for _, item in sorted(self._items, key=lambda entry: entry[0])]
+
+
+def merge_samples(
+    streams: t.Sequence[t.Tuple[int, int]], size: int, seed: t.Any = 0
+) -> t.List[t.List[int]]:
+    """Merges uniform samples of several streams into one of their concatenation.
+
+    `streams` holds the `(count, sampled)` of each stream: its length and the size
+    of its uniform sample, of at most `size` items. Returns, for each stream, the
+    sorted positions in its sample of the items kept: together they are a uniform
+    sample of at most `size` items of all the streams.
+
+    :param streams: the length and the sample size of each stream
+    :param size: the maximum number of items kept
+    :param seed: the seed of the random choices, any hashable value
+    """
+    rng = random.Random(seed)
+    remaining = [count for count, _ in streams]
+    taken = [0] * len(streams)
+    # draws without replacement from all the items, by stream
+    for _ in range(min(size, sum(remaining))):
+        pick = rng.randrange(sum(remaining))
+        stream = 0
+        while pick >= remaining[stream]:
+            pick -= remaining[stream]
+            stream += 1
+        remaining[stream] -= 1
+        taken[stream] += 1
+    return [
+        sorted(rng.sample(range(sampled), count))
+        for (_, sampled), count in zip(streams, taken)
+    ]
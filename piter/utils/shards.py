@@ -0,0 +1,159 @@
+import json
+import os
+import pathlib as pl
+import typing as t
+import zipfile
+from urllib.parse import quote, unquote
+
+from piter.utils.profiling import stage
+
+SHARD_VERSION = 2
+_HEADER = "shard.json"
+
+
+def parse_shard(value: str) -> t.Tuple[int, int]:
+    """The `(index, count)` of a shard given as `i/N`, with `0 <= i < N`."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected i/N (e.g. 0/4)")
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard {value!r}, expected 0 <= i < N")
+    return index, count
+
+
+def shard_range(length: int, index: int, count: int) -> range:
+    """The positions of shard `index` of `count` in a sequence of `length` items.
+
+    Shards are contiguous and balanced, so that concatenating them in order gives
+    back the whole sequence.
+    """
+    return range(length * index // count, length * (index + 1) // count)
+
+
+def rebase_url(url: str, source_dir: pl.Path, target_dir: pl.Path) -> str:
+    """A URL relative to `source_dir` made relative to `target_dir`.
+
+    Data URLs and absolute paths are returned as they are.
+    """
+    if url.startswith("data:") or os.path.isabs(url):
+        return url
+    path = os.path.relpath(source_dir / unquote(url), target_dir)
+    return quote(pl.Path(path).as_posix())
+
+
+class ShardWriter:
+    """Writes the artifact of a shard, merged by `piter merge` into a report.
+
+    The artifact is a zip file of JSON lines entries, written while streaming,
+    plus a header describing the shard. Entries are compressed and can be read
+    independently of each other. The zip is written to a temporary file, renamed
+    to `path` only once closed without errors: a failed shard leaves no artifact.
+
+    :param path: the artifact file
+    :param settings: the settings shared by all the shards of a report
+    :param index: the index of the shard
+    """
+
+    def __init__(
+        self, path: t.Union[str, pl.Path], settings: t.Dict[str, t.Any], index: int
+    ):
+        self.path = pl.Path(path)
+        self.header = {"settings": {**settings, "version": SHARD_VERSION}}
+        self.header["index"] = index
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.path.with_name(f".{self.path.name}.tmp")
+        self._zip = zipfile.ZipFile(
+            self._tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1
+        )
+
+    def write(self, entry: str, records: t.Iterable[t.Any]) -> int:
+        """Streams `records` as JSON lines to `entry`, returns their number."""
+        count = 0
+        with self._zip.open(entry, "w") as f:
+            for record in records:
+                with stage("write"):
+                    f.write(json.dumps(record).encode("utf-8") + b"\n")
+                count += 1
+        return count
+
+    def close(self) -> None:
+        self._zip.writestr(_HEADER, json.dumps(self.header))
+        self._zip.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self) -> None:
+        """Discards the artifact, e.g. when the shard could not be built."""
+        self._zip.close()
+        os.remove(self._tmp)
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Shard:
+    """The artifact of a shard written by `ShardWriter`.
+
+    :param path: the artifact file
+    """
+
+    def __init__(self, path: t.Union[str, pl.Path]):
+        self.path = pl.Path(path)
+        try:
+            self._zip = zipfile.ZipFile(self.path)
+            self.header = json.loads(self._zip.read(_HEADER))
+        except (OSError, KeyError, zipfile.BadZipFile) as e:
+            raise ValueError(f"{self.path} is not a shard artifact: {e}") from e
+
+    @property
+    def index(self) -> int:
+        return self.header["index"]
+
+    @property
+    def settings(self) -> t.Dict[str, t.Any]:
+        return self.header["settings"]
+
+    def records(self, entry: str) -> t.Iterator[t.Any]:
+        """The records of `entry`, in order."""
+        if entry not in self._zip.namelist():
+            return
+        with self._zip.open(entry) as f:
+            for line in f:
+                with stage("read"):
+                    record = json.loads(line)
+                yield record
+
+    def close(self) -> None:
+        self._zip.close()
+
+
+def load_shards(paths: t.Iterable[t.Union[str, pl.Path]]) -> t.List[Shard]:
+    """The shards of a report, sorted by index.
+
+    Raises ValueError if they are incomplete, if they were not generated with the
+    same settings or if any of them is missing or repeated.
+    """
+    shards = sorted((Shard(path) for path in paths), key=lambda shard: shard.index)
+    if not shards:
+        raise ValueError("No shards to merge")
+    for shard in shards:
+        if "rows" not in shard.header and "clusters" not in shard.header:
+            raise ValueError(f"{shard.path} is an incomplete shard artifact")
+    settings = shards[0].settings
+    for shard in shards[1:]:
+        if shard.settings != settings:
+            raise ValueError(
+                f"{shard.path} and {shards[0].path} are not shards of the same report"
+            )
+    indices = [shard.index for shard in shards]
+    if indices != list(range(settings["count"])):
+        raise ValueError(
+            f"Expected the shards 0 to {settings['count'] - 1}, got {indices}"
+        )
+    return shards
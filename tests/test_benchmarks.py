@@ -0,0 +1,74 @@
+import pytest
+
+bench = pytest.importorskip("benchmarks.bench")
+pytest.importorskip("pipelime.sequences")
+
+
+def test_make_underfolder_writes_a_jpeg_png_mix(tmp_path):
+    folder = bench.make_underfolder(tmp_path / "uf", 8, (16, 12), png_ratio=0.25)
+
+    files = sorted(path.name for path in (folder / "data").iterdir())
+    assert len([name for name in files if name.endswith(".png")]) == 2
+    assert len([name for name in files if name.endswith(".jpg")]) == 6
+    assert (
+        (folder / "data" / "000003_metadata.yaml")
+        .read_text()
+        .startswith("cluster: 3\n")
+    )
+
+
+def test_cli_case_measures_a_report(tmp_path):
+    params = {
+        "data_dir": str(tmp_path),
+        "size": 4,
+        "resolution": (16, 12),
+        "command": "images_clusters_simple",
+        "embed": True,
+        "workers": 1,
+    }
+
+    result = bench._case_cli(params)
+
+    assert result["items"] == 4 and result["wall_time"] > 0 and result["bytes"] > 0
+
+
+def test_plan_and_compare():
+    cases = bench.plan([10, 100], [(8, 8), (16, 16)], "/tmp", 1, 5)
+    names = [name for name, _, _ in cases]
+
+    # 2 startups, 3 datasets x 2 commands x (embed or not), 2 x 2 encodings, 2 renders
+    assert len(names) == len(set(names)) == 2 + 12 + 4 + 2
+    assert "images_table_simple_embed[100,8x8]" in names
+
+    baseline = [{"name": "a", "wall_time": 1.0}, {"name": "b", "wall_time": 1.0}]
+    results = [{"name": "a", "wall_time": 1.05}, {"name": "b", "wall_time": 2.0}]
+    assert bench.compare(results, baseline) == ["b"]
+
+
+def test_over_budget_only_checks_startup_cases():
+    results = [
+        {"name": "startup[help]", "kind": "startup", "wall_time": 0.2},
+        {"name": "startup[image2base64]", "kind": "startup", "wall_time": 0.9},
+        {"name": "render[10]", "kind": "render", "wall_time": 5.0},
+    ]
+    assert bench.over_budget(results, 0.5) == ["startup[image2base64]"]
+
+
+def test_cli_and_utilities_defer_heavy_imports():
+    statement = "import piter.cli.cli, piter.utils.images, piter.renderers.html"
+    assert bench.imported_heavy_modules(statement) == []
+    # rendering does need them
+    assert "jinja2" in bench.imported_heavy_modules(
+        "from piter.renderers.html import ImagesTableSimple"
+    )
+
+
+def test_rss_without_the_resource_module(monkeypatch):
+    import sys
+
+    assert bench._rss_mb() > 0
+    # as on Windows, where psutil is used if installed
+    monkeypatch.setitem(sys.modules, "resource", None)
+    assert bench._rss_mb() >= 0 and bench._rss_mb(children=True) == 0.0
+    monkeypatch.setitem(sys.modules, "psutil", None)
+    assert bench._rss_mb() == 0.0
@@ -1,4 +1,5 @@
 import base64
+import io
 from pathlib import Path
 
 import pytest
@@ -38,6 +39,27 @@ def test_image2base64_command(tmp_path, monkeypatch):
     base64.b64decode(output.split(",", 1)[1])
 
 
+def test_image2base64_command_encodes_many_images(tmp_path):
+    paths = []
+    for color in ("red", "green", "blue"):
+        paths.append(tmp_path / f"{color}.png")
+        Image.new("RGB", (2, 2), color).save(paths[-1])
+    paths_file = tmp_path / "paths.txt"
+    paths_file.write_text(f"{paths[1]}\n\n{paths[2]}\n")
+
+    result = runner.invoke(
+        piter, ["image2base64", "-i", str(paths[0]), "--paths-file", str(paths_file)]
+    )
+
+    assert result.exit_code == 0
+    lines = result.stdout.splitlines()
+    assert len(lines) == 3
+    for path, line in zip(paths, lines):
+        data = base64.b64decode(line.split(",", 1)[1])
+        decoded = Image.open(io.BytesIO(data)).convert("RGB")
+        assert decoded.getpixel((0, 0)) == Image.open(path).getpixel((0, 0))
+
+
 def test_images_table_simple_command_writes_html(tmp_path, monkeypatch):
     img1 = tmp_path / "img1.png"
     Image.new("RGB", (2, 2), "blue").save(img1)
@@ -173,3 +195,814 @@ def test_images_clusters_simple_command_writes_html(tmp_path, monkeypatch):
     assert output_file.exists()
     html = output_file.read_text()
     assert str(img1) in html and str(img2) in html
+
+
+def test_images_table_simple_embeds_with_workers(tmp_path, monkeypatch):
+    paths = []
+    for idx, color in enumerate(["blue", "green", "red"]):
+        path = tmp_path / f"img{idx}.png"
+        Image.new("RGB", (2, 2), color).save(path)
+        paths.append(path)
+
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummySequence(list):
+        def map(self, *_args, **_kwargs):
+            return self
+
+    dataset = DummySequence({"image": DummyImage(path)} for path in paths)
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda _item: True)
+
+    output_file = tmp_path / "report.html"
+    result = runner.invoke(
+        piter,
+        [
+            "images_table_simple",
+            "--folder",
+            str(tmp_path),
+            "--keys",
+            "image",
+            "--embed",
+            "--workers",
+            "2",
+            "--output-file",
+            str(output_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    html = output_file.read_text()
+    expected = [
+        cli_module._embed_images(({"image": str(path)}, None), quality=50)[0]["image"]
+        for path in paths
+    ]
+    positions = [html.index(url) for url in expected]
+    assert positions == sorted(positions)
+
+
+def test_images_clusters_simple_writes_one_page_per_cluster(tmp_path, monkeypatch):
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummyMetadata:
+        def __init__(self, label):
+            self._label = label
+
+        def __call__(self):
+            return {"label": self._label}
+
+    dataset = [
+        {
+            "image": DummyImage(tmp_path / f"img{idx}.png"),
+            "metadata": DummyMetadata(label),
+        }
+        for idx, label in enumerate([0, 1, 0, 0])
+    ]
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(pli_items, "PngImageItem", DummyImage)
+
+    output_file = tmp_path / "clusters.html"
+    result = runner.invoke(
+        piter,
+        [
+            "images_clusters_simple",
+            "--folder",
+            str(tmp_path),
+            "--page-size",
+            "2",
+            "--output-file",
+            str(output_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    index = output_file.read_text()
+    pages = [(tmp_path / f"clusters_{n:03d}.html").read_text() for n in (1, 2, 3)]
+    assert "Cluster 0 (1/2)" in index and "Cluster 1" in index
+    assert "img0.png" in pages[0] and "img2.png" in pages[0]
+    assert "img3.png" in pages[1]
+    assert "img1.png" in pages[2]
+    assert not (tmp_path / "clusters_004.html").exists()
+
+
+def test_images_clusters_simple_samples_large_clusters(tmp_path, monkeypatch):
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummyMetadata:
+        def __init__(self, label):
+            self._label = label
+
+        def __call__(self):
+            return {"label": self._label}
+
+    dataset = [
+        {
+            "image": DummyImage(tmp_path / f"img{idx:02d}.png"),
+            "metadata": DummyMetadata(label),
+        }
+        for idx, label in enumerate([0] * 20 + [1] * 2)
+    ]
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(pli_items, "PngImageItem", DummyImage)
+
+    def run(output_file, seed):
+        result = runner.invoke(
+            piter,
+            [
+                "images_clusters_simple",
+                "--folder",
+                str(tmp_path),
+                "--max-per-cluster",
+                "5",
+                "--sample-seed",
+                str(seed),
+                "--output-file",
+                str(output_file),
+            ],
+        )
+        assert result.exit_code == 0
+        html = output_file.read_text()
+        return [f"img{idx:02d}.png" for idx in range(22) if f"img{idx:02d}.png" in html]
+
+    shown = run(tmp_path / "a.html", seed=0)
+    assert len([name for name in shown if name < "img20"]) == 5
+    assert "img20.png" in shown and "img21.png" in shown
+    html = (tmp_path / "a.html").read_text()
+    assert "a sample of 5 out of 20 images" in html and "2 images" in html
+    assert run(tmp_path / "b.html", seed=0) == shown
+
+
+def test_images_table_simple_dedup_embeds_identical_images_once(tmp_path, monkeypatch):
+    for idx in range(4):
+        Image.new("RGB", (2, 2), "blue" if idx % 2 else "red").save(
+            tmp_path / f"img{idx}.png"
+        )
+
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummySequence(list):
+        def map(self, *_args, **_kwargs):
+            return self
+
+    dataset = DummySequence(
+        {"image": DummyImage(tmp_path / f"img{idx}.png")} for idx in range(4)
+    )
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda _item: True)
+
+    output_file = tmp_path / "report.html"
+    result = runner.invoke(
+        piter,
+        [
+            "images_table_simple",
+            "--folder",
+            str(tmp_path),
+            "--keys",
+            "image",
+            "--embed",
+            "--dedup",
+            "--output-file",
+            str(output_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "4 images, 2 unique" in result.stdout
+    html = output_file.read_text()
+    assets = html.split('class="piter-assets">')[1:]
+    assert sum(island.count("data:image/png;base64,") for island in assets) == 2
+    assert html.count("data-asset=") == 4
+
+
+def test_images_table_simple_incremental_processes_only_changes(tmp_path, monkeypatch):
+    import os
+
+    images_dir = tmp_path / "data"
+    images_dir.mkdir()
+    for idx in range(3):
+        Image.new("RGB", (2, 2), "red").save(images_dir / f"img{idx}.png")
+
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummySequence(list):
+        def map(self, *_args, **_kwargs):
+            return self
+
+    dataset = DummySequence(
+        {"image": DummyImage(images_dir / f"img{idx}.png")} for idx in range(2)
+    )
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda _item: True)
+    encoded = []
+    embed_images = cli_module._embed_images
+
+    def counting_embed(row, **settings):
+        encoded.extend(row[0].values())
+        return embed_images(row, **settings)
+
+    monkeypatch.setattr(cli_module, "_embed_images", counting_embed)
+
+    output_file = tmp_path / "report.html"
+    args = [
+        "images_table_simple",
+        "--folder",
+        str(tmp_path),
+        "--keys",
+        "image",
+        "--embed",
+        "--incremental",
+        "--output-file",
+        str(output_file),
+    ]
+    assert runner.invoke(piter, args).exit_code == 0
+    assert len(encoded) == 2
+
+    # a new sample and a changed one
+    encoded.clear()
+    dataset.append({"image": DummyImage(images_dir / "img2.png")})
+    Image.new("RGB", (2, 2), "blue").save(images_dir / "img0.png")
+    os.utime(images_dir / "img0.png", ns=(0, 0))
+    result = runner.invoke(piter, args)
+
+    assert result.exit_code == 0
+    assert "1 unchanged, 2 new or changed samples" in result.stdout
+    assert sorted(encoded) == [
+        str(images_dir / "img0.png"),
+        str(images_dir / "img2.png"),
+    ]
+    assert (tmp_path / "report.html.manifest" / "rows.sqlite").exists()
+    assert output_file.read_text().count("data:image/png;base64,") >= 3
+
+
+def test_incremental_rows_depend_on_the_rendering_of_arrays(tmp_path, monkeypatch):
+    np = pytest.importorskip("numpy")
+
+    class DummyItem:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummyImage(DummyItem):
+        pass
+
+    class DummySequence(list):
+        def map(self, *_args, **_kwargs):
+            return self
+
+    Image.new("RGB", (8, 8), "white").save(tmp_path / "image.png")
+    np.save(tmp_path / "depth.npy", np.arange(64, dtype=np.float32).reshape(8, 8))
+    dataset = DummySequence(
+        [
+            {
+                "image": DummyImage(tmp_path / "image.png"),
+                "depth": DummyItem(tmp_path / "depth.npy"),
+            }
+        ]
+    )
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(
+        cli_module, "_is_valid_image", lambda item: isinstance(item, DummyImage)
+    )
+    monkeypatch.setattr(cli_module, "_is_array_item", lambda item: True)
+
+    output_file = tmp_path / "report.html"
+    args = ["images_table_simple", "--folder", str(tmp_path), "--incremental"]
+    args += ["--keys", "image", "--keys", "depth", "--output-file", str(output_file)]
+
+    # linked, the array is left out of the stored rows
+    assert runner.invoke(piter, args).exit_code == 0
+    assert "data:image/jpeg" not in output_file.read_text()
+
+    # embedded, the stored rows are not reused and the array is rendered
+    result = runner.invoke(piter, args + ["--embed"])
+    assert result.exit_code == 0
+    assert "0 unchanged" in result.stdout
+    assert output_file.read_text().count("data:image/jpeg") == 1
+
+
+def test_watch_rebuilds_when_the_folder_changes(tmp_path, monkeypatch):
+    import time
+
+    (tmp_path / "data").mkdir()
+    builds = []
+    sleeps = []
+
+    def fake_sleep(_seconds):
+        sleeps.append(_seconds)
+        if len(sleeps) == 1:
+            (tmp_path / "data" / "000_image.png").write_bytes(b"new")
+        elif len(sleeps) == 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(time, "sleep", fake_sleep)
+
+    cli_module._watch(tmp_path, 5, lambda: builds.append(len(builds)))
+
+    # the initial build, one after the change, none while unchanged
+    assert builds == [0, 1]
+    assert sleeps == [5, 5, 5]
+
+
+def test_images_table_simple_writes_assets_next_to_the_report(tmp_path, monkeypatch):
+    for idx in range(3):
+        Image.new("RGB", (40, 20), "blue" if idx else "red").save(
+            tmp_path / f"img{idx}.png"
+        )
+
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummySequence(list):
+        def map(self, *_args, **_kwargs):
+            return self
+
+    dataset = DummySequence(
+        {"image": DummyImage(tmp_path / f"img{idx}.png")} for idx in range(3)
+    )
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda _item: True)
+
+    output_file = tmp_path / "report" / "index.html"
+    output_file.parent.mkdir()
+    result = runner.invoke(
+        piter,
+        [
+            "images_table_simple",
+            "--folder",
+            str(tmp_path),
+            "--keys",
+            "image",
+            "--assets-dir",
+            "assets",
+            "--thumb-size",
+            "10",
+            "--workers",
+            "2",
+            "--output-file",
+            str(output_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    assets = sorted(p.name for p in (tmp_path / "report" / "assets").iterdir())
+    assert len(assets) == 2  # identical images share a file
+    html = output_file.read_text()
+    assert str(tmp_path / "img0.png") not in html
+    assert all(f'src="assets/{name}"' in html for name in assets)
+
+
+def test_images_table_simple_profile_writes_stage_summary(tmp_path, monkeypatch):
+    import json
+
+    Image.new("RGB", (8, 8), "red").save(tmp_path / "img0.png")
+
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummySequence(list):
+        def map(self, *_args, **_kwargs):
+            return self
+
+    dataset = DummySequence([{"image": DummyImage(tmp_path / "img0.png")}])
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda _item: True)
+
+    profile_file = tmp_path / "profile.json"
+    result = runner.invoke(
+        piter,
+        [
+            "images_table_simple",
+            "--folder",
+            str(tmp_path),
+            "--keys",
+            "image",
+            "--embed",
+            "--output-file",
+            str(tmp_path / "report.html"),
+            "--profile-output",
+            str(profile_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "Profile" in result.stdout
+    stages = {
+        row["stage"]: row for row in json.loads(profile_file.read_text())["stages"]
+    }
+    assert {"load", "decode", "encode", "base64", "render", "write"} <= set(stages)
+    assert stages["encode"]["calls"] == 1 and stages["base64"]["bytes"] > 0
+
+
+def test_job_args_and_cost(tmp_path):
+    (tmp_path / "data").mkdir()
+    for idx in range(3):
+        (tmp_path / "data" / f"{idx:06d}_image.png").touch()
+    job = {
+        "command": "images_table_simple",
+        "name": "table",
+        "folder": str(tmp_path),
+        "keys": ["image", "mask"],
+        "embed": True,
+        "compress": False,
+        "thumb_size": 64,
+    }
+
+    assert cli_module._job_args(job) == [
+        "images_table_simple",
+        "--folder",
+        str(tmp_path),
+        "--keys",
+        "image",
+        "--keys",
+        "mask",
+        "--embed",
+        "--no-compress",
+        "--thumb-size",
+        "64",
+    ]
+    assert cli_module._job_cost(job) == 30
+    assert cli_module._job_cost({**job, "embed": False}) == 3
+    assert cli_module._job_cost({**job, "folder": str(tmp_path / "missing")}) == 0
+
+
+def test_batch_command_runs_all_the_jobs(tmp_path, monkeypatch):
+    path = tmp_path / "img.png"
+    Image.new("RGB", (2, 2), "red").save(path)
+
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummySequence(list):
+        def map(self, *_args, **_kwargs):
+            return self
+
+    loads = []
+
+    def from_underfolder(folder):
+        loads.append(folder)
+        if "missing" in str(folder):
+            raise FileNotFoundError(folder)
+        return DummySequence([{"image": DummyImage(path)}])
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(from_underfolder),
+    )
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda _item: True)
+
+    config = tmp_path / "jobs.yaml"
+    config.write_text(f"""
+defaults:
+  folder: {tmp_path}
+  keys: [image]
+jobs:
+  - command: images_table_simple
+    name: linked
+    output_file: {tmp_path / "linked.html"}
+  - command: images_table_simple
+    name: embedded
+    embed: true
+    output_file: {tmp_path / "embedded.html"}
+  - command: images_table_simple
+    name: broken
+    folder: {tmp_path / "missing"}
+    output_file: {tmp_path / "broken.html"}
+""")
+    summary_file = tmp_path / "summary.json"
+    result = runner.invoke(
+        piter,
+        ["batch", "--config", str(config), "--summary-output", str(summary_file)],
+    )
+
+    assert result.exit_code == 1
+    assert (tmp_path / "linked.html").exists()
+    assert "data:image/" in (tmp_path / "embedded.html").read_text()
+    # the dataset shared by the two jobs is loaded once
+    assert [str(folder) for folder in loads].count(str(tmp_path)) == 1
+
+    import json
+
+    summary = {job["name"]: job for job in json.loads(summary_file.read_text())}
+    assert summary["linked"]["error"] is None and summary["embedded"]["error"] is None
+    assert "FileNotFoundError" in summary["broken"]["error"]
+    assert "render" in summary["linked"]["stages"]
+
+
+def test_sharded_reports_merge_into_the_whole_report(tmp_path, monkeypatch):
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummyMetadata:
+        def __init__(self, label):
+            self._label = label
+
+        def __call__(self):
+            return {"label": self._label}
+
+    dataset = [
+        {
+            "image": DummyImage(tmp_path / f"img{idx}.png"),
+            "metadata": DummyMetadata(label),
+        }
+        for idx, label in enumerate([1, 0, 1, 2, 0, 1, 1])
+    ]
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(pli_items, "PngImageItem", DummyImage)
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda _item: True)
+
+    for command, options in [
+        ("images_table_simple", ["--keys", "image"]),
+        ("images_clusters_simple", ["--max-per-cluster", "3"]),
+    ]:
+        base = [command, "--folder", str(tmp_path), *options]
+        shards = [str(tmp_path / f"{command}_{index}.zip") for index in range(3)]
+        for index, shard in enumerate(shards):
+            result = runner.invoke(
+                piter, base + ["--shard", f"{index}/3", "--output-file", shard]
+            )
+            assert result.exit_code == 0
+
+        merged = tmp_path / f"{command}_merged.html"
+        result = runner.invoke(
+            piter,
+            ["merge", "-i", shards[2], "-i", shards[0], "-i", shards[1]]
+            + ["--output-file", str(merged)],
+        )
+        assert result.exit_code == 0
+        html = merged.read_text()
+        if command == "images_table_simple":
+            whole = tmp_path / "whole.html"
+            runner.invoke(piter, base + ["--output-file", str(whole)])
+            assert html == whole.read_text()
+        else:
+            # the clusters in order of appearance, 1 sampled from 4 to 3 images
+            images = [html.index(f"img{idx}.png") for idx in (1, 4, 3)]
+            assert images == sorted(images)
+            assert "a sample of 3 out of 4 images" in html
+            assert html.count(".png") == 3 + 2 + 1
+
+    result = runner.invoke(piter, ["merge", "-i", shards[0]])
+    assert result.exit_code != 0
+
+
+def test_images_table_simple_renders_masks_and_arrays(tmp_path, monkeypatch):
+    np = pytest.importorskip("numpy")
+
+    class DummyItem:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummyImage(DummyItem):
+        pass
+
+    Image.new("RGB", (8, 8), "white").save(tmp_path / "image.png")
+    mask = np.zeros((8, 8), dtype=np.uint8)
+    mask[2:6, 2:6] = 1
+    Image.fromarray(mask).save(tmp_path / "mask.png")
+    np.save(tmp_path / "depth.npy", np.arange(64, dtype=np.float32).reshape(8, 8))
+    dataset = [
+        {
+            "image": DummyImage(tmp_path / "image.png"),
+            "mask": DummyImage(tmp_path / "mask.png"),
+            "depth": DummyItem(tmp_path / "depth.npy"),
+        }
+    ]
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(
+        cli_module, "_is_valid_image", lambda item: isinstance(item, DummyImage)
+    )
+    monkeypatch.setattr(cli_module, "_is_array_item", lambda item: True)
+
+    base = ["images_table_simple", "--folder", str(tmp_path)]
+    for key in ("image", "mask", "depth"):
+        base += ["--keys", key]
+
+    # without rendering the array is left out, masks are refused
+    output_file = tmp_path / "linked.html"
+    result = runner.invoke(piter, base + ["--output-file", str(output_file)])
+    assert result.exit_code == 0
+    assert "depth.npy" not in output_file.read_text()
+    result = runner.invoke(piter, base + ["--mask-keys", "mask"])
+    assert result.exit_code != 0
+
+    output_file = tmp_path / "rendered.html"
+    result = runner.invoke(
+        piter,
+        base
+        + ["--embed", "--mask-keys", "mask", "--colormap", "turbo"]
+        + ["--output-file", str(output_file)],
+    )
+    assert result.exit_code == 0
+    html = output_file.read_text()
+    # the image as it is, the mask losslessly (plus the favicon and the logo), the
+    # depth map colored
+    assert html.count("data:image/png") == 2 + 2
+    assert html.count("data:image/jpeg") == 1
+
+    result = runner.invoke(
+        piter,
+        base
+        + ["--embed", "--overlay", "mask:image", "--output-file", str(output_file)],
+    )
+    assert result.exit_code == 0
+    assert output_file.read_text().count("data:image/jpeg") == 2
+
+
+def test_images_clusters_simple_clusters_embeddings(tmp_path, monkeypatch):
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummyMetadata:
+        def __init__(self, embedding):
+            self._embedding = embedding
+
+        def __call__(self):
+            return {"embedding": self._embedding}
+
+    # two groups of embeddings, the first image of each is the farthest
+    embeddings = [[0.5, 0], [0.1, 0], [0, 0.1], [10, 10.5], [10, 10.1], [10.1, 10]]
+    dataset = [
+        {
+            "image": DummyImage(tmp_path / f"img{idx}.png"),
+            "metadata": DummyMetadata(embedding),
+        }
+        for idx, embedding in enumerate(embeddings)
+    ]
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(pli_items, "PngImageItem", DummyImage)
+
+    output_file = tmp_path / "clusters.html"
+    result = runner.invoke(
+        piter,
+        [
+            "images_clusters_simple",
+            "--folder",
+            str(tmp_path),
+            "--embedding-key",
+            "metadata.embedding",
+            "--num-clusters",
+            "2",
+            "--max-per-cluster",
+            "2",
+            "--output-file",
+            str(output_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    html = output_file.read_text()
+    # the members nearest to the centroids are kept, in order of distance
+    assert "img0.png" not in html and "img3.png" not in html
+    for group in (["img1.png", "img2.png"], ["img4.png", "img5.png"]):
+        assert all(name in html for name in group)
+    assert html.count("a sample of 2 out of 3 images") == 2
+
+    for num_clusters in ("0", "-1"):
+        result = runner.invoke(
+            piter,
+            [
+                "images_clusters_simple",
+                "--folder",
+                str(tmp_path),
+                "--embedding-key",
+                "metadata.embedding",
+                "--num-clusters",
+                num_clusters,
+            ],
+        )
+        assert result.exit_code != 0
+        assert "--num-clusters must be at least 1" in result.output
+
+
+def test_images_clusters_simple_packs_sprite_sheets(tmp_path, monkeypatch):
+    class DummyImage:
+        def __init__(self, path: Path):
+            self.local_sources = [path]
+
+    class DummyMetadata:
+        def __init__(self, label):
+            self._label = label
+
+        def __call__(self):
+            return {"label": self._label}
+
+    labels = [0, 1, 0, 0, 1, 0, 0]
+    dataset = []
+    for idx, label in enumerate(labels):
+        path = tmp_path / f"img{idx}.png"
+        Image.new("RGB", (40, 32), (idx * 30, 0, 0)).save(path)
+        dataset.append({"image": DummyImage(path), "metadata": DummyMetadata(label)})
+
+    monkeypatch.setattr(
+        pls_sequences.SamplesSequence,
+        "from_underfolder",
+        staticmethod(lambda _folder: dataset),
+    )
+    monkeypatch.setattr(pli_items, "PngImageItem", DummyImage)
+    monkeypatch.setattr(cli_module, "_is_valid_image", lambda item: True)
+
+    def run(*options):
+        return runner.invoke(
+            piter,
+            [
+                "images_clusters_simple",
+                "--folder",
+                str(tmp_path),
+                "--label-key",
+                "metadata.label",
+                "--output-file",
+                str(tmp_path / "clusters.html"),
+                "--atlas",
+                *options,
+            ],
+        )
+
+    # sheets of 16px thumbnails, at most 4 per sheet
+    result = run("--embed", "--thumb-size", "16", "--atlas-size", "40")
+
+    assert result.exit_code == 0, result.output
+    html = (tmp_path / "clusters.html").read_text()
+    # 5 members of cluster 0 in 2 sheets, 2 of cluster 1 in 1 sheet
+    assert html.count("data:image/jpeg") == 3
+    assert html.count('class="piter-sprite ') == len(labels)
+    assert "--sw: 40; --sh: 32;" in html  # 2 shelves of 2 thumbnails 20px wide
+    assert "--x: 20; --y: 16; --w: 20; --h: 16" in html
+
+    assert run("--embed").exit_code != 0  # no --thumb-size
+    assert run("--thumb-size", "16").exit_code != 0  # no --embed
+
+
+def test_metadata_values_keep_their_numbers():
+    import math
+
+    values = cli_module._purge_metadata(
+        {"a": 1, "b": 0.5, "c": float("nan"), "d": True, "e": [1]}
+    )
+    assert values["a"] == 1 and values["b"] == 0.5 and values["d"] is True
+    assert math.isnan(values["c"])
+    assert values["e"] == "[1]"
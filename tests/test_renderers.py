@@ -61,3 +61,398 @@ def test_global_params_footer_defaults_to_current_year():
     footer = GlobalParams().footnotes
 
     assert current_year in footer
+
+
+def test_images_table_simple_streams_lazy_rows(tmp_path):
+    consumed = []
+
+    def rows():
+        for idx in range(3):
+            consumed.append(idx)
+            yield {"image": f"img{idx}.png"}
+
+    params = ImagesTableSimpleParams(
+        keys=["image"], images=rows(), metadatas=({} for _ in range(3))
+    )
+    chunks = ImagesTableSimple().stream(params)
+
+    assert next(chunks)
+    assert consumed == []  # nothing is rendered before it is needed
+    html = "".join(chunks)
+    assert consumed == [0, 1, 2]
+    assert "img0.png" in html and "img2.png" in html
+
+
+def test_images_clusters_simple_dump_to_file(tmp_path):
+    params = ImagesClustersSimpleParams(
+        images_clusters={0: iter(["a.png", "b.png"]), 1: iter(["c.png"])},
+        labels_colors={0: "#ff0000", 1: "#00ff00"},
+    )
+    output = tmp_path / "clusters.html"
+
+    ImagesClustersSimple().dump(params, output)
+
+    html = output.read_text()
+    assert html == ImagesClustersSimple().render(
+        ImagesClustersSimpleParams(
+            images_clusters={0: ["a.png", "b.png"], 1: ["c.png"]},
+            labels_colors={0: "#ff0000", 1: "#00ff00"},
+        )
+    )
+    assert html.count("a.png") == 1
+
+
+def test_pagination_links_and_start_index():
+    from piter.renderers.html import Pagination
+
+    params = ImagesTableSimpleParams(
+        keys=["image"],
+        images=[{"image": "img.png"}],
+        metadatas=[{}],
+        start_index=41,
+        pagination=Pagination(
+            index="report.html", current=2, total=3, previous="report_001.html"
+        ),
+    )
+
+    html = ImagesTableSimple().render(params)
+
+    assert 'href="report.html"' in html
+    assert 'href="report_001.html"' in html
+    assert "Page 2 / 3" in html
+    assert "Next" not in html
+    assert "42" in html
+
+
+def test_dump_pages_in_parallel(tmp_path):
+    from piter.renderers.html import PageLink, PagesIndex, PagesIndexParams
+
+    pages = [
+        (
+            ImagesClustersSimpleParams(
+                images_clusters={idx: [f"img{idx}.png"]},
+                labels_colors={idx: "#ff0000"},
+            ),
+            tmp_path / f"page{idx}.html",
+        )
+        for idx in range(3)
+    ]
+    ImagesClustersSimple().dump_pages(pages, workers=2)
+    PagesIndex().dump(
+        PagesIndexParams(pages=[PageLink(label="First", url="page0.html", count=1)]),
+        tmp_path / "index.html",
+    )
+
+    for idx in range(3):
+        assert f"img{idx}.png" in (tmp_path / f"page{idx}.html").read_text()
+    assert 'href="page0.html"' in (tmp_path / "index.html").read_text()
+
+
+def _json_island(html: str, marker: str):
+    import json
+
+    start = html.index(">", html.index(marker)) + 1
+    return json.loads(html[start : html.index("</script>", start)])
+
+
+def test_images_table_simple_virtual_emits_json_rows():
+    params = ImagesTableSimpleParams(
+        keys=["image"],
+        images=[{"image": "img1.png"}, {"image": "</script>.png"}],
+        mkeys=["meta"],
+        metadatas=[{"meta": {"foo": "bar"}}, {"meta": {"foo": "baz"}}],
+        virtual=True,
+    )
+
+    html = ImagesTableSimple().render(params)
+
+    assert "<img" not in html.split('id="piter-viewport"')[1]
+    assert _json_island(html, 'class="piter-rows"') == [
+        [["img1.png"], {"meta": {"foo": "bar"}}],
+        [["</script>.png"], {"meta": {"foo": "baz"}}],
+    ]
+    assert _json_island(html, 'id="piter-config"')["keys"] == ["image"]
+
+
+def test_images_table_simple_emits_a_typed_metadata_index():
+    params = ImagesTableSimpleParams(
+        keys=["image"],
+        images=iter([{"image": "a.png"}, {"image": "b.png"}, {"image": "c.png"}]),
+        mkeys=["meta"],
+        metadatas=iter(
+            [
+                {"meta": {"score": 0.25, "name": "</script>"}},
+                {"meta": {"score": 2, "name": 1, "flag": True}},
+                {"meta": {"name": "c"}},
+            ]
+        ),
+    )
+
+    html = ImagesTableSimple().render(params)
+
+    assert _json_island(html, 'class="piter-index"') == {
+        "rows": 3,
+        "fields": [
+            {"name": "meta.score", "type": "number"},
+            {"name": "meta.name", "type": "string"},
+            {"name": "meta.flag", "type": "number"},
+        ],
+        "columns": [[0.25, 2, None], ["</script>", "1", "c"], [None, True, None]],
+    }
+    # the values are shown as before, floats with 4 decimals
+    assert ">0.2500</div>" in html and ">True</div>" in html
+    assert html.count('class="piter-row ') == 3
+
+
+@pytest.mark.parametrize("virtual", [False, True])
+def test_images_clusters_simple_renders_sprites_of_sheets(virtual):
+    from piter.utils.atlas import Sheet, Sprite
+
+    first, second = Sheet("data:first", 96, 64), Sheet("sheets/second.jpg", 48, 32)
+    sprites = [Sprite(first, 0, 0, 48, 32), Sprite(first, 48, 32, 48, 32)]
+    params = ImagesClustersSimpleParams(
+        images_clusters={0: iter(sprites), 1: iter([Sprite(second, 0, 0, 48, 32)])},
+        labels_colors={0: "#ff0000", 1: "#00ff00"},
+        virtual=virtual,
+        atlas=True,
+    )
+
+    html = ImagesClustersSimple().render(params)
+
+    # each sheet is written once, as the background of a class
+    assert html.count('url("data:first")') == 1
+    assert html.count('url("sheets/second.jpg")') == 1
+    assert "--sw: 96; --sh: 64;" in html
+    assert "<img" not in html.split("</nav>")[1]
+    if virtual:
+        island = html.split('class="cluster-data"')[1]
+        assert _json_island(island, "") == [
+            ["s0", 0, 0, 48, 32],
+            ["s0", 48, 32, 48, 32],
+        ]
+    else:
+        assert html.count('class="piter-sprite piter-sheet-s0 ') == 2
+        assert html.count('class="piter-sprite piter-sheet-s1 ') == 1
+        assert "--x: 48; --y: 32; --w: 48; --h: 32" in html
+
+
+def test_metadata_index_keeps_numeric_columns_with_non_finite_values():
+    params = ImagesTableSimpleParams(
+        keys=["image"],
+        images=[{"image": "a.png"}, {"image": "b.png"}, {"image": "c.png"}],
+        mkeys=["meta"],
+        metadatas=[
+            {"meta": {"score": 10}},
+            {"meta": {"score": float("nan")}},
+            {"meta": {"score": float("inf")}},
+        ],
+    )
+
+    html = ImagesTableSimple().render(params)
+
+    index = _json_island(html, 'class="piter-index"')
+    assert index["fields"] == [{"name": "meta.score", "type": "number"}]
+    assert index["columns"] == [[10, None, None]]
+    assert ">nan</div>" in html
+
+
+@pytest.mark.parametrize("mkeys", [[], ["meta"]])
+@pytest.mark.parametrize("virtual", [False, True])
+def test_data_islands_are_read_by_a_defined_helper(mkeys, virtual):
+    params = ImagesTableSimpleParams(
+        keys=["image"],
+        images=[{"image": "a.png"}],
+        mkeys=mkeys,
+        metadatas=[{"meta": {"score": 1.5}}],
+        virtual=virtual,
+    )
+
+    html = ImagesTableSimple().render(params)
+
+    islands = 'class="piter-index"' in html or 'class="piter-rows"' in html
+    assert islands == bool(mkeys or virtual)
+    assert ("async function readIsland" in html) == islands
+
+
+def test_images_clusters_simple_virtual_emits_json_clusters():
+    params = ImagesClustersSimpleParams(
+        images_clusters={0: iter(["a.png", "b.png"]), 1: iter(["c.png"])},
+        labels_colors={0: "#ff0000", 1: "#00ff00"},
+        virtual=True,
+    )
+
+    html = ImagesClustersSimple().render(params)
+
+    assert "<img" not in html.split("</nav>")[1]
+    assert 'data-color="#00ff00"' in html
+    first, second = html.split('class="cluster-data"')[1:]
+    assert _json_island('class="cluster-data"' + first, "cluster-data") == [
+        "a.png",
+        "b.png",
+    ]
+    assert _json_island('class="cluster-data"' + second, "cluster-data") == ["c.png"]
+
+
+def test_images_table_simple_compresses_json_rows(tmp_path):
+    import base64
+    import gzip
+    import json
+
+    rows = [{"meta": {"foo": "bar", "index": str(index)}} for index in range(200)]
+    params = ImagesTableSimpleParams(
+        keys=["image"],
+        images=[{"image": f"img{index}.png"} for index in range(200)],
+        mkeys=["meta"],
+        metadatas=rows,
+        virtual=True,
+        compress=True,
+    )
+
+    html = ImagesTableSimple().render(params)
+    plain = ImagesTableSimple().render(params.model_copy(update={"compress": False}))
+
+    assert len(html) < len(plain)
+    marker = 'data-encoding="gzip" class="piter-rows">'
+    payload = html.split(marker)[1].split("</script>")[0]
+    rows = json.loads(gzip.decompress(base64.b64decode(payload)))
+    assert rows[199] == [["img199.png"], {"meta": {"foo": "bar", "index": "199"}}]
+    assert "DecompressionStream" in html
+
+    ImagesTableSimple().dump(params, tmp_path / "report.html.gz")
+    with gzip.open(tmp_path / "report.html.gz", "rt", encoding="utf-8") as f:
+        assert f.read() == html
+
+
+def test_data_island_is_plain_when_compression_does_not_pay():
+    import base64
+    import json
+    import os
+
+    from piter.renderers.html import data_island
+
+    # random base64, like the data URL of a JPEG
+    value = json.dumps([base64.b64encode(os.urandom(3000)).decode()])
+    island = data_island(value, "piter-assets", compress=True)
+    assert "data-encoding" not in island and value in island
+
+
+def test_renderers_share_a_cached_environment():
+    from piter.renderers.html import get_environment
+
+    env = get_environment()
+    ImagesTableSimple().render(ImagesTableSimpleParams(images=[]))
+
+    assert get_environment() is env
+    assert env.get_template(TemplatesCollection.IMAGES_TABLE_SIMPLE) is (
+        env.get_template(TemplatesCollection.IMAGES_TABLE_SIMPLE)
+    )
+
+
+def test_precompiled_templates_and_bytecode_cache(tmp_path):
+    from piter.renderers.html import (
+        EnvironmentSettings,
+        compile_templates,
+        configure_environment,
+    )
+
+    params = ImagesClustersSimpleParams(
+        images_clusters={0: ["a.png"]}, labels_colors={0: "#ff0000"}
+    )
+    expected = ImagesClustersSimple().render(params)
+    compile_templates(tmp_path / "compiled")
+
+    try:
+        env = configure_environment(
+            EnvironmentSettings(
+                compiled_templates_dir=str(tmp_path / "compiled"),
+                bytecode_cache_dir=str(tmp_path / "bytecode"),
+            )
+        )
+        template = env.get_template(TemplatesCollection.IMAGES_CLUSTERS_SIMPLE)
+        assert template.filename is None or "compiled" in str(template.filename)
+        assert ImagesClustersSimple().render(params) == expected
+
+        # compiled from other sources, e.g. before the templates were edited
+        (tmp_path / "compiled" / "TEMPLATES_DIGEST").write_text("stale")
+        env = configure_environment(
+            EnvironmentSettings(compiled_templates_dir=str(tmp_path / "compiled"))
+        )
+        template = env.get_template(TemplatesCollection.IMAGES_CLUSTERS_SIMPLE)
+        assert template.filename == str(
+            templates_path() / TemplatesCollection.IMAGES_CLUSTERS_SIMPLE
+        )
+    finally:
+        configure_environment()
+
+
+def test_images_table_simple_references_deduplicated_assets():
+    from piter.utils.images import DataURLStore
+
+    store = DataURLStore()
+
+    def rows():
+        for url in ["data:a", "data:b", "data:a"]:
+            yield {"image": store.add(url)}
+
+    html = ImagesTableSimple().render(
+        ImagesTableSimpleParams(
+            keys=["image"], images=rows(), metadatas=[{}] * 3, assets=store
+        )
+    )
+
+    assert html.count('data-asset="a0"') == 2
+    assert html.count('data-asset="a1"') == 1
+    assert html.count("data:a") == 1 and html.count("data:b") == 1
+    assert "function assetUrl" in html
+
+
+def test_reports_inline_styles_for_every_template_class():
+    import re
+
+    from piter.renderers.html import css_escape
+
+    css = (templates_path() / "_styles.css").read_text()
+    classes = set()
+    for template in templates_path().glob("*.html"):
+        source = template.read_text()
+        # class attributes, plus the class names set by the scripts
+        for value in re.findall(r'class(?:Name)?\s*=\s*["`]([^"`]*)["`]', source):
+            value = re.sub(r"{{.*?}}", "{}", re.sub(r"{%.*?%}", " ", value))
+            classes.update(value.split())
+        for value in re.findall(r"classList\.(?:add|toggle)\(([^)]*)\)", source):
+            classes.update(re.findall(r'"([^"]+)"', value))
+
+    # hooks used by the scripts, and dynamic names with their own rules
+    hooks = re.compile(r"^(column-|button-|piter-|cluster-|resizable|group-divider)")
+    missing = [
+        name
+        for name in sorted(classes)
+        if not hooks.match(name)
+        and "{" not in name
+        and "$" not in name
+        and f".{css_escape(name)}" not in css
+    ]
+    assert missing == []
+
+
+def test_hidden_overrides_the_display_of_every_class():
+    import re
+
+    css = (templates_path() / "_styles.css").read_text()
+    hidden = css.index(".hidden {")
+    # same specificity, the last rule wins (e.g. hidden rows are also grids)
+    for rule in re.finditer(r"^\.[^{]+\{[^}]*display:", css, re.MULTILINE):
+        assert rule.start() <= hidden, rule.group(0)
+
+
+def test_images_clusters_simple_is_styled_offline():
+    params = ImagesClustersSimpleParams(
+        images_clusters={0: ["img0.png"], 1: ["img1.png"]},
+        labels_colors={0: "#f44336", 1: "#4caf50"},
+    )
+
+    html = ImagesClustersSimple().render(params)
+
+    assert "https://" not in html.split("</head>")[0]
+    assert ".border-\\[\\#f44336\\] { border-color: #f44336; }" in html
+    assert ".border-\\[\\#4caf50\\] { border-color: #4caf50; }" in html
@@ -0,0 +1,164 @@
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from piter.server import (
+    ClustersView,
+    ReportServer,
+    ReportView,
+    TableView,
+    ThumbnailCache,
+)
+
+
+class DummyImage:
+    def __init__(self, path: Path):
+        self.local_sources = [path]
+
+
+def _dataset(tmp_path, count):
+    dataset = []
+    for idx in range(count):
+        path = tmp_path / f"img{idx}.png"
+        Image.new("RGB", (64, 32), (idx * 40, 0, 0)).save(path)
+        dataset.append({"image": DummyImage(path), "label": idx % 2})
+    return dataset
+
+
+def test_thumbnail_cache_encodes_each_image_once(tmp_path, monkeypatch):
+    path = tmp_path / "img.png"
+    Image.new("RGB", (64, 32), "red").save(path)
+    cache = ThumbnailCache({"thumb_size": 16})
+    encoded = []
+    encode = cache._encode
+    monkeypatch.setattr(cache, "_encode", lambda p: encoded.append(p) or encode(p))
+
+    data, mime = cache.get(str(path))
+    assert cache.get(str(path)) == (data, mime)
+    assert mime == "image/png" and len(encoded) == 1
+    assert cache.hits == 1 and cache.misses == 1
+    cache.close()
+
+
+def test_thumbnail_cache_evicts_least_recently_used(tmp_path):
+    paths = []
+    for idx in range(3):
+        paths.append(str(tmp_path / f"img{idx}.png"))
+        Image.new("RGB", (64, 32), (idx * 80, 0, 0)).save(paths[-1])
+    cache = ThumbnailCache(max_size=1)
+    for path in paths:
+        cache.get(path)
+    assert list(cache._entries) == [cache.key(paths[-1])]
+    cache.close()
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(view):
+        server = ReportServer(("127.0.0.1", 0), view, ThumbnailCache())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _get(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read(), response.headers
+
+
+def test_report_server_serves_table_pages_and_images(tmp_path, serve):
+    read = []
+
+    def read_row(sample):
+        read.append(sample)
+        return ["image"], {}
+
+    view = TableView(_dataset(tmp_path, 5), ["image"], [], read_row, page_size=2)
+    url = serve(view)
+
+    html, _ = _get(url)  # redirected to the first page
+    assert b"/image/0/image" in html and b"/image/2/image" not in html
+    html, _ = _get(url + "page/3")
+    assert b"/image/4/image" in html
+    assert len(read) == 3  # only the rows of the served pages
+
+    data, headers = _get(url + "image/4/image")
+    assert headers["Content-Type"] == "image/png" and data.startswith(b"\x89PNG")
+    request = urllib.request.Request(
+        url + "image/4/image", headers={"If-None-Match": headers["ETag"]}
+    )
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request)
+    assert error.value.code == 304
+
+    for missing in ("page/4", "image/9/image", "image/0/other", "nothing"):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + missing)
+        assert error.value.code == 404
+
+
+def test_report_server_serves_only_valid_images(tmp_path, serve):
+    class DummyMetadata(DummyImage):
+        pass
+
+    dataset = _dataset(tmp_path, 2)
+    (tmp_path / "meta.yaml").write_text("label: 0\n")
+    (tmp_path / "corrupt.png").write_bytes(b"\x89PNG not really")
+    dataset[0]["metadata"] = DummyMetadata(tmp_path / "meta.yaml")
+    dataset[1]["image"] = DummyImage(tmp_path / "corrupt.png")
+
+    view = TableView(
+        dataset,
+        ["image", "metadata"],
+        [],
+        lambda sample: (["image"], {}),
+        is_image=lambda item: not isinstance(item, DummyMetadata),
+    )
+    url = serve(view)
+
+    data, _ = _get(url + "image/0/image")
+    assert data.startswith(b"\x89PNG")
+    for path, code in (("image/0/metadata", 404), ("image/1/image", 500)):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + path)
+        assert error.value.code == code
+    # the server is still up
+    assert _get(url + "image/0/image")[0] == data
+
+
+def test_report_server_serves_clusters(tmp_path, serve):
+    view = ClustersView(
+        _dataset(tmp_path, 5),
+        "image",
+        lambda sample: (sample["label"], "#ff0000"),
+        page_size=2,
+    )
+    url = serve(view)
+
+    index, _ = _get(url)
+    assert b"Cluster 0 (1/2)" in index and b"Cluster 1" in index
+    html, _ = _get(url + "page/2")
+    assert b"/image/4/image" in html and b"3 images" in html
+
+
+def test_report_views_must_implement_pages_and_images():
+    class PagesOnly(ReportView):
+        def page_count(self):
+            return 1
+
+        def render_page(self, number):
+            yield ""
+
+    with pytest.raises(TypeError, match="image_path"):
+        PagesOnly()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from piter.utils.arrays import (
+    colorize_labels,
+    colorize_values,
+    colormap_lut,
+    normalize,
+    render_source,
+)
+from piter.utils.images import ArraySource, ImageCache, label_to_color, pil_to_bytes
+
+
+def test_colormap_luts():
+    for name in ("viridis", "turbo", "gray"):
+        lut = colormap_lut(name)
+        assert lut.shape == (256, 3) and lut.dtype == np.uint8
+    assert colormap_lut("gray")[128].tolist() == [128, 128, 128]
+    # viridis goes from dark purple to yellow
+    assert colormap_lut("viridis")[0].tolist() == pytest.approx([68, 1, 84], abs=4)
+    assert colormap_lut("viridis")[255].tolist() == pytest.approx([253, 231, 37], abs=4)
+    with pytest.raises(ValueError):
+        colormap_lut("jet")
+
+
+def test_colorize_labels_uses_the_cluster_colors():
+    rgb = colorize_labels(np.array([[0, 1], [2, 17]]))
+    assert rgb[0, 0].tolist() == [0, 0, 0]
+    for (row, col), label in [((0, 1), 1), ((1, 0), 2), ((1, 1), 17)]:
+        hex_color = "#" + "".join(f"{c:02x}" for c in rgb[row, col])
+        assert label_to_color(label, format="hex") in (hex_color, hex_color[::2])
+
+
+def test_colorize_values_normalizes_the_finite_range():
+    values = np.array([[2.0, 4.0], [np.nan, 6.0]])
+    assert normalize(values).tolist() == [[0, 128], [0, 255]]
+    rgb = colorize_values(values, "gray")
+    assert rgb[:, :, 0].tolist() == [[0, 128], [0, 255]]
+    assert colorize_values(np.full((2, 2), 3.0)).shape == (2, 2, 3)
+
+
+def test_render_source_depth_mask_and_overlay(tmp_path):
+    depth = np.linspace(0, 1, 400 * 300, dtype=np.float32).reshape(400, 300)
+    np.save(tmp_path / "depth.npy", depth)
+    mask = np.zeros((400, 300), dtype=np.uint8)
+    mask[100:200, 100:200] = 3
+    Image.fromarray(mask).save(tmp_path / "mask.png")
+    Image.new("RGB", (300, 400), (255, 255, 255)).save(tmp_path / "image.png")
+
+    image = render_source(ArraySource(str(tmp_path / "depth.npy")), thumb_size=100)
+    assert image.mode == "RGB" and image.height == 100
+
+    source = ArraySource(str(tmp_path / "mask.png"), mode="mask")
+    rgb = np.asarray(render_source(source))
+    assert rgb[0, 0].tolist() == [0, 0, 0]
+    assert rgb[150, 150].tolist() == list(colorize_labels(np.array(3)))
+
+    overlaid = source._replace(overlay=str(tmp_path / "image.png"), alpha=0.5)
+    rgb = np.asarray(render_source(overlaid))
+    assert rgb[0, 0].tolist() == [255, 255, 255]
+    expected = (255 + colorize_labels(np.array(3)).astype(float)) / 2
+    assert rgb[150, 150].tolist() == pytest.approx(expected.tolist(), abs=1)
+
+
+def test_mask_thumbnails_keep_the_label_colors(tmp_path):
+    labels = np.arange(7 * 5, dtype=np.uint8).reshape(7, 5) % 4
+    Image.fromarray(np.kron(labels, np.ones((30, 30), np.uint8))).save(
+        tmp_path / "mask.png"
+    )
+    source = ArraySource(str(tmp_path / "mask.png"), mode="mask")
+    image = render_source(source, thumb_size=100)
+    assert image.height == 100
+    assert pil_to_bytes(image, thumb_size=100) == pil_to_bytes(image)
+
+    palette = {tuple(color) for color in colorize_labels(np.arange(4)).tolist()}
+    colors = {color for _, color in image.getcolors()}
+    assert colors <= palette and len(colors) == 4
+
+
+def test_source_key_depends_on_the_rendering(tmp_path):
+    np.save(tmp_path / "depth.npy", np.zeros((2, 2)))
+    source = ArraySource(str(tmp_path / "depth.npy"))
+    key = ImageCache.source_key(source, quality=50)
+    assert key == ImageCache.source_key(source, quality=50)
+    assert key != ImageCache.source_key(source._replace(colormap="turbo"), quality=50)
+    assert key != ImageCache.file_key(source.path, quality=50)
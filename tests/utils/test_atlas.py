@@ -0,0 +1,42 @@
+from PIL import Image
+
+from piter.utils.atlas import pack_sheet, sheet_capacity, shelf_pack
+
+
+def test_sheet_capacity():
+    assert sheet_capacity(64, 256) == 16
+    assert sheet_capacity(512, 256) == 1
+
+
+def test_shelf_pack_fills_shelves_in_order():
+    positions, width, height = shelf_pack([(40, 10), (50, 8), (30, 10)], 10, 100)
+    assert positions == [(0, 0), (40, 0), (0, 10)]
+    assert (width, height) == (90, 20)
+    # a rectangle wider than the sheet gets a shelf of its own
+    positions, width, height = shelf_pack([(20, 10), (150, 10)], 10, 100)
+    assert positions == [(0, 0), (0, 10)]
+    assert (width, height) == (150, 20)
+    assert shelf_pack([], 10, 100) == ([], 0, 0)
+
+
+def test_pack_sheet_places_the_thumbnails(tmp_path):
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+    paths = []
+    for index, (color, size) in enumerate(zip(colors, [(60, 40), (30, 20), (80, 80)])):
+        paths.append(str(tmp_path / f"img{index}.png"))
+        Image.new("RGB", size, color).save(paths[-1])
+    Image.new("L", (10, 10), 128).save(tmp_path / "gray.png")
+    paths.append(str(tmp_path / "gray.png"))
+
+    sheet, placements = pack_sheet(paths, thumb_size=20, atlas_size=64)
+
+    # tall images are downscaled to the thumbnail height, short ones are not
+    assert placements == [
+        (0, 0, 30, 20),
+        (30, 0, 30, 20),
+        (0, 20, 20, 20),
+        (20, 20, 10, 10),
+    ]
+    assert sheet.mode == "RGB" and sheet.size == (60, 40)
+    for (x, y, w, h), color in zip(placements, colors + [(128, 128, 128)]):
+        assert sheet.getpixel((x + w // 2, y + h // 2)) == color
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from piter.utils.clustering import assign, minibatch_kmeans
+
+
+def _blobs(count, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 10, size=(4, 16))
+    truth = rng.integers(0, 4, size=count)
+    points = centers[truth] + rng.normal(0, 0.5, size=(count, 16))
+    return points.astype(np.float32), truth
+
+
+def test_assign_matches_brute_force():
+    points, _ = _blobs(500)
+    centroids = points[:7]
+    labels, distances = assign(points, centroids, chunk_size=64)
+
+    brute = ((points[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    assert (labels == brute.argmin(axis=1)).all()
+    assert distances == pytest.approx(brute.min(axis=1), rel=1e-3, abs=1e-2)
+
+
+def test_minibatch_kmeans_recovers_blobs_reproducibly():
+    points, truth = _blobs(5000)
+    result = minibatch_kmeans(points, 4, seed=3, batch_size=256)
+
+    assert result.centroids.shape == (4, 16)
+    # each cluster is one of the blobs
+    for label in range(4):
+        assert len(set(truth[result.labels == label])) == 1
+    again = minibatch_kmeans(points, 4, seed=3, batch_size=256)
+    assert (again.labels == result.labels).all()
+
+
+def test_minibatch_kmeans_small_inputs():
+    result = minibatch_kmeans(np.eye(3), 10)
+    assert sorted(result.labels.tolist()) == [0, 1, 2]
+    assert result.distances == pytest.approx([0, 0, 0], abs=1e-6)
+    with pytest.raises(ValueError):
+        minibatch_kmeans(np.zeros((0, 4)), 2)
+    with pytest.raises(ValueError):
+        minibatch_kmeans(np.eye(3), 0)
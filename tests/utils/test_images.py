@@ -64,3 +64,173 @@ def test_label_to_color_rgba_raises_type_error():
 
 def test_color_rgb_to_hex():
     assert images.color_rgb_to_hex((255, 0, 0)) == "#ff0000"
+
+
+def test_image_cache_reuses_encoded_files(tmp_path, monkeypatch):
+    image_path = tmp_path / "sample.png"
+    Image.fromarray(np.zeros((4, 4, 3), dtype=np.uint8)).save(image_path)
+    cache = images.ImageCache(tmp_path / "cache")
+
+    first = images.image_file_to_base64_url(image_path, cache=cache)
+    monkeypatch.setattr(images, "numpy_to_base64_url", None)  # must not encode
+    second = images.image_file_to_base64_url(image_path, cache=cache)
+
+    assert first == second
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_image_cache_keys_depend_on_settings_and_content(tmp_path):
+    image_path = tmp_path / "sample.png"
+    Image.fromarray(np.zeros((4, 4, 3), dtype=np.uint8)).save(image_path)
+    key = images.ImageCache.file_key(image_path, quality=50)
+
+    assert key == images.ImageCache.file_key(image_path, quality=50)
+    assert key != images.ImageCache.file_key(image_path, quality=60)
+
+    Image.fromarray(np.ones((5, 5, 3), dtype=np.uint8)).save(image_path)
+    assert key != images.ImageCache.file_key(image_path, quality=50)
+
+
+def test_image_cache_numpy_arrays(tmp_path):
+    cache = images.ImageCache(tmp_path)
+    array = np.zeros((4, 4, 3), dtype=np.uint8)
+
+    first = images.numpy_to_base64_url(array, cache=cache)
+    second = images.numpy_to_base64_url(array.copy(), cache=cache)
+    images.numpy_to_base64_url(array + 1, cache=cache)
+
+    assert first == second
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_image_cache_prune_evicts_least_recently_used(tmp_path):
+    import os
+
+    cache = images.ImageCache(tmp_path, max_size=25)
+    for idx, key in enumerate(["aa1", "bb2", "cc3"]):
+        cache.put(key, "x" * 10)
+        os.utime(cache.root / key[:2] / key, ns=(idx, idx))
+    cache.get("aa1")  # most recently used now
+
+    assert cache.prune() == 1
+    assert cache.get("bb2") is None
+    assert cache.get("aa1") is not None and cache.get("cc3") is not None
+
+
+def test_image_file_to_base64_url_thumbnail_bounds_height(tmp_path):
+    image_path = tmp_path / "large.jpg"
+    Image.new("RGB", (800, 400), "red").save(image_path)
+
+    data_url = images.image_file_to_base64_url(image_path, thumb_size=100)
+
+    assert data_url.startswith("data:image/jpeg;base64,")
+    assert _decode_data_url_to_array(data_url).shape == (100, 200, 3)
+
+
+def test_image_file_to_base64_url_thumbnail_keeps_small_images(tmp_path):
+    array = np.array([[[255, 0, 0], [0, 255, 0]]], dtype=np.uint8)
+    image_path = tmp_path / "small.png"
+    Image.fromarray(array).save(image_path)
+
+    data_url = images.image_file_to_base64_url(image_path, thumb_size=100)
+
+    assert np.array_equal(_decode_data_url_to_array(data_url), array)
+
+
+def test_numpy_to_base64_url_thumbnail():
+    array = np.zeros((300, 30, 3), dtype=np.uint8)
+
+    data_url = images.numpy_to_base64_url(array, thumb_size=30)
+
+    assert _decode_data_url_to_array(data_url).shape == (30, 3, 3)
+
+
+def test_data_url_store_deduplicates_payloads():
+    store = images.DataURLStore()
+
+    first = store.add("data:image/png;base64,AAAA")
+    second = store.add("data:image/png;base64,BBBB")
+
+    assert store.add("data:image/png;base64,AAAA") == first != second
+    assert store.flush() == {
+        first: "data:image/png;base64,AAAA",
+        second: "data:image/png;base64,BBBB",
+    }
+    assert store.flush() == {}
+    assert (store.references, store.unique) == (3, 2)
+
+
+def test_data_url_store_resolves_identical_files(tmp_path):
+    store = images.DataURLStore()
+    first, copy, other = (tmp_path / name for name in ("a.bin", "b.bin", "c.bin"))
+    first.write_bytes(b"same")
+    copy.write_bytes(b"same")
+    other.write_bytes(b"diff")
+
+    assert store.source_id(first) is None
+    store.add_source(first, "a0")
+
+    assert store.source_id(copy) == "a0"
+    assert store.source_id(other) is None  # same size, different content
+
+    store.reset()
+    assert store.source_id(copy) is None
+
+
+def test_sniff_image_format():
+    assert images.sniff_image_format(b"\xff\xd8\xff\xe0" + b"\0" * 12) == "jpeg"
+    assert images.sniff_image_format(b"\x89PNG\r\n\x1a\n" + b"\0" * 8) == "png"
+    assert images.sniff_image_format(b"RIFF\0\0\0\0WEBPVP8 ") == "webp"
+    assert images.sniff_image_format(b"not an image....") is None
+
+
+def test_image_file_to_base64_url_passthrough_keeps_original_bytes(tmp_path):
+    # a PNG with a misleading extension is embedded as it is, with its real type
+    image_path = tmp_path / "sample.jpg"
+    Image.new("RGB", (40, 20), "blue").save(image_path, format="png")
+
+    data_url = images.image_file_to_base64_url(
+        image_path, passthrough_size=1 << 20, thumb_size=100
+    )
+
+    assert data_url == "data:image/png;base64," + base64.b64encode(
+        image_path.read_bytes()
+    ).decode("ascii")
+
+
+def test_image_file_to_base64_url_passthrough_thresholds(tmp_path, monkeypatch):
+    image_path = tmp_path / "sample.png"
+    Image.new("RGB", (40, 20), "blue").save(image_path)
+    encoded = []
+    original_encode = images.pil_to_bytes
+
+    def counting_encode(*args, **kwargs):
+        encoded.append(args[0].size)
+        return original_encode(*args, **kwargs)
+
+    monkeypatch.setattr(images, "pil_to_bytes", counting_encode)
+
+    images.image_file_to_base64_url(image_path, passthrough_size=1 << 20)
+    assert encoded == []
+
+    images.image_file_to_base64_url(image_path, passthrough_size=10)
+    too_tall = images.image_file_to_base64_url(
+        image_path, passthrough_size=1 << 20, thumb_size=10
+    )
+
+    assert encoded == [(40, 20), (40, 20)]
+    assert _decode_data_url_to_array(too_tall).shape == (10, 20, 3)
+
+
+def test_image_file_to_asset_writes_content_hashed_files(tmp_path):
+    first, copy = tmp_path / "a.png", tmp_path / "b.png"
+    Image.new("RGB", (40, 20), "blue").save(first)
+    Image.new("RGB", (40, 20), "blue").save(copy)
+    assets_dir = tmp_path / "assets"
+
+    name = images.image_file_to_asset(first, assets_dir, thumb_size=10)
+
+    assert images.image_file_to_asset(copy, assets_dir, thumb_size=10) == name
+    assert name.endswith(".png") and [p.name for p in assets_dir.iterdir()] == [name]
+    with Image.open(assets_dir / name) as image:
+        assert image.size == (20, 10)
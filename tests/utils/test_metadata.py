@@ -0,0 +1,63 @@
+import os
+
+from piter.utils.metadata import MetadataIndex
+
+
+class _Item:
+    def __init__(self, path):
+        self.local_sources = [path]
+
+
+def _dataset(folder, count):
+    samples = []
+    for index in range(count):
+        path = folder / f"{index:03d}_metadata.txt"
+        if not path.exists():
+            path.write_text(str(index))
+        samples.append({"metadata": _Item(path)})
+    return samples
+
+
+def _parse(parsed):
+    def fn(item):
+        parsed.append(item.local_sources[0].name)
+        return {"value": int(item.local_sources[0].read_text())}
+
+    return fn
+
+
+def test_metadata_index_parses_only_changed_files(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    index = MetadataIndex(tmp_path / "index.npz")
+    parsed = []
+    columns = {"meta": ("metadata", _parse(parsed))}
+
+    values = index.read(_dataset(data, 5), columns)
+    assert values["meta"] == [{"value": index} for index in range(5)]
+    assert len(parsed) == 5
+
+    parsed.clear()
+    index = MetadataIndex(tmp_path / "index.npz")
+    assert index.read(_dataset(data, 5), columns) == values
+    assert parsed == []
+    assert index.hits == 5 and index.misses == 0
+
+    changed = data / "002_metadata.txt"
+    changed.write_text("42")
+    stat = changed.stat()
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    values = index.read(_dataset(data, 6), columns)
+    assert sorted(parsed) == ["002_metadata.txt", "005_metadata.txt"]
+    assert values["meta"][2] == {"value": 42}
+    assert values["meta"][5] == {"value": 5}
+
+
+def test_metadata_index_missing_items_are_none(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    samples = _dataset(data, 2) + [{}]
+    index = MetadataIndex.in_folder(tmp_path / "index", data, ["metadata"])
+    values = index.read(samples, {"meta": ("metadata", _parse([]))})
+    assert values["meta"] == [{"value": 0}, {"value": 1}, None]
+    assert index.path.parent == tmp_path / "index"
@@ -0,0 +1,52 @@
+import os
+
+from piter.utils.parallel import ordered_map
+
+
+def _square(x):
+    return x * x
+
+
+def _pid(_x):
+    return os.getpid()
+
+
+def test_ordered_map_single_worker_matches_map():
+    assert list(ordered_map(_square, range(10), workers=1)) == [
+        x * x for x in range(10)
+    ]
+
+
+def test_ordered_map_keeps_input_order_with_workers():
+    assert list(ordered_map(_square, range(50), workers=3, window=4)) == [
+        x * x for x in range(50)
+    ]
+
+
+def test_ordered_map_runs_in_worker_processes():
+    pids = set(ordered_map(_pid, range(8), workers=2))
+    assert os.getpid() not in pids
+
+
+def test_ordered_map_consumes_input_lazily():
+    consumed = []
+
+    def source():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    results = ordered_map(_square, source(), workers=2, window=3)
+    assert next(results) == 0
+    assert len(consumed) <= 4
+    results.close()
+
+
+def test_shared_pool_reuses_the_worker_processes():
+    from piter.utils.parallel import shared_pool
+
+    with shared_pool(2):
+        first = set(ordered_map(_pid, range(8), workers=2))
+        second = set(ordered_map(_pid, range(8), workers=2))
+    assert os.getpid() not in first | second
+    assert len(first | second) <= 2
@@ -0,0 +1,66 @@
+import json
+import time
+
+from piter.utils import profiling
+from piter.utils.parallel import ordered_map
+
+
+def _measured_square(x):
+    with profiling.stage("square", nbytes=x):
+        return x * x
+
+
+def test_stage_is_a_no_op_when_not_profiling():
+    assert profiling.active_profiler() is None
+    with profiling.stage("anything") as measure:
+        measure.bytes = 10
+    assert profiling.active_profiler() is None
+
+
+def test_nested_stages_measure_total_and_self_time():
+    with profiling.profiling(profiling.Profiler()) as profiler:
+        with profiling.stage("outer"):
+            with profiling.stage("inner", nbytes=100):
+                time.sleep(0.02)
+            with profiling.stage("inner") as measure:
+                measure.bytes = 50
+
+    outer, inner = profiler.stats["outer"], profiler.stats["inner"]
+    assert (inner.calls, inner.bytes) == (2, 150)
+    assert outer.total >= inner.total >= 0.02
+    assert outer.self_time < outer.total - 0.015
+    assert [row["stage"] for row in profiler.summary()] == ["inner", "outer"]
+    assert profiling.active_profiler() is None
+
+
+def test_worker_stages_are_merged(tmp_path):
+    with profiling.profiling(profiling.Profiler(trace=True)) as profiler:
+        results = list(ordered_map(_measured_square, range(6), workers=2))
+
+    assert results == [x * x for x in range(6)]
+    assert (profiler.stats["square"].calls, profiler.stats["square"].bytes) == (6, 15)
+    assert profiler.stats["wait"].calls == 6
+
+    profiler.write_json(tmp_path / "profile.json")
+    profiler.write_trace(tmp_path / "trace.json")
+    summary = json.loads((tmp_path / "profile.json").read_text())
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert {row["stage"] for row in summary["stages"]} == {"square", "wait"}
+    assert len([event for event in events if event["name"] == "square"]) == 6
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+def test_peak_rss_without_the_resource_module(monkeypatch):
+    import sys
+
+    assert profiling._peak_rss_mb() > 0
+    # as on Windows, where psutil is used if installed
+    monkeypatch.setitem(sys.modules, "resource", None)
+    profiling._peak_rss_reader.cache_clear()
+    try:
+        assert profiling._peak_rss_mb() >= 0
+        monkeypatch.setitem(sys.modules, "psutil", None)
+        profiling._peak_rss_reader.cache_clear()
+        assert profiling._peak_rss_mb() == 0.0
+    finally:
+        profiling._peak_rss_reader.cache_clear()
@@ -0,0 +1,55 @@
+from piter.utils.sampling import Reservoir, merge_samples
+
+
+def _sample(size, count, seed):
+    reservoir = Reservoir(size, seed=seed)
+    for item in range(count):
+        reservoir.add(item)
+    return reservoir
+
+
+def test_reservoir_keeps_short_streams_whole():
+    reservoir = _sample(10, 4, seed=0)
+    assert reservoir.items == [0, 1, 2, 3]
+    assert reservoir.count == 4
+
+
+def test_reservoir_sample_is_bounded_ordered_and_reproducible():
+    reservoir = _sample(10, 1000, seed=7)
+    assert reservoir.count == 1000
+    assert len(reservoir.items) == 10
+    assert reservoir.items == sorted(reservoir.items)
+    assert _sample(10, 1000, seed=7).items == reservoir.items
+    assert _sample(10, 1000, seed=8).items != reservoir.items
+
+
+def test_reservoir_sample_is_uniform():
+    hits = [0] * 20
+    for seed in range(2000):
+        for item in _sample(5, 20, seed).items:
+            hits[item] += 1
+    # every item is kept with probability 5/20
+    assert all(400 < count < 600 for count in hits)
+
+
+def test_merge_samples_keeps_short_streams_whole():
+    assert merge_samples([(2, 2), (3, 3)], 10) == [[0, 1], [0, 1, 2]]
+
+
+def test_merge_samples_is_bounded_and_uniform():
+    hits = [0] * 30
+    for seed in range(2000):
+        # streams of 10, 15 and 5 items, sampled to at most 5 items each
+        streams = [
+            _sample(5, count, seed=f"{seed}:{n}") for n, count in enumerate([10, 15, 5])
+        ]
+        kept = merge_samples([(s.count, len(s.items)) for s in streams], 5, seed=seed)
+        assert sum(len(positions) for positions in kept) == 5
+        offset = 0
+        for reservoir, positions in zip(streams, kept):
+            assert positions == sorted(positions)
+            for position in positions:
+                hits[offset + reservoir.items[position]] += 1
+            offset += reservoir.count
+    # every item is kept with probability 5/30
+    assert all(250 < count < 420 for count in hits)
@@ -0,0 +1,72 @@
+import pytest
+
+from piter.utils.shards import (
+    Shard,
+    ShardWriter,
+    load_shards,
+    parse_shard,
+    rebase_url,
+    shard_range,
+)
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for value in ("4/4", "-1/4", "1", "a/b", "0/0"):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_shard_ranges_cover_the_sequence_in_order():
+    for length in (0, 3, 10, 101):
+        positions = [p for i in range(4) for p in shard_range(length, i, 4)]
+        assert positions == list(range(length))
+
+
+def test_rebase_url(tmp_path):
+    shard_dir, report_dir = tmp_path / "shards", tmp_path / "reports"
+    assert rebase_url("assets/a%20b.jpg", shard_dir, report_dir) == (
+        "../shards/assets/a%20b.jpg"
+    )
+    assert rebase_url("data:image/png;base64,AA", shard_dir, report_dir).startswith(
+        "data:"
+    )
+    assert rebase_url("/data/img.png", shard_dir, report_dir) == "/data/img.png"
+
+
+def _write(path, index, count=2, **settings):
+    with ShardWriter(path, {"count": count, **settings}, index) as writer:
+        writer.header["rows"] = writer.write("rows.jsonl", [[index, "a"], [index, 1]])
+
+
+def test_shards_roundtrip_and_are_validated(tmp_path):
+    for index in (1, 0):
+        _write(tmp_path / f"{index}.zip", index)
+
+    shards = load_shards([tmp_path / "1.zip", tmp_path / "0.zip"])
+    assert [shard.index for shard in shards] == [0, 1]
+    assert shards[1].header["rows"] == 2
+    assert list(shards[1].records("rows.jsonl")) == [[1, "a"], [1, 1]]
+    assert list(shards[1].records("missing.jsonl")) == []
+
+    with pytest.raises(ValueError):
+        load_shards([tmp_path / "0.zip"])
+    _write(tmp_path / "other.zip", 1, title="Other")
+    with pytest.raises(ValueError):
+        load_shards([tmp_path / "0.zip", tmp_path / "other.zip"])
+    (tmp_path / "bad.zip").write_text("not a shard")
+    with pytest.raises(ValueError):
+        Shard(tmp_path / "bad.zip")
+
+
+def test_failed_shards_leave_no_artifact(tmp_path):
+    with pytest.raises(RuntimeError):
+        with ShardWriter(tmp_path / "0.zip", {"count": 1}, 0) as writer:
+            writer.write("rows.jsonl", [[0, "a"]])
+            raise RuntimeError("a corrupt image")
+    assert list(tmp_path.iterdir()) == []
+
+    # a header without rows or clusters
+    ShardWriter(tmp_path / "0.zip", {"count": 1}, 0).close()
+    with pytest.raises(ValueError, match="incomplete"):
+        load_shards([tmp_path / "0.zip"])